@@ -24,6 +24,7 @@ const TMP_MUSIC_DATA_JSON_FILEPATH := "tmp_music_data.json"
             _music_data_dict = Utils.json_to_dict(_music_data).v
 
 ## checksum of musicxml data that was used to compute the current music_data. if checksum of input_music_data_filepath matches, no need to re-compute.
+## the python side writes the same SHA-256 to its output's source.musicxml_sha256. its parse cache key adds the parser and its version to it, so a parse run here for an already-seen file is still cheap.
 @export_storage var _input_music_data_checksum: PackedByteArray = []:
     set(val):
         print_verbose("setting _input_music_data_checksum = %s" % val.hex_encode())
@@ -158,6 +159,11 @@ func _parse_input_music_data(input_path: String) -> JSON:
     return music_data
 
 
+## extra parser flags controlling the python-side parse cache
+func _parse_cache_flags() -> String:
+    return "--no-parse-cache" if DISABLE_CACHING else ""
+
+
 func _invoke_python_win(input_path: String) -> Array[String]:
     # Invoke Command Prompt to:
     # 1) load python virtual environment, then
@@ -165,7 +171,7 @@ func _invoke_python_win(input_path: String) -> Array[String]:
     var output: Array[String] = []
     var cmd_to_execute = """\
 		..\\.venv-win\\Scripts\\activate.bat \
-        && python3 ..\\renderer\\main.py --music-data-file \"%s\" \"%s\"""" % [TMP_MUSIC_DATA_JSON_FILEPATH, input_path]
+        && python3 ..\\renderer\\main.py %s --music-data-file \"%s\" \"%s\"""" % [_parse_cache_flags(), TMP_MUSIC_DATA_JSON_FILEPATH, input_path]
     print_verbose("Invoking external python script on Windows via `CMD.exe`, please wait...")
     print_verbose("command: %s" % cmd_to_execute)
     OS.execute("CMD.exe", ["/C", cmd_to_execute], output, true)
@@ -176,7 +182,7 @@ func _invoke_python_mac(input_path: String) -> Array[String]:
     var output: Array[String] = []
     var cmd_to_execute = """\
 		source ../.venv/bin/activate \
-        && python3 ../renderer/main.py --music-data-file \'%s\' \'%s\'""" % [TMP_MUSIC_DATA_JSON_FILEPATH, input_path]
+        && python3 ../renderer/main.py %s --music-data-file \'%s\' \'%s\'""" % [_parse_cache_flags(), TMP_MUSIC_DATA_JSON_FILEPATH, input_path]
     print_verbose("Invoking external python script on Mac via `/bin/sh`, please wait...")
     print_verbose("command: %s" % cmd_to_execute)
     OS.execute("/bin/sh", ["-c", cmd_to_execute], output, true)
@@ -0,0 +1,362 @@
+# standard lib
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, asdict, field, replace
+from enum import Enum
+from pathlib import Path
+
+# project files
+from export_json import MusicDataSource
+from main import ProcessStage, _write_atomically
+from musicxml import PARSER_VERSION, ExportLayout, ScoreParser
+from timing import DEFAULT_EXTRA_START_TIME_SEC, DEFAULT_TEMPO_CURVE, TempoCurve, resolve_timing
+from parse_cache import (
+    DEFAULT_PARSE_CACHE_DIR,
+    DEFAULT_PARSE_CACHE_MAX_MB,
+    ParseCache,
+    cached_parse_score_data,
+    musicxml_sha256,
+)
+
+# log setup
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+DEFAULT_MUSIC_DATA_JSON_FILENAME = "music_data.json"
+DEFAULT_JSON_INDENT = "  "
+DEFAULT_BATCH_OUTPUT_DIR = Path("./batch_output")
+BATCH_SUMMARY_FILENAME = "summary.json"
+MUSICXML_SUFFIXES = (".musicxml",)
+
+
+# --------------------BATCH CONTROL FLOW--------------------
+# parse (and time) a whole catalog of scores in one go, so python/music21 startup
+# is paid once per worker instead of once per file.
+
+
+class BatchStage(Enum):
+    # the stages of main.ProcessStage that don't need manim
+    parse_score = "parse_score"
+    timing = "timing"
+
+    def __str__(self):
+        return self.name
+
+
+@dataclass
+class BatchJob:
+    musicxml_file: Path
+    music_data_file: Path
+    stage: BatchStage
+    parser: ScoreParser
+    parse_cache_dir: Path | None  # None disables the parse cache
+    parse_cache_max_bytes: int
+    json_indent: str | None  # None for compact JSON
+    json_layout: ExportLayout = ExportLayout.full
+    extra_start_time_sec: float = DEFAULT_EXTRA_START_TIME_SEC
+    tempo_curve: TempoCurve = DEFAULT_TEMPO_CURVE
+
+
+@dataclass
+class BatchResult:
+    musicxml_file: str
+    music_data_file: str | None = None
+    parse_sec: float = 0.0
+    timing_sec: float = 0.0
+    total_sec: float = 0.0
+    error: str | None = None
+    traceback: str | None = field(default=None, repr=False)
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def process_batch_job(job: BatchJob) -> BatchResult:
+    """Run one score through the requested stages and write its music data json.
+    Never raises, failures are reported in the result."""
+    result = BatchResult(musicxml_file=str(job.musicxml_file))
+    start = time.perf_counter()
+    try:
+        parse_cache = (
+            ParseCache(job.parse_cache_dir, job.parse_cache_max_bytes)
+            if job.parse_cache_dir is not None
+            else None
+        )
+        musicxml_data = job.musicxml_file.read_bytes()
+        music_data = cached_parse_score_data(musicxml_data, parse_cache, parser=job.parser)
+        result.parse_sec = time.perf_counter() - start
+        # the same header main.py writes, so main can resume from a batch output
+        source = MusicDataSource(
+            musicxml_sha256=musicxml_sha256(musicxml_data),
+            parser=str(job.parser),
+            parser_version=PARSER_VERSION,
+            stage=ProcessStage.parse_score.name,
+        )
+
+        if job.stage == BatchStage.timing:
+            timing_start = time.perf_counter()
+            resolve_timing(music_data, job.extra_start_time_sec, job.tempo_curve)
+            result.timing_sec = time.perf_counter() - timing_start
+            source = replace(
+                source,
+                stage=ProcessStage.timing.name,
+                extra_start_time_sec=job.extra_start_time_sec,
+                tempo_curve=str(job.tempo_curve),
+            )
+
+        job.music_data_file.parent.mkdir(parents=True, exist_ok=True)
+        _write_atomically(
+            job.music_data_file,
+            "w",
+            lambda f: music_data.export_to(f, job.json_indent, job.json_layout, source),
+        )
+        result.music_data_file = str(job.music_data_file)
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+        result.traceback = traceback.format_exc()
+    result.total_sec = time.perf_counter() - start
+    return result
+
+
+def find_musicxml_files(inputs: list[str]) -> list[Path]:
+    """Expand each input (a musicxml file, a directory of them, or a glob) into a sorted, de-duplicated list."""
+    found: dict[Path, None] = {}
+    for input_arg in inputs:
+        path = Path(input_arg)
+        if path.is_dir():
+            matches = sorted(
+                p for p in path.rglob("*") if p.suffix.lower() in MUSICXML_SUFFIXES
+            )
+        elif path.is_file():
+            matches = [path]
+        else:
+            matches = sorted(
+                p
+                for p in map(Path, glob.glob(input_arg, recursive=True))
+                if p.is_file() and p.suffix.lower() in MUSICXML_SUFFIXES
+            )
+            if not matches:
+                logger.warning(f"no musicxml files match {input_arg}")
+        for match in matches:
+            found.setdefault(match.resolve(), None)
+    return list(found)
+
+
+def music_data_files_for(musicxml_files: list[Path], output_dir: Path) -> list[Path]:
+    """One `<output_dir>/<score name>/music_data.json` per input, numbering scores that share a name."""
+    used_names: set[str] = set()
+    outputs: list[Path] = []
+    for musicxml_file in musicxml_files:
+        name = musicxml_file.stem
+        idx = 2
+        while name in used_names:
+            name = f"{musicxml_file.stem}-{idx}"
+            idx += 1
+        used_names.add(name)
+        outputs.append(output_dir / name / DEFAULT_MUSIC_DATA_JSON_FILENAME)
+    return outputs
+
+
+def run_batch(jobs: list[BatchJob], workers: int) -> list[BatchResult]:
+    """Process all jobs across a pool of worker processes. Results are in the same order as `jobs`."""
+    results: list[BatchResult | None] = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for idx, job in enumerate(jobs):
+            try:
+                futures[pool.submit(process_batch_job, job)] = idx
+            except Exception as e:
+                # the pool broke before every job got in, see below
+                results[idx] = _failed_result(job, e)
+        for future in as_completed(futures):
+            idx = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # process_batch_job never raises, so this is the pool itself failing, e.g. BrokenProcessPool
+                # when a worker is killed (out of memory) or crashes in native code. one such crash fails
+                # every job still pending, but the ones already done keep their results.
+                result = _failed_result(jobs[idx], e)
+            results[idx] = result
+            if result.ok:
+                logger.info(f"done {result.musicxml_file} in {result.total_sec:.2f}s")
+            else:
+                logger.error(f"failed {result.musicxml_file}: {result.error}")
+    return [r for r in results if r is not None]
+
+
+def _failed_result(job: BatchJob, e: Exception) -> BatchResult:
+    return BatchResult(
+        musicxml_file=str(job.musicxml_file),
+        error=f"{type(e).__name__}: {e}",
+        traceback="".join(traceback.format_exception(e)),
+    )
+
+
+def format_summary(results: list[BatchResult], wall_sec: float) -> str:
+    name_width = max([len(Path(r.musicxml_file).name) for r in results] + [4])
+    lines = [
+        f"{'file':{name_width}}  {'status':6}  {'parse':>7}  {'timing':>7}  {'total':>7}",
+    ]
+    for r in results:
+        lines.append(
+            f"{Path(r.musicxml_file).name:{name_width}}  {'ok' if r.ok else 'FAILED':6}  "
+            f"{r.parse_sec:6.2f}s  {r.timing_sec:6.2f}s  {r.total_sec:6.2f}s"
+            + ("" if r.ok else f"  {r.error}")
+        )
+    failed = sum(1 for r in results if not r.ok)
+    lines.append(
+        f"{len(results) - failed}/{len(results)} succeeded, {failed} failed, "
+        f"{sum(r.total_sec for r in results):.2f}s of work in {wall_sec:.2f}s"
+    )
+    return "\n".join(lines)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog="harmonimation-batch",
+        description="Parse (and time) many musicxml files at once, writing one music data JSON per file",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "inputs",
+        nargs="+",
+        help="musicxml files, directories to search for them, or glob patterns (quote them to keep the shell from expanding)",
+    )
+    parser.add_argument(
+        '-o',
+        '--output-dir',
+        type=Path,
+        help=f"Directory to write <score name>/{DEFAULT_MUSIC_DATA_JSON_FILENAME} and {BATCH_SUMMARY_FILENAME} into",
+        default=DEFAULT_BATCH_OUTPUT_DIR,
+    )
+    parser.add_argument(
+        '--compact-json',
+        action='store_true',
+        help="Write music data JSON without indentation or whitespace",
+    )
+    parser.add_argument(
+        '--json-layout',
+        type=ExportLayout,
+        choices=list(ExportLayout),
+        default=ExportLayout.full,
+        help="Music data JSON layout. normalized writes pitches, chords and keys once in tables and refers to them by index",
+    )
+    parser.add_argument(
+        '-s',
+        '--stage',
+        type=BatchStage,
+        choices=list(BatchStage),
+        default=BatchStage.timing,
+        help="Processing stage to stop after."
+    )
+    parser.add_argument(
+        '--extra-start-time',
+        type=float,
+        help="Seconds before the first beat (stage timing)",
+        default=DEFAULT_EXTRA_START_TIME_SEC,
+    )
+    parser.add_argument(
+        '--tempo-curve',
+        type=TempoCurve,
+        choices=list(TempoCurve),
+        default=DEFAULT_TEMPO_CURVE,
+        help="How the tempo changes over an accel. or rit. (stage timing)",
+    )
+    parser.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        help="Number of worker processes",
+        default=os.cpu_count() or 1,
+    )
+    parser.add_argument(
+        '-p',
+        '--parser',
+        type=ScoreParser,
+        choices=list(ScoreParser),
+        default=ScoreParser.music21,
+        help="Musicxml reader to use",
+    )
+    parser.add_argument(
+        '--no-parse-cache',
+        action='store_true',
+        help="Always re-parse the musicxml files instead of reusing cached parse results",
+    )
+    parser.add_argument(
+        '--parse-cache-dir',
+        type=Path,
+        help="Directory for cached parse results, keyed by musicxml content hash",
+        default=DEFAULT_PARSE_CACHE_DIR,
+    )
+    parser.add_argument(
+        '--parse-cache-max-mb',
+        type=float,
+        help="Maximum total size of the parse cache; least recently used entries are evicted past this",
+        default=DEFAULT_PARSE_CACHE_MAX_MB,
+    )
+    return parser.parse_args()
+
+
+def main():
+    # use UTF-8 output encoding
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    args = parse_args()
+    musicxml_files = find_musicxml_files(args.inputs)
+    if not musicxml_files:
+        logger.error("no musicxml files found")
+        sys.exit(2)
+
+    jobs = [
+        BatchJob(
+            musicxml_file=musicxml_file,
+            music_data_file=music_data_file,
+            stage=args.stage,
+            parser=args.parser,
+            parse_cache_dir=None if args.no_parse_cache else args.parse_cache_dir,
+            parse_cache_max_bytes=int(args.parse_cache_max_mb * 1024 * 1024),
+            json_indent=None if args.compact_json else DEFAULT_JSON_INDENT,
+            json_layout=args.json_layout,
+            extra_start_time_sec=args.extra_start_time,
+            tempo_curve=args.tempo_curve,
+        )
+        for musicxml_file, music_data_file in zip(
+            musicxml_files, music_data_files_for(musicxml_files, args.output_dir)
+        )
+    ]
+    workers = max(1, min(args.workers, len(jobs)))
+    logger.info(f"processing {len(jobs)} musicxml files with {workers} workers")
+
+    start = time.perf_counter()
+    results = run_batch(jobs, workers)
+    wall_sec = time.perf_counter() - start
+
+    print(format_summary(results, wall_sec))
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    with open(args.output_dir / BATCH_SUMMARY_FILENAME, 'w') as f:
+        json.dump(
+            {
+                "stage": str(args.stage),
+                "parser": str(args.parser),
+                "wall_sec": wall_sec,
+                "results": [asdict(r) for r in results],
+            },
+            f,
+            indent=2,
+        )
+
+    if any(not r.ok for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+# std library
+import io
+import json
+import mmap
+from copy import copy
+from pathlib import Path
+from typing import Any, BinaryIO
+
+# 3rd party library
+import numpy as np
+from music21 import converter
+from music21.stream import Score
+
+# project files
+from export_json import key_name, key_pitch, part_name
+from musicxml import MusicData, MusicDataTiming
+from utils import display_chord_short_custom, get_key_mask
+
+# binary version of MusicData's JSON export, for readers that want to memory map it and look up events by index
+# instead of parsing the whole thing.
+#
+# layout (all little-endian):
+#   header: magic b"HRMN", u16 format version, u16 table count
+#   table directory, one entry per table: 4-byte tag, u32 byte offset from file start, u32 row count, u32 row size
+#   tables, each starting on an 8-byte boundary, of fixed-width rows laid out like `TABLES` below
+#   (C struct alignment, i.e. numpy's align=True)
+# strings (names, types, lyric text) are indices into the string table: STRO holds row count + 1 u32 offsets
+# into STRD, the utf-8 bytes of every string back to back. NO_STRING stands for null.
+# bump FORMAT_VERSION whenever a table changes; readers should refuse versions newer than they know.
+
+MAGIC = b"HRMN"
+FORMAT_VERSION = 3
+NO_STRING = 0xFFFFFFFF
+NO_PITCH_CLASS = 0xFF  # pitch_class of a missing pitch (chord roots of chords with no root)
+TABLE_ALIGNMENT = 8
+
+_HEADER = np.dtype([("magic", "S4"), ("version", "<u2"), ("table_count", "<u2")])
+_TABLE_ENTRY = np.dtype(
+    [("tag", "S4"), ("offset", "<u4"), ("rows", "<u4"), ("row_size", "<u4")]
+)
+
+# every timed row starts with these. type is the timing's "_type", e.g. "MusicDataTiming[Chord]"
+_TIMING_FIELDS = [("offset", "<f8"), ("time", "<f8"), ("type", "<u4")]  # time is NaN until timed
+_PITCH_FIELDS = [("pitch_class", "u1"), ("pitch_name", "<u4")]
+
+TABLES: dict[bytes, np.dtype] = {
+    # one row: everything that isn't a list of events
+    b"META": np.dtype(
+        [
+            ("bpm", "<f8"),
+            ("comments", "<u4"),  # as a JSON string
+            ("type", "<u4"),
+            ("all_notes", "<u4"),  # NOTE rows [0, all_notes) are `all_notes`, any after only appear in a part
+        ],
+        align=True,
+    ),
+    b"NOTE": np.dtype(_TIMING_FIELDS + [("quarter_length", "<f8")] + _PITCH_FIELDS, align=True),
+    # `all_notes_by_part`: the notes of each part are NOTE rows listed at PNOT[first, first + count)
+    b"PART": np.dtype([("name", "<u4"), ("first", "<u4"), ("count", "<u4")], align=True),
+    b"PNOT": np.dtype([("note", "<u4")]),
+    # chord notes are CPIT[first_pitch, first_pitch + pitch_count)
+    b"CHRD": np.dtype(
+        _TIMING_FIELDS
+        + [
+            ("quarter_length", "<f8"),
+            ("name", "<u4"),
+            ("first_pitch", "<u4"),
+            ("pitch_count", "<u4"),
+        ],
+        align=True,
+    ),
+    b"CPIT": np.dtype(_PITCH_FIELDS, align=True),
+    b"ROOT": np.dtype(_TIMING_FIELDS + _PITCH_FIELDS, align=True),
+    # lyric words, with their syllables at SYLL[first_syllable, first_syllable + syllable_count)
+    b"WORD": np.dtype(
+        _TIMING_FIELDS + [("first_syllable", "<u4"), ("syllable_count", "<u4")], align=True
+    ),
+    b"SYLL": np.dtype(_TIMING_FIELDS + [("text", "<u4")], align=True),
+    b"KEYS": np.dtype(
+        _TIMING_FIELDS
+        + [("name", "<u4"), ("quality", "<u4"), ("pitch_mask", "<u2")]  # pitch_mask: bit n = pitch class n
+        + _PITCH_FIELDS,
+        align=True,
+    ),
+    # tempo changes, see MusicData.tempos. not in version 1
+    b"TMPO": np.dtype(_TIMING_FIELDS + [("bpm", "<f8")], align=True),
+    # accel. and rit. up to the tempo `bpm`, see MusicData.tempo_ramps. not before version 3
+    b"RAMP": np.dtype(_TIMING_FIELDS + [("quarter_length", "<f8"), ("bpm", "<f8")], align=True),
+    b"STRO": np.dtype([("offset", "<u4")]),
+    b"STRD": np.dtype([("byte", "u1")]),
+}
+
+
+class _StringTable:
+    def __init__(self):
+        self.indices: dict[str, int] = {}
+
+    def add(self, s: str | None) -> int:
+        if s is None:
+            return NO_STRING
+        return self.indices.setdefault(s, len(self.indices))
+
+    def tables(self) -> tuple[np.ndarray, np.ndarray]:
+        encoded = [s.encode("utf-8") for s in self.indices]
+        offsets = np.zeros(len(encoded) + 1, dtype=TABLES[b"STRO"])
+        offsets["offset"][1:] = np.cumsum([len(b) for b in encoded], dtype=np.uint64)
+        data = np.frombuffer(b"".join(encoded), dtype=TABLES[b"STRD"])
+        return offsets, data
+
+
+def export_music_data_binary(music_data: MusicData, out: BinaryIO) -> None:
+    # plain lists, with timings shared between lists still shared
+    music_data = copy(music_data)
+    music_data.materialize()
+    strings = _StringTable()
+
+    def timing(t: MusicDataTiming) -> tuple:
+        return (
+            float(t.offset),
+            float(t.time) if t.time is not None else np.nan,
+            strings.add(t._type),
+        )
+
+    def pitch(p) -> tuple:
+        if p is None:
+            return (NO_PITCH_CLASS, NO_STRING)
+        return (p.pitchClass, strings.add(p.nameWithOctave))
+
+    # notes
+    note_rows: list[tuple] = []
+    note_indices: dict[int, int] = {}
+
+    def note_index(t: MusicDataTiming) -> int:
+        idx = note_indices.get(id(t))
+        if idx is None:
+            idx = note_indices[id(t)] = len(note_rows)
+            note_rows.append(timing(t) + (float(t.elem.quarterLength),) + pitch(t.elem.pitch))
+        return idx
+
+    for t in music_data.all_notes:
+        note_index(t)
+    all_notes_count = len(note_rows)
+    # parts are keyed by name in JSON, so parts sharing a name end up as one, like they do there
+    notes_by_part_name: dict[str, list[MusicDataTiming]] = {}
+    for part, part_notes in music_data.all_notes_by_part.items():
+        name = part_name(part)
+        notes_by_part_name["null" if name is None else str(name)] = part_notes
+    part_rows: list[tuple] = []
+    part_note_rows: list[tuple] = []
+    for name, part_notes in notes_by_part_name.items():
+        part_rows.append((strings.add(name), len(part_note_rows), len(part_notes)))
+        part_note_rows.extend((note_index(t),) for t in part_notes)
+
+    # chords
+    chord_rows: list[tuple] = []
+    chord_pitch_rows: list[tuple] = []
+    for t in music_data.chords:
+        chord = t.elem
+        notes = list(chord.notes)
+        chord_rows.append(
+            timing(t)
+            + (
+                float(chord.quarterLength),
+                strings.add(display_chord_short_custom(chord)),
+                len(chord_pitch_rows),
+                len(notes),
+            )
+        )
+        chord_pitch_rows.extend(pitch(n.pitch) for n in notes)
+    root_rows = [timing(t) + pitch(t.elem) for t in music_data.chord_roots]
+
+    # lyrics
+    word_rows: list[tuple] = []
+    syllable_rows: list[tuple] = []
+    for t in music_data.lyrics:
+        word_rows.append(timing(t) + (len(syllable_rows), len(t.elem)))
+        syllable_rows.extend(timing(s) + (strings.add(s.elem),) for s in t.elem)
+
+    key_rows = [
+        timing(t)
+        + (
+            strings.add(key_name(t.elem)),
+            strings.add(t.elem.mode),
+            get_key_mask(t.elem).mask,
+        )
+        + pitch(key_pitch(t.elem))
+        for t in music_data.keys
+    ]
+
+    tempo_rows = [timing(t) + (float(t.elem),) for t in music_data.tempos]
+    ramp_rows = [timing(t) + (float(t.elem.quarterLength), float(t.elem.bpm)) for t in music_data.tempo_ramps]
+
+    meta_rows = [
+        (
+            float(music_data.bpm),
+            strings.add(json.dumps(music_data.comments)),
+            strings.add(music_data._type),
+            all_notes_count,
+        )
+    ]
+    string_offsets, string_data = strings.tables()
+    tables: dict[bytes, np.ndarray] = {
+        b"META": np.array(meta_rows, dtype=TABLES[b"META"]),
+        b"NOTE": np.array(note_rows, dtype=TABLES[b"NOTE"]),
+        b"PART": np.array(part_rows, dtype=TABLES[b"PART"]),
+        b"PNOT": np.array(part_note_rows, dtype=TABLES[b"PNOT"]),
+        b"CHRD": np.array(chord_rows, dtype=TABLES[b"CHRD"]),
+        b"CPIT": np.array(chord_pitch_rows, dtype=TABLES[b"CPIT"]),
+        b"ROOT": np.array(root_rows, dtype=TABLES[b"ROOT"]),
+        b"WORD": np.array(word_rows, dtype=TABLES[b"WORD"]),
+        b"SYLL": np.array(syllable_rows, dtype=TABLES[b"SYLL"]),
+        b"KEYS": np.array(key_rows, dtype=TABLES[b"KEYS"]),
+        b"TMPO": np.array(tempo_rows, dtype=TABLES[b"TMPO"]),
+        b"RAMP": np.array(ramp_rows, dtype=TABLES[b"RAMP"]),
+        b"STRO": string_offsets,
+        b"STRD": string_data,
+    }
+    _write_tables(tables, out)
+
+
+def _align(position: int) -> int:
+    return -(-position // TABLE_ALIGNMENT) * TABLE_ALIGNMENT
+
+
+def _write_tables(tables: dict[bytes, np.ndarray], out: BinaryIO) -> None:
+    header = np.array([(MAGIC, FORMAT_VERSION, len(tables))], dtype=_HEADER)
+    directory = np.zeros(len(tables), dtype=_TABLE_ENTRY)
+    position = _align(_HEADER.itemsize + _TABLE_ENTRY.itemsize * len(tables))
+    for entry, (tag, table) in zip(directory, tables.items()):
+        entry["tag"] = tag
+        entry["offset"] = position
+        entry["rows"] = len(table)
+        entry["row_size"] = table.dtype.itemsize
+        position = _align(position + table.nbytes)
+
+    written = out.write(header.tobytes()) + out.write(directory.tobytes())
+    for entry, table in zip(directory, tables.values()):
+        written += out.write(b"\0" * (int(entry["offset"]) - written))
+        written += out.write(table.tobytes())
+
+
+class MusicDataBinary:
+    """The tables of a binary MusicData export, as numpy record arrays reading straight from the buffer (no copies)."""
+
+    tables: dict[str, np.ndarray]
+
+    def __init__(self, buffer):
+        header = np.frombuffer(buffer, dtype=_HEADER, count=1)[0]
+        if header["magic"] != MAGIC:
+            raise ValueError("not a binary MusicData export")
+        if header["version"] > FORMAT_VERSION:
+            raise ValueError(
+                f"binary MusicData format version {header['version']} is newer than supported ({FORMAT_VERSION})"
+            )
+        directory = np.frombuffer(
+            buffer, dtype=_TABLE_ENTRY, count=int(header["table_count"]), offset=_HEADER.itemsize
+        )
+        self.tables = {}
+        for entry in directory:
+            dtype = TABLES.get(bytes(entry["tag"]))
+            if dtype is None:
+                # from a newer writer, not needed to read what we know
+                continue
+            if entry["row_size"] != dtype.itemsize:
+                raise ValueError(f"table {entry['tag']} has rows of {entry['row_size']} bytes, expected {dtype.itemsize}")
+            self.tables[bytes(entry["tag"]).decode("ascii")] = np.frombuffer(
+                buffer, dtype=dtype, count=int(entry["rows"]), offset=int(entry["offset"])
+            )
+        self._string_offsets = self.tables["STRO"]["offset"]
+        self._string_data = self.tables["STRD"]["byte"]
+
+    @staticmethod
+    def open(path: Path) -> "MusicDataBinary":
+        with open(path, "rb") as f:
+            # the map stays open as long as the tables reading from it are around
+            return MusicDataBinary(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def string(self, idx: int) -> str | None:
+        if idx == NO_STRING:
+            return None
+        start, end = self._string_offsets[idx], self._string_offsets[idx + 1]
+        return self._string_data[start:end].tobytes().decode("utf-8")
+
+    def to_json_dict(self) -> dict[str, Any]:
+        """Everything, in the shape of the JSON export."""
+        string = self.string
+
+        def timing(row, elem) -> dict:
+            return {
+                "elem": elem,
+                "offset": float(row["offset"]),
+                "time": None if np.isnan(row["time"]) else float(row["time"]),
+                "_type": string(row["type"]),
+            }
+
+        def pitch(row) -> dict | None:
+            if row["pitch_class"] == NO_PITCH_CLASS:
+                return None
+            return {
+                "pitchClass": int(row["pitch_class"]),
+                "pitchName": string(row["pitch_name"]),
+                "_type": "Pitch",
+            }
+
+        def note(row) -> dict:
+            return timing(
+                row,
+                {"pitch": pitch(row), "_type": "Note", "quarterLength": float(row["quarter_length"])},
+            )
+
+        tables = self.tables
+        meta = tables["META"][0]
+        notes = [note(row) for row in tables["NOTE"]]
+        part_notes = tables["PNOT"]["note"]
+        chord_pitches = tables["CPIT"]
+        syllables = tables["SYLL"]
+        return {
+            "chords": [
+                timing(
+                    row,
+                    {
+                        "notes": [
+                            {"pitch": pitch(pitch_row), "_type": "Note"}
+                            for pitch_row in chord_pitches[row["first_pitch"] : row["first_pitch"] + row["pitch_count"]]
+                        ],
+                        "name": string(row["name"]),
+                        "quarterLength": float(row["quarter_length"]),
+                        "_type": "Chord",
+                    },
+                )
+                for row in tables["CHRD"]
+            ],
+            "all_notes": notes[: int(meta["all_notes"])],
+            "all_notes_by_part": {
+                string(row["name"]): [notes[idx] for idx in part_notes[row["first"] : row["first"] + row["count"]]]
+                for row in tables["PART"]
+            },
+            "lyrics": [
+                timing(
+                    row,
+                    [
+                        timing(syllable_row, string(syllable_row["text"]))
+                        for syllable_row in syllables[
+                            row["first_syllable"] : row["first_syllable"] + row["syllable_count"]
+                        ]
+                    ],
+                )
+                for row in tables["WORD"]
+            ],
+            "keys": [
+                timing(
+                    row,
+                    {
+                        "name": string(row["name"]),
+                        "pitch": pitch(row),
+                        "quality": string(row["quality"]),
+                        "pitches": [pc for pc in range(12) if row["pitch_mask"] & (1 << pc)],
+                        "_type": "Key",
+                    },
+                )
+                for row in tables["KEYS"]
+            ],
+            "bpm": float(meta["bpm"]),
+            "tempos": [timing(row, float(row["bpm"])) for row in tables.get("TMPO", [])],
+            "tempo_ramps": [
+                timing(
+                    row,
+                    {"quarterLength": float(row["quarter_length"]), "bpm": float(row["bpm"]), "_type": "TempoRamp"},
+                )
+                for row in tables.get("RAMP", [])
+            ],
+            "comments": json.loads(string(meta["comments"])),
+            "chord_roots": [timing(row, pitch(row)) for row in tables["ROOT"]],
+            "_type": string(meta["type"]),
+        }
+
+
+def _test_binary_round_trip(scores_dir: Path = Path(__file__).parent.parent / "test_scores"):
+    from timing import resolve_timing
+
+    for score_path in sorted(scores_dir.glob("*.musicxml")):
+        m21_score = converter.parse(score_path)
+        assert isinstance(m21_score, Score)
+        music_data = MusicData.from_score(m21_score).detach()
+        resolve_timing(music_data)
+        for data in (music_data, music_data.filter_by_beat_range(8, 24)):
+            out = io.BytesIO()
+            export_music_data_binary(data, out)
+            binary = MusicDataBinary(out.getbuffer())
+            assert binary.to_json_dict() == json.loads(data.export()), f"{score_path.name}: binary round trip differs"
+
+
+# _test_binary_round_trip()
@@ -0,0 +1,595 @@
+# std library
+import copy
+import io
+import json
+from dataclasses import asdict, dataclass
+from fractions import Fraction
+from json.encoder import encode_basestring_ascii
+from pathlib import Path
+from typing import Any, TextIO
+
+# 3rd party library
+from music21 import converter
+from music21.chord import Chord
+from music21.key import Key
+from music21.note import Note
+from music21.pitch import Pitch
+from music21.stream import Part, PartStaff, Score
+
+# project files
+from music.records import ChordRecord, KeyRecord, NoteRecord, PartRecord, PitchRecord
+from musicxml import ExportLayout, MusicData, MusicDataTiming, TempoRamp, TimingView
+from utils import display_chord_short_custom, get_key_mask
+
+# writes MusicData as JSON by walking its known layout, straight to the output as it goes,
+# instead of the deep copy + dict conversion + json.dumps() the export used to do (see _export_via_asdict()).
+# for the same MusicData, the indented output is byte-identical to what that wrote, which the Godot `MusicScoreData`
+# loader reads. files written now differ from older ones only by keys added since: `tempos` and `tempo_ramps`, and
+# the `source` header main.py passes in. the loader looks keys up by name, so it doesn't mind them.
+
+
+def _number(value: int | float | Fraction) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return int.__repr__(value)
+    # offsets and durations of tuplets are Fractions, which json.dumps() can't write at all
+    value = float(value)
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "Infinity" if value > 0 else "-Infinity"
+    return float.__repr__(value)
+
+
+def part_name(part: Part | PartRecord) -> str | None:
+    if isinstance(part, PartStaff) or (isinstance(part, PartRecord) and part.is_staff):
+        # assuming p.id is a string like "P3-Staff2"
+        # TODO: this is making a lot of assumptions, maybe test other cases or find a better way to distinguish PartStaff groups?
+        return f"{part.partName}-{str(part.id).split('-')[1]}"
+    return part.partName
+
+
+def key_name(key: Key | KeyRecord) -> str:
+    return key.name.replace("-", "♭").replace("+", "♯")
+
+
+def key_pitch(key: Key | KeyRecord) -> Pitch | PitchRecord:
+    return key.tonic if isinstance(key, KeyRecord) else key.pitchFromDegree(1)
+
+
+@dataclass
+class MusicDataSource:
+    """What an export was made from, written as its "source" so a later run can tell if it's stale (see import_json.py)."""
+
+    musicxml_sha256: str  # see parse_cache.musicxml_sha256()
+    parser: str
+    parser_version: int
+    stage: str  # last stage the music data went through, main.ProcessStage name
+    beat_range: tuple[float, float] | None = None
+    time_range: tuple[float, float] | None = None
+    extra_start_time_sec: float | None = None  # for stage timing, see timing.resolve_timing()
+    tempo_curve: str | None = None  # for stage timing, timing.TempoCurve name
+
+    @staticmethod
+    def from_json(data: dict[str, Any]) -> "MusicDataSource":
+        def as_range(value: list[float] | None) -> tuple[float, float] | None:
+            return None if value is None else (value[0], value[1])
+
+        return MusicDataSource(
+            musicxml_sha256=data["musicxml_sha256"],
+            parser=data["parser"],
+            parser_version=data["parser_version"],
+            stage=data["stage"],
+            beat_range=as_range(data.get("beat_range")),
+            time_range=as_range(data.get("time_range")),
+            extra_start_time_sec=data.get("extra_start_time_sec"),
+            tempo_curve=data.get("tempo_curve"),
+        )
+
+
+class MusicDataJsonWriter:
+    out: TextIO
+    indent: str | None  # None for compact output, with no whitespace at all
+
+    def __init__(self, out: TextIO, indent: str | None = "  "):
+        self.out = out
+        self.indent = indent
+        self._key_separator = ": " if indent is not None else ":"
+
+    def write(self, music_data: MusicData, source: MusicDataSource | None = None) -> None:
+        self._value(
+            {
+                "chords": music_data.chords,
+                "all_notes": music_data.all_notes,
+                "all_notes_by_part": music_data.all_notes_by_part,
+                "lyrics": music_data.lyrics,
+                "keys": music_data.keys,
+                "bpm": music_data.bpm,
+                "tempos": music_data.tempos,
+                "tempo_ramps": music_data.tempo_ramps,
+                "comments": music_data.comments,
+                "chord_roots": music_data.chord_roots,
+                "_type": music_data._type,
+                **({"source": asdict(source)} if source is not None else {}),
+            },
+            0,
+        )
+
+    def _newline(self, level: int) -> None:
+        if self.indent is not None:
+            self.out.write("\n" + self.indent * level)
+
+    def _value(self, value: Any, level: int) -> None:
+        write = self.out.write
+        if value is None:
+            write("null")
+        elif isinstance(value, str):
+            write(encode_basestring_ascii(value))
+        elif isinstance(value, (int, float, Fraction)):
+            write(_number(value))
+        elif isinstance(value, MusicDataTiming):
+            self._object(
+                (
+                    ("elem", value.elem),
+                    ("offset", value.offset),
+                    ("time", value.time),
+                    ("_type", value._type),
+                ),
+                level,
+            )
+        elif isinstance(value, (list, tuple, TimingView)):
+            self._array(value, level)
+        elif isinstance(value, dict):
+            # json.dumps() writes dict keys as strings, parts by their names
+            items: dict[str, Any] = {}
+            for k, v in value.items():
+                if isinstance(k, (Part, PartRecord)):
+                    k = part_name(k)
+                items["null" if k is None else str(k)] = v
+            self._object(items.items(), level)
+        elif isinstance(value, (Chord, ChordRecord)):
+            self._object(
+                (
+                    ("notes", [_NoteWithoutLength(n) for n in value.notes]),
+                    ("name", display_chord_short_custom(value)),
+                    ("quarterLength", value.quarterLength),
+                    ("_type", "Chord"),
+                ),
+                level,
+            )
+        elif isinstance(value, _NoteWithoutLength):
+            self._object((("pitch", value.note.pitch), ("_type", "Note")), level)
+        elif isinstance(value, (Note, NoteRecord)):
+            self._object(
+                (
+                    ("pitch", value.pitch),
+                    ("_type", "Note"),
+                    ("quarterLength", value.quarterLength),
+                ),
+                level,
+            )
+        elif isinstance(value, (Pitch, PitchRecord)):
+            self._object(
+                (
+                    ("pitchClass", value.pitchClass),
+                    ("pitchName", value.nameWithOctave),
+                    ("_type", "Pitch"),
+                ),
+                level,
+            )
+        elif isinstance(value, TempoRamp):
+            self._object(
+                (
+                    ("quarterLength", value.quarterLength),
+                    ("bpm", value.bpm),
+                    ("_type", value._type),
+                ),
+                level,
+            )
+        elif isinstance(value, (Key, KeyRecord)):
+            self._object(
+                (
+                    ("name", key_name(value)),
+                    ("pitch", key_pitch(value)),
+                    ("quality", value.mode),
+                    ("pitches", get_key_mask(value).pitch_classes()),
+                    ("_type", "Key"),
+                ),
+                level,
+            )
+        else:
+            raise TypeError(f"Object of type {type(value).__name__} is not part of MusicData's JSON")
+
+    def _object(self, items, level: int) -> None:
+        write = self.out.write
+        first = True
+        for key, value in items:
+            write("{" if first else ",")
+            first = False
+            self._newline(level + 1)
+            write(encode_basestring_ascii(key))
+            write(self._key_separator)
+            self._value(value, level + 1)
+        if first:
+            write("{}")
+            return
+        self._newline(level)
+        write("}")
+
+    def _array(self, values, level: int) -> None:
+        write = self.out.write
+        first = True
+        for value in values:
+            write("[" if first else ",")
+            first = False
+            self._newline(level + 1)
+            self._value(value, level + 1)
+        if first:
+            write("[]")
+            return
+        self._newline(level)
+        write("]")
+
+
+class _NoteWithoutLength:
+    """A chord's notes are written without their own quarterLength."""
+
+    __slots__ = ("note",)
+
+    def __init__(self, note: Note | NoteRecord):
+        self.note = note
+
+
+# the normalized layout writes each distinct pitch, chord voicing and key once, in tables, and events refer to
+# them by their index in those tables. most events of a piece repeat the same few of each, so the file is several
+# times smaller, and two chords are the same chord iff they have the same chord id.
+NORMALIZED_VERSION = 1
+
+
+def elem_type(elem: Any) -> str:
+    """Class name of a MusicDataTiming's elem, as in its `_type`."""
+    return getattr(elem, "_type", elem.__class__.__name__)
+
+
+def _pitch_key(pitch: Pitch | PitchRecord) -> tuple[int, str]:
+    return pitch.midi, pitch.nameWithOctave
+
+
+def normalize_music_data(music_data: MusicData, source: MusicDataSource | None = None) -> dict[str, Any]:
+    """MusicData as plain dicts and lists in the normalized layout, ready for MusicDataJsonWriter."""
+    music_data = copy.copy(music_data)
+    music_data.materialize()
+
+    # pitches sorted low to high, so ids don't depend on the order they show up in
+    pitches: dict[tuple[int, str], Pitch | PitchRecord] = {}
+
+    def add_pitch(pitch: Pitch | PitchRecord) -> None:
+        pitches.setdefault(_pitch_key(pitch), pitch)
+
+    for timing in music_data.all_notes:
+        add_pitch(timing.elem.pitch)
+    for timing in music_data.chords:
+        for pitch in timing.elem.pitches:
+            add_pitch(pitch)
+    for timing in music_data.chord_roots:
+        if timing.elem is not None:
+            add_pitch(timing.elem)
+    for timing in music_data.keys:
+        add_pitch(key_pitch(timing.elem))
+    pitch_ids = {k: i for i, k in enumerate(sorted(pitches))}
+
+    def pitch_id(pitch: Pitch | PitchRecord | None) -> int | None:
+        return None if pitch is None else pitch_ids[_pitch_key(pitch)]
+
+    voicings: dict[tuple, int] = {}
+    chords = []
+    for timing in music_data.chords:
+        chord_pitch_ids = tuple(sorted(pitch_id(p) for p in timing.elem.pitches))
+        voicing = (chord_pitch_ids, display_chord_short_custom(timing.elem), elem_type(timing.elem))
+        chord_id = voicings.setdefault(voicing, len(voicings))
+        chords.append(
+            {"chord": chord_id, "quarterLength": timing.elem.quarterLength, "offset": timing.offset, "time": timing.time}
+        )
+
+    key_ids: dict[tuple[str, str], int] = {}
+    key_table = []
+    keys = []
+    for timing in music_data.keys:
+        key = timing.elem
+        key_id = key_ids.get((key.name, key.mode))
+        if key_id is None:
+            key_id = key_ids[(key.name, key.mode)] = len(key_table)
+            key_table.append(
+                {
+                    "name": key_name(key),
+                    "pitch": pitch_id(key_pitch(key)),
+                    "quality": key.mode,
+                    "pitches": get_key_mask(key).pitch_classes(),
+                }
+            )
+        keys.append({"key": key_id, "offset": timing.offset, "time": timing.time})
+
+    note_index = {id(timing): i for i, timing in enumerate(music_data.all_notes)}
+    all_notes_by_part: dict[str, list[int]] = {}
+    for part, timings in music_data.all_notes_by_part.items():
+        name = part_name(part)
+        indices = []
+        for timing in timings:
+            if id(timing) not in note_index:
+                raise ValueError(f"a note of part {name} isn't in all_notes, can't refer to it by index")
+            indices.append(note_index[id(timing)])
+        all_notes_by_part["null" if name is None else str(name)] = indices
+
+    return {
+        "_type": "NormalizedMusicData",
+        "version": NORMALIZED_VERSION,
+        "pitches": [
+            {"pitchClass": pitches[k].pitchClass, "pitchName": pitches[k].nameWithOctave} for k in sorted(pitches)
+        ],
+        "chord_voicings": [{"pitches": list(ids), "name": name, "class": cls} for ids, name, cls in voicings],
+        "key_table": key_table,
+        "chords": chords,
+        "all_notes": [
+            {
+                "pitch": pitch_id(timing.elem.pitch),
+                "quarterLength": timing.elem.quarterLength,
+                "offset": timing.offset,
+                "time": timing.time,
+            }
+            for timing in music_data.all_notes
+        ],
+        "all_notes_by_part": all_notes_by_part,
+        "lyrics": [
+            {
+                "syllables": [{"text": s.elem, "offset": s.offset, "time": s.time} for s in timing.elem],
+                "offset": timing.offset,
+                "time": timing.time,
+            }
+            for timing in music_data.lyrics
+        ],
+        "keys": keys,
+        "bpm": music_data.bpm,
+        "tempos": [{"bpm": timing.elem, "offset": timing.offset, "time": timing.time} for timing in music_data.tempos],
+        "tempo_ramps": [
+            {"quarterLength": t.elem.quarterLength, "bpm": t.elem.bpm, "offset": t.offset, "time": t.time}
+            for t in music_data.tempo_ramps
+        ],
+        "comments": music_data.comments,
+        "chord_roots": [
+            {"pitch": pitch_id(timing.elem), "offset": timing.offset, "time": timing.time}
+            for timing in music_data.chord_roots
+        ],
+        **({"source": asdict(source)} if source is not None else {}),
+    }
+
+
+def denormalize(data: dict[str, Any]) -> dict[str, Any]:
+    """The full layout's JSON (as parsed by json.loads()) back from the normalized layout's."""
+    if data.get("version") != NORMALIZED_VERSION:
+        raise ValueError(f"unsupported normalized MusicData version {data.get('version')}")
+
+    def pitch(pitch_id: int | None) -> dict[str, Any] | None:
+        if pitch_id is None:
+            return None
+        return {**data["pitches"][pitch_id], "_type": "Pitch"}
+
+    def timing(elem: Any, event: dict[str, Any], elem_type: str) -> dict[str, Any]:
+        return {"elem": elem, "offset": event["offset"], "time": event["time"], "_type": f"MusicDataTiming[{elem_type}]"}
+
+    def chord(event: dict[str, Any]) -> dict[str, Any]:
+        voicing = data["chord_voicings"][event["chord"]]
+        return {
+            "notes": [{"pitch": pitch(i), "_type": "Note"} for i in voicing["pitches"]],
+            "name": voicing["name"],
+            "quarterLength": event["quarterLength"],
+            "_type": "Chord",
+        }
+
+    def key(key_id: int) -> dict[str, Any]:
+        entry = data["key_table"][key_id]
+        return {**entry, "pitch": pitch(entry["pitch"]), "_type": "Key"}
+
+    all_notes = [
+        timing({"pitch": pitch(e["pitch"]), "_type": "Note", "quarterLength": e["quarterLength"]}, e, "Note")
+        for e in data["all_notes"]
+    ]
+    return {
+        "chords": [timing(chord(e), e, data["chord_voicings"][e["chord"]]["class"]) for e in data["chords"]],
+        "all_notes": all_notes,
+        "all_notes_by_part": {name: [all_notes[i] for i in ids] for name, ids in data["all_notes_by_part"].items()},
+        "lyrics": [
+            timing([timing(s["text"], s, "str") for s in e["syllables"]], e, "list") for e in data["lyrics"]
+        ],
+        "keys": [timing(key(e["key"]), e, "Key") for e in data["keys"]],
+        "bpm": data["bpm"],
+        # not in exports from before tempo changes were read
+        "tempos": [timing(e["bpm"], e, "float") for e in data.get("tempos", [])],
+        # nor from before tempo ramps were
+        "tempo_ramps": [
+            timing({"quarterLength": e["quarterLength"], "bpm": e["bpm"], "_type": "TempoRamp"}, e, "TempoRamp")
+            for e in data.get("tempo_ramps", [])
+        ],
+        "comments": data["comments"],
+        "chord_roots": [
+            timing(pitch(e["pitch"]), e, "NoneType" if e["pitch"] is None else "Pitch") for e in data["chord_roots"]
+        ],
+        "_type": "MusicData",
+        **({"source": data["source"]} if "source" in data else {}),
+    }
+
+
+def export_music_data(
+    music_data: MusicData,
+    out: TextIO,
+    indent: str | None = "  ",
+    layout: ExportLayout = ExportLayout.full,
+    source: MusicDataSource | None = None,
+) -> None:
+    writer = MusicDataJsonWriter(out, indent)
+    if layout == ExportLayout.normalized:
+        writer._value(normalize_music_data(music_data, source), 0)
+    else:
+        writer.write(music_data, source)
+
+
+def _export_via_asdict(music_data: MusicData, indent: str='  ') -> str:
+    """MusicData.export() as it was before this module: asdict(), a preprocess pass and a custom encoder.
+    Only kept as the reference _test_matches_asdict_export() compares against."""
+
+    def _convert_special_objs(obj):
+        def convert_pitch(p: Pitch | PitchRecord) -> dict:
+            return {
+                "pitchClass": p.pitchClass,
+                "pitchName": p.nameWithOctave,
+                '_type': 'Pitch',
+            }
+
+        def convert_note(n: Note | NoteRecord, include_quarter_length: bool=True) -> dict:
+            disp: dict = {
+                'pitch': convert_pitch(n.pitch),
+                '_type': 'Note',
+            }
+            if include_quarter_length:
+                disp['quarterLength'] = n.quarterLength
+            return disp
+
+        def convert_chord(c: Chord | ChordRecord) -> dict:
+            return {
+                'notes': [convert_note(n, include_quarter_length=False) for n in c.notes],
+                'name': display_chord_short_custom(c),
+                'quarterLength': c.quarterLength,
+                '_type': 'Chord',
+            }
+
+        def convert_part(p: Part | PartRecord) -> str:
+            if isinstance(p, PartStaff) or (isinstance(p, PartRecord) and p.is_staff):
+                # assuming p.id is a string like "P3-Staff2"
+                # TODO: this is making a lot of assumptions, maybe test other cases or find a better way to distinguish PartStaff groups?
+                return f"{p.partName}-{str(p.id).split('-')[1]}"
+            else:
+                return p.partName
+
+        def convert_key(k: Key | KeyRecord) -> dict:
+            return {
+                'name': k.name.replace('-', '♭').replace('+', '♯'),
+                'pitch': convert_pitch(k.tonic if isinstance(k, KeyRecord) else k.pitchFromDegree(1)),
+                'quality': k.mode,
+                'pitches': get_key_mask(k).pitch_classes(),
+                '_type': 'Key',
+            }
+
+        if isinstance(obj, (Chord, ChordRecord)):
+            return convert_chord(obj)
+        if isinstance(obj, (Note, NoteRecord)):
+            return convert_note(obj)
+        if isinstance(obj, (Pitch, PitchRecord)):
+            return convert_pitch(obj)
+        if isinstance(obj, (Part, PartRecord)):
+            return convert_part(obj)
+        if isinstance(obj, (Key, KeyRecord)):
+            return convert_key(obj)
+
+        raise TypeError()
+
+    def _convert_or_leave(obj):
+        try:
+            return _convert_special_objs(obj)
+        except TypeError:
+            return obj
+
+    class CustomEncoder(json.JSONEncoder):
+
+        def encode(self, o):
+            # print(f"{o=}")
+            if isinstance(o, dict):
+                new_dict = {}
+                for k, v in o.items():
+                    # print(f"{k=}, {v=}")
+                    k = _convert_or_leave(k)
+                    new_dict[k] = v
+                return super().encode(new_dict)
+            return super().encode(o)
+
+        def default(self, o):
+            try:
+                return _convert_special_objs(o)
+            except TypeError:
+                # Let the base class default method raise a TypeError for unhandled types
+                return json.JSONEncoder.default(self, o)
+
+
+    def preprocess(e):
+        e = _convert_or_leave(e)
+        if isinstance(e, dict):
+            new_d = {}
+            for k, v in e.items():
+                new_d[preprocess(k)] = preprocess(v)
+            return new_d
+        elif isinstance(e, list):
+            return [preprocess(o) for o in e]
+        else:
+            return e
+
+
+    # asdict() would deep copy views instead of converting them like lists
+    music_data = copy.copy(music_data)
+    music_data.materialize()
+    # TODO: bother python maintainers to actually apply default handler on dict keys :(((
+    d = preprocess(asdict(music_data))
+    # print(d)
+    return json.dumps(d, indent=indent, cls=CustomEncoder)
+
+
+def _test_matches_asdict_export(scores_dir: Path = Path(__file__).parent.parent / "test_scores"):
+    from timing import resolve_timing
+
+    for score_path in sorted(scores_dir.glob("*.musicxml")):
+        m21_score = converter.parse(score_path)
+        assert isinstance(m21_score, Score)
+        music_data = MusicData.from_score(m21_score)
+        resolve_timing(music_data)
+        detached = MusicData.from_score(m21_score).detach()
+        resolve_timing(detached)
+        for music_data in (music_data, detached, detached.filter_by_beat_range(8, 24)):
+            try:
+                expected = _export_via_asdict(music_data)
+            except TypeError:
+                # json.dumps() can't write Fraction offsets, nothing to compare against
+                continue
+            out = io.StringIO()
+            export_music_data(music_data, out)
+            assert out.getvalue() == expected, f"{score_path.name}: export differs"
+            out = io.StringIO()
+            export_music_data(music_data, out, indent=None)
+            assert json.loads(out.getvalue()) == json.loads(expected), f"{score_path.name}: compact export differs"
+
+
+# _test_matches_asdict_export()
+
+
+def sorted_chord_notes(data: dict[str, Any]) -> dict[str, Any]:
+    """Full layout JSON with each chord's notes in a fixed order, for comparing against the normalized layout,
+    which keeps a chord's pitches low to high instead of in score order."""
+    for timing in data["chords"]:
+        timing["elem"]["notes"].sort(key=lambda n: n["pitch"]["pitchName"])
+    return data
+
+
+def _test_normalized_round_trip(scores_dir: Path = Path(__file__).parent.parent / "test_scores"):
+    from timing import resolve_timing
+
+    for score_path in sorted(scores_dir.glob("*.musicxml")):
+        m21_score = converter.parse(score_path)
+        assert isinstance(m21_score, Score)
+        music_data = MusicData.from_score(m21_score).detach()
+        resolve_timing(music_data)
+        for music_data in (music_data, music_data.filter_by_beat_range(8, 24)):
+            full = music_data.export()
+            normalized = music_data.export(layout=ExportLayout.normalized)
+            expected = sorted_chord_notes(json.loads(full))
+            assert sorted_chord_notes(denormalize(json.loads(normalized))) == expected, f"{score_path.name}: differs"
+            print(f"{score_path.name}: {len(full)} -> {len(normalized)} bytes")
+
+
+# _test_normalized_round_trip()
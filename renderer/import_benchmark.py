@@ -0,0 +1,133 @@
+# standard lib
+import argparse
+import logging
+import subprocess
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+
+# log setup
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# entry points whose import must stay free of rendering modules: everything main.py needs before
+# the animate stage, and the tools that never render at all
+PARSE_ONLY_MODULES = ("main", "batch", "parse_service")
+# top-level packages only needed to render, loaded by main.animate() once it's running
+RENDER_ONLY_PACKAGES = (
+    "manim",
+    "manimpango",
+    "cairo",
+    "scene_glasspanel",
+    "layout_config",
+    "manim_utils",
+)
+# top-level packages the parse-only entry points do use, but only once a stage that needs them starts:
+# numpy for timing (see timing._numpy()). importing them up front would slow down every start, even cache hits
+DEFERRED_PACKAGES = ("numpy",)
+DEFAULT_REPEAT = 3
+
+
+# --------------------IMPORT TIME BENCHMARK--------------------
+# imports each parse-only entry point in a fresh interpreter with `python -X importtime`, and fails if it
+# pulls in any rendering or deferred package, or (with --budget-ms) takes longer than the budget.
+
+
+@dataclass
+class ImportTimes:
+    module: str
+    total_us: int  # cumulative import time of `module`, including everything it imported
+    top_level_us: dict[str, int]  # cumulative import time of each top-level package it (indirectly) imported
+
+
+def measure_import(module: str) -> ImportTimes:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=Path(__file__).parent,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # lines look like "import time:       284 |      43636 |       regex", indented by nesting depth
+    total_us = 0
+    top_level_us: dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue  # the header
+        name = name.strip()
+        package = name.split(".")[0]
+        top_level_us[package] = max(top_level_us.get(package, 0), int(cumulative))
+        if name == module:
+            total_us = int(cumulative)
+    return ImportTimes(module=module, total_us=total_us, top_level_us=top_level_us)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog="harmonimation-import-benchmark",
+        description="Check that the parse-only entry points don't import rendering modules, and time their imports",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        'modules',
+        nargs='*',
+        help="Modules to import",
+        default=list(PARSE_ONLY_MODULES),
+    )
+    parser.add_argument(
+        '--budget-ms',
+        type=float,
+        help="Fail if importing a module takes longer than this (best of --repeat runs). No time limit if not given",
+        default=None,
+    )
+    parser.add_argument(
+        '-r',
+        '--repeat',
+        type=int,
+        help="Number of times to import each module, keeping the fastest",
+        default=DEFAULT_REPEAT,
+    )
+    parser.add_argument(
+        '--top',
+        type=int,
+        help="Number of slowest top-level packages to list per module",
+        default=5,
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    failures: list[str] = []
+    for module in args.modules:
+        runs = [measure_import(module) for _ in range(max(1, args.repeat))]
+        best = min(runs, key=lambda times: times.total_us)
+        logger.info(f"{module}: {best.total_us / 1000:.1f}ms (best of {len(runs)})")
+        slowest = sorted(
+            ((us, package) for package, us in best.top_level_us.items() if package != module),
+            reverse=True,
+        )[: args.top]
+        for us, package in slowest:
+            logger.info(f"  {package:24} {us / 1000:8.1f}ms")
+
+        # a package imported in any run counts, not just in the fastest one
+        loaded = {package for times in runs for package in times.top_level_us}
+        render_only = sorted(loaded & set(RENDER_ONLY_PACKAGES))
+        if render_only:
+            failures.append(f"{module} imports render-only {', '.join(render_only)}")
+        deferred = sorted(loaded & set(DEFERRED_PACKAGES))
+        if deferred:
+            failures.append(f"{module} imports {', '.join(deferred)} before any stage needs it")
+        if args.budget_ms is not None and best.total_us / 1000 > args.budget_ms:
+            failures.append(f"{module} takes {best.total_us / 1000:.1f}ms to import, over the {args.budget_ms}ms budget")
+
+    for failure in failures:
+        logger.error(failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
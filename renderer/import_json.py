@@ -0,0 +1,225 @@
+# std library
+import json
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Any
+
+# 3rd party library
+from music21.chord import Chord
+from music21.common.numberTools import opFrac
+
+# project files
+from export_json import NORMALIZED_VERSION, MusicDataSource, denormalize
+from music.key_mask import KeyMask
+from music.records import ChordRecord, KeyRecord, NoteRecord, PartRecord, PitchRecord
+from music import chord_table
+from musicxml import MusicData, MusicDataTiming, TempoRamp
+
+# rebuilds MusicData from a music_data.json written by export_json.py (either layout), so a run can pick up
+# from the timing or animate stage without parsing the musicxml again (see main.py --from-stage).
+# elems come back as the same records MusicData.detach() makes, so widgets can't tell the difference.
+
+# semitones above C of each step, as in Pitch.midi
+_STEP_SEMITONES = {"C": 0, "D": 2, "E": 4, "F": 5, "G": 7, "A": 9, "B": 11}
+_ACCIDENTAL_SEMITONES = {"#": 1, "-": -1, "~": 0.5, "`": -0.5}
+# degree of the major scale each mode starts on, in semitones above the ionian root
+_MODE_SEMITONES = {
+    "major": 0,
+    "ionian": 0,
+    "dorian": 2,
+    "phrygian": 4,
+    "lydian": 5,
+    "mixolydian": 7,
+    "minor": 9,
+    "aeolian": 9,
+    "locrian": 11,
+}
+
+
+def _midi_of(name_with_octave: str) -> int:
+    # e.g. "E-4", "F##3", "B#3" (= C4, like music21)
+    step = _STEP_SEMITONES[name_with_octave[0]]
+    rest = name_with_octave[1:]
+    alter = 0.0
+    while rest and rest[0] in _ACCIDENTAL_SEMITONES:
+        alter += _ACCIDENTAL_SEMITONES[rest[0]]
+        rest = rest[1:]
+    octave = int(rest) if rest else 4
+    return round((octave + 1) * 12 + step + alter)
+
+
+class _RecordBuilder:
+    """Builds one record per distinct JSON object, like MusicData.detach() keeps shared objects shared."""
+
+    def __init__(self):
+        self.pitches: dict[tuple[int, str], PitchRecord] = {}
+        self.keys: dict[tuple[str, str], KeyRecord] = {}
+        self.pitched_common_names: dict[tuple[str, ...], str] = {}
+
+    def pitch(self, data: dict[str, Any] | None) -> PitchRecord | None:
+        if data is None:
+            return None
+        cache_key = (data["pitchClass"], data["pitchName"])
+        pitch = self.pitches.get(cache_key)
+        if pitch is None:
+            name_with_octave = data["pitchName"]
+            pitch = self.pitches[cache_key] = PitchRecord(
+                pitchClass=data["pitchClass"],
+                nameWithOctave=name_with_octave,
+                name=name_with_octave.rstrip("0123456789"),
+                midi=_midi_of(name_with_octave),
+            )
+        return pitch
+
+    def note(self, data: dict[str, Any], quarterLength: float) -> NoteRecord:
+        return NoteRecord(pitch=self.pitch(data["pitch"]), quarterLength=opFrac(quarterLength), _type=data["_type"])
+
+    def chord(self, data: dict[str, Any], root: PitchRecord | None, elem_type: str) -> ChordRecord:
+        quarterLength = data["quarterLength"]
+        notes = tuple(self.note(n, quarterLength) for n in data["notes"])
+        name = data["name"]
+        pitched_common_name = ""
+        if name is None and notes:
+            # not exported, only shown for chords without a custom name, so worked out again just for those
+            pitch_names = tuple(n.nameWithOctave for n in notes)
+            pitched_common_name = self.pitched_common_names.get(pitch_names)
+            if pitched_common_name is None:
+                pitched_common_name = self.pitched_common_names[pitch_names] = Chord(pitch_names).pitchedCommonName
+        return ChordRecord(
+            notes=notes,
+            quarterLength=opFrac(quarterLength),
+            root=root,
+            display_custom=name,
+            pitched_common_name=pitched_common_name,
+            _type=elem_type,
+        )
+
+    def key(self, data: dict[str, Any]) -> KeyRecord:
+        # exported names use ♭/♯, see export_json.key_name()
+        name = data["name"].replace("♭", "-").replace("♯", "+")
+        cache_key = (name, data["quality"])
+        key = self.keys.get(cache_key)
+        if key is None:
+            tonic = self.pitch(data["pitch"])
+            key = self.keys[cache_key] = KeyRecord(
+                name=name,
+                mode=data["quality"],
+                tonic=tonic,
+                mask=KeyMask(
+                    tonic=tonic.pitchClass,
+                    ionian_root=(tonic.pitchClass - _MODE_SEMITONES.get(data["quality"], 0)) % 12,
+                    mask=chord_table.pitch_class_mask(data["pitches"]),
+                ),
+                _type=data["_type"],
+            )
+        return key
+
+
+def _elem_type(timing_data: dict[str, Any]) -> str:
+    # "MusicDataTiming[ChordSymbol]" -> "ChordSymbol"
+    return timing_data["_type"].partition("[")[2].rstrip("]")
+
+
+def music_data_from_json(data: dict[str, Any]) -> tuple[MusicData, MusicDataSource | None]:
+    """MusicData (made of records) and its source header, from the parsed JSON of either export layout."""
+    if not isinstance(data, dict):
+        raise ValueError(f"not exported music data: a JSON {type(data).__name__}, expected an object")
+    if data.get("_type") == "NormalizedMusicData":
+        data = denormalize(data)
+    elif data.get("_type") != "MusicData":
+        raise ValueError(f"not exported music data: {data.get('_type')}, expected MusicData (or normalized v{NORMALIZED_VERSION})")
+
+    records = _RecordBuilder()
+
+    def timing(elem: Any, timing_data: dict[str, Any]) -> MusicDataTiming:
+        return MusicDataTiming(elem=elem, offset=opFrac(timing_data["offset"]), time=timing_data["time"])
+
+    chord_roots = [timing(records.pitch(t["elem"]), t) for t in data["chord_roots"]]
+    # chord roots are only kept for chords with notes, in chord order (see MusicData.__post_init__())
+    roots = iter(chord_roots)
+    chords = []
+    for t in data["chords"]:
+        root = next(roots).elem if t["elem"]["notes"] else None
+        chords.append(timing(records.chord(t["elem"], root, _elem_type(t)), t))
+
+    def note_timing(timing_data: dict[str, Any]) -> MusicDataTiming:
+        return timing(records.note(timing_data["elem"], timing_data["elem"]["quarterLength"]), timing_data)
+
+    def note_key(timing_data: dict[str, Any]) -> tuple:
+        elem = timing_data["elem"]
+        return timing_data["offset"], timing_data["time"], elem["pitch"]["pitchName"], elem["quarterLength"]
+
+    # a part's notes are the same timings as in all_notes, written out again in full under their part.
+    # each note is in one part, so equal notes are handed out in order
+    all_notes = []
+    unclaimed_notes: defaultdict[tuple, deque[MusicDataTiming]] = defaultdict(deque)
+    for t in data["all_notes"]:
+        all_notes.append(note_timing(t))
+        unclaimed_notes[note_key(t)].append(all_notes[-1])
+    all_notes_by_part = {}
+    for name, part_timings in data["all_notes_by_part"].items():
+        # part_name() of this record is `name` again
+        part = PartRecord(id=name, partName=None if name == "null" else name, is_staff=False)
+        all_notes_by_part[part] = [
+            unclaimed.popleft() if (unclaimed := unclaimed_notes.get(note_key(t))) else note_timing(t)
+            for t in part_timings
+        ]
+
+    music_data = MusicData(
+        chords=chords,
+        all_notes=all_notes,
+        all_notes_by_part=all_notes_by_part,
+        lyrics=[timing([timing(s["elem"], s) for s in t["elem"]], t) for t in data["lyrics"]],
+        keys=[timing(records.key(t["elem"]), t) for t in data["keys"]],
+        bpm=data["bpm"],
+        tempos=[timing(t["elem"], t) for t in data.get("tempos", [])],
+        tempo_ramps=[
+            timing(TempoRamp(quarterLength=opFrac(t["elem"]["quarterLength"]), bpm=t["elem"]["bpm"]), t)
+            for t in data.get("tempo_ramps", [])
+        ],
+        comments=data["comments"],
+        chord_roots=chord_roots,
+    )
+    source = MusicDataSource.from_json(data["source"]) if data.get("source") is not None else None
+    return music_data, source
+
+
+def import_music_data(path: Path) -> tuple[MusicData, MusicDataSource | None]:
+    with open(path, encoding="utf-8") as f:
+        return music_data_from_json(json.load(f))
+
+
+def _test_import_round_trip(scores_dir: Path = Path(__file__).parent.parent / "test_scores"):
+    from dataclasses import asdict
+
+    from music21 import converter
+    from music21.stream import Score
+
+    from export_json import sorted_chord_notes
+    from musicxml import ExportLayout
+    from timing import resolve_timing
+
+    source = MusicDataSource(musicxml_sha256="0" * 64, parser="music21", parser_version=0, stage="timing")
+    for score_path in sorted(scores_dir.glob("*.musicxml")):
+        m21_score = converter.parse(score_path)
+        assert isinstance(m21_score, Score)
+        music_data = MusicData.from_score(m21_score).detach()
+        resolve_timing(music_data)
+        expected = music_data.export()
+        for layout in ExportLayout:
+            exported = json.loads(music_data.export(layout=layout))
+            exported["source"] = asdict(source)
+            imported, imported_source = music_data_from_json(exported)
+            assert imported_source == source
+            if layout == ExportLayout.full:
+                assert imported.export() == expected, f"{score_path.name}: import differs"
+            else:
+                # the normalized layout keeps a chord's pitches low to high, not in score order
+                assert sorted_chord_notes(json.loads(imported.export())) == sorted_chord_notes(
+                    json.loads(expected)
+                ), f"{score_path.name} ({layout}): import differs"
+            # parts keep their notes
+            assert sum(map(len, imported.all_notes_by_part.values())) == len(imported.all_notes)
+
+
+# _test_import_round_trip()
@@ -10,7 +10,7 @@ from obj_music_circles import (
     Circle12NotesSequenceConnectors,
 )
 from obj_music_text import ChordText, LyricText, KeyText
-from utils import get_ionian_root
+from utils import get_key_mask
 
 
 def _compute_shift(widget_def: dict) -> Vector3D:
@@ -65,19 +65,17 @@ def _build_circle12notes(widget_def: dict, music_data: MusicData) -> list[Mobjec
         elif widget_type == "circle_fifths":
             return 7
 
-    starting_key = music_data.keys[0].elem
-    starting_root_pitch = get_ionian_root(starting_key).pitchClass
-    starting_key_pitches = {p.pitchClass for p in starting_key.getPitches()}
+    starting_key = get_key_mask(music_data.keys[0].elem)
 
     circle12n = Circle12NotesSequenceConnectors(
         radius=radius,
         max_selected_steps=max_selected_steps,
         steps_per_pitch=map_note_intervals(widget_def["type"]),
-        rotate_pitch=starting_root_pitch,
+        rotate_pitch=starting_key.ionian_root,
         
     ).shift(_compute_shift(widget_def))
     for _, pitch_idx in circle12n._list_steps():
-        if pitch_idx in starting_key_pitches:
+        if pitch_idx in starting_key:
             circle12n.get_pitch_text(pitch_idx).color = DEFAULT_NOTE_IN_KEY_COLOR
         else:
             circle12n.get_pitch_text(pitch_idx).color = DEFAULT_NOTE_NOT_IN_KEY_COLOR
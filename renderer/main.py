@@ -1,25 +1,37 @@
 # standard lib
 import argparse
 import logging
+import os
 import sys
+import time
+from dataclasses import replace
 from enum import Enum
 from pathlib import Path
+from typing import IO, Callable
 
 # 3rd party
 import pyjson5
-from manim import config
 
 # project files
-from timing import resolve_timing
-from scene_glasspanel import GlassPanel
-from layout_config import build_widgets
-from musicxml import parse_score_data
+from export_json import MusicDataSource
+from import_json import import_music_data
+from musicxml import PARSER_VERSION, ExportLayout, MusicData, ScoreParser
+from timing import DEFAULT_EXTRA_START_TIME_SEC, DEFAULT_TEMPO_CURVE, TempoCurve, resolve_timing
+from parse_cache import (
+    DEFAULT_PARSE_CACHE_DIR,
+    DEFAULT_PARSE_CACHE_MAX_MB,
+    ParseCache,
+    cached_parse_score_data,
+    musicxml_sha256,
+)
 
 # log setup
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 DEFAULT_MUSIC_DATA_JSON_FILENAME = "music_data.json"
+DEFAULT_JSON_INDENT = "  "
+DEFAULT_WATCH_INTERVAL_SEC = 0.25
 
 logger.debug(f"Python version: {sys.version}")
 logger.debug(f"Version info: {sys.version_info}")
@@ -68,7 +80,7 @@ def parse_args():
     )
     parser.add_argument(
         "musicxml_file",
-        type=argparse.FileType('r', encoding='UTF-8'),
+        type=argparse.FileType('rb'),
         help="musicxml file to render music from",
     )
     hrmn_file_arg_def = parser.add_argument(
@@ -97,6 +109,26 @@ def parse_args():
         default=ProcessStage.timing,
         help="Processing stage to stop after."
     )
+    parser.add_argument(
+        '--watch',
+        action='store_true',
+        help="Keep running after the first run, and re-run the stages affected by each change to the musicxml file "
+        "(and the harmonimation file, for stage animate)",
+    )
+    parser.add_argument(
+        '--watch-interval',
+        type=float,
+        help="Seconds between checks for changes in --watch mode",
+        default=DEFAULT_WATCH_INTERVAL_SEC,
+    )
+    parser.add_argument(
+        '--from-stage',
+        type=ProcessStage,
+        choices=[ProcessStage.timing, ProcessStage.animate],
+        default=None,
+        help="Processing stage to start at, reusing the music data file of an earlier run instead of the stages before it. "
+        "Falls back to running every stage if that file is missing or stale",
+    )
     parser.add_argument(
         '-f',
         '--music-data-file',
@@ -104,6 +136,71 @@ def parse_args():
         help="Output JSON file path for music data parsed from musicxml",
         default=Path(f"./{DEFAULT_MUSIC_DATA_JSON_FILENAME}")
     )
+    parser.add_argument(
+        '--music-data-binary-file',
+        type=Path,
+        help="Also write the music data in the memory-mappable binary format (see export_binary.py) to this path",
+        default=None,
+    )
+    parser.add_argument(
+        '--compact-json',
+        action='store_true',
+        help="Write music data JSON without indentation or whitespace",
+    )
+    parser.add_argument(
+        '--json-layout',
+        type=ExportLayout,
+        choices=list(ExportLayout),
+        default=ExportLayout.full,
+        help="Music data JSON layout. normalized writes pitches, chords and keys once in tables and refers to them by index",
+    )
+    parser.add_argument(
+        '--extra-start-time',
+        type=float,
+        help="Seconds before the first beat, e.g. for the scene to appear in",
+        default=DEFAULT_EXTRA_START_TIME_SEC,
+    )
+    parser.add_argument(
+        '--tempo-curve',
+        type=TempoCurve,
+        choices=list(TempoCurve),
+        default=DEFAULT_TEMPO_CURVE,
+        help="How the tempo changes over an accel. or rit. up to a metronome mark. linear changes the bpm by the same "
+        "amount every beat, exponential by the same ratio",
+    )
+    parser.add_argument(
+        '-p',
+        '--parser',
+        type=ScoreParser,
+        choices=list(ScoreParser),
+        default=ScoreParser.music21,
+        help="Musicxml reader to use. fast streams only what's needed for music data, without building a music21 score. "
+        "incremental is fast, but re-reads only the measures changed since the last parse, best with --watch",
+    )
+    parser.add_argument(
+        '-j',
+        '--parse-jobs',
+        type=int,
+        help="Number of worker processes to parse the parts of the musicxml file with (music21 parser only)",
+        default=1,
+    )
+    parser.add_argument(
+        '--no-parse-cache',
+        action='store_true',
+        help="Always re-parse the musicxml file instead of reusing a cached parse result",
+    )
+    parser.add_argument(
+        '--parse-cache-dir',
+        type=Path,
+        help="Directory for cached parse results, keyed by musicxml content hash",
+        default=DEFAULT_PARSE_CACHE_DIR,
+    )
+    parser.add_argument(
+        '--parse-cache-max-mb',
+        type=float,
+        help="Maximum total size of the parse cache; least recently used entries are evicted past this",
+        default=DEFAULT_PARSE_CACHE_MAX_MB,
+    )
     args = parser.parse_args()
     if args.beat_range is not None and args.time_range is not None:
         # TODO: figure out how to print this nicer
@@ -111,6 +208,12 @@ def parse_args():
             argument=None,
             message="Cannot provide both --beat-range and --time-range arguments.",
         )
+    stages = list(ProcessStage)
+    if args.from_stage is not None and stages.index(args.from_stage) > stages.index(args.stage):
+        raise argparse.ArgumentError(
+            argument=None,
+            message=f"--from-stage {args.from_stage} is after --stage {args.stage}.",
+        )
     if args.stage == ProcessStage.animate and args.harmonimation_file is None:
         raise argparse.ArgumentError(
             argument=hrmn_file_arg_def,
@@ -119,39 +222,149 @@ def parse_args():
     return args
 
 
-def main():
-    # use UTF-8 output encoding
-    sys.stdout.reconfigure(encoding='utf-8')
+def export_music_data(
+    music_data: MusicData, args, json_indent: str | None, source: MusicDataSource
+) -> None:
+    # written to a temp file first so a reader (e.g. Godot, or a --watch run) never sees a partial file
+    _write_atomically(
+        args.music_data_file,
+        'w',
+        lambda f: music_data.export_to(f, json_indent, args.json_layout, source),
+    )
+    if args.music_data_binary_file is not None:
+        _write_atomically(args.music_data_binary_file, 'wb', music_data.export_binary_to)
 
-    # parse program arguments
-    args = parse_args()
-    music_data_json_filename = args.music_data_file
-
-    # parse music data
-    music_data = parse_score_data(args.musicxml_file.read())
-    if args.beat_range:
-        # filter by beat
-        music_data = music_data.filter_by_beat_range(*args.beat_range)
-    if args.stage == ProcessStage.parse_score:
-        with open(music_data_json_filename, 'w') as f:
-            f.write(music_data.export())
-        return
-
-    # parse into timing data (data, beat) -> (data, beat, second)
-    resolve_timing(music_data)
-    if args.time_range:
-        # filter by time
-        # TODO: compensate for create time and start buffer time?
-        music_data = music_data.filter_by_time_range(*args.time_range)
-    # always export at this stage
-    with open(music_data_json_filename, 'w') as f:
-        f.write(music_data.export())
-    if args.stage == ProcessStage.timing:
-        return
+
+def _write_atomically(path: Path, mode: str, write: Callable[[IO], None]) -> None:
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, mode) as f:
+            write(f)
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def resume_music_data(args, from_stage: ProcessStage, source: MusicDataSource) -> MusicData | None:
+    """Music data of an earlier run to start at `from_stage` with, or None if there's no usable one."""
+    path: Path = args.music_data_file
+    if not path.exists():
+        logger.warning(f"no {path} to start at stage {from_stage} from, running every stage")
+        return None
+    try:
+        music_data, file_source = import_music_data(path)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        # e.g. a file cut short by a killed run, or some other JSON saved under that name
+        logger.warning(f"can't read {path} to start at stage {from_stage} from ({type(e).__name__}: {e}), running every stage")
+        return None
+
+    stale_reasons = []
+    if file_source is None:
+        stale_reasons.append("it has no source header")
+    else:
+        if file_source.musicxml_sha256 != source.musicxml_sha256:
+            stale_reasons.append("the musicxml file changed")
+        if (file_source.parser, file_source.parser_version) != (source.parser, source.parser_version):
+            stale_reasons.append(f"it was parsed by {file_source.parser} v{file_source.parser_version}")
+        if file_source.beat_range != source.beat_range:
+            stale_reasons.append(f"it has beat range {file_source.beat_range}")
+        if from_stage == ProcessStage.animate:
+            # timing is skipped too, so the file must be timed and filtered exactly as asked
+            if file_source.stage != ProcessStage.timing.name:
+                stale_reasons.append(f"it is from stage {file_source.stage}")
+            if file_source.time_range != source.time_range:
+                stale_reasons.append(f"it has time range {file_source.time_range}")
+            if file_source.extra_start_time_sec != source.extra_start_time_sec:
+                stale_reasons.append(f"its first beat is at {file_source.extra_start_time_sec}s")
+            if file_source.tempo_curve != source.tempo_curve:
+                stale_reasons.append(f"it has tempo curve {file_source.tempo_curve}")
+        elif file_source.time_range is not None:
+            # times are worked out again, which a file already filtered by time can't give
+            stale_reasons.append(f"it has time range {file_source.time_range}")
+    if stale_reasons:
+        logger.warning(f"not starting at stage {from_stage} from {path}: {', '.join(stale_reasons)}")
+        return None
+    logger.info(f"starting at stage {from_stage} from {path}")
+    return music_data
+
+
+def run_music_data_stages(
+    args,
+    musicxml_data: bytes,
+    json_indent: str | None,
+    parse_cache: ParseCache | None,
+    from_stage: ProcessStage | None,
+) -> MusicData:
+    """Run the stages before animate (up to `args.stage`) and export their music data, which is returned."""
+    source = MusicDataSource(
+        musicxml_sha256=musicxml_sha256(musicxml_data),
+        parser=str(args.parser),
+        parser_version=PARSER_VERSION,
+        stage=ProcessStage.parse_score.name,
+        beat_range=args.beat_range,
+    )
+
+    music_data = None
+    if from_stage is not None:
+        music_data = resume_music_data(
+            args,
+            from_stage,
+            replace(
+                source,
+                time_range=args.time_range,
+                extra_start_time_sec=args.extra_start_time,
+                tempo_curve=str(args.tempo_curve),
+            ),
+        )
+    if music_data is None:
+        from_stage = ProcessStage.parse_score
+
+    if from_stage == ProcessStage.parse_score:
+        # parse music data
+        music_data = cached_parse_score_data(
+            musicxml_data, parse_cache, args.parse_jobs, args.parser
+        )
+        if args.beat_range:
+            # filter by beat
+            music_data = music_data.filter_by_beat_range(*args.beat_range)
+        if args.stage == ProcessStage.parse_score:
+            export_music_data(music_data, args, json_indent, source)
+            return music_data
+
+    if from_stage != ProcessStage.animate:
+        # parse into timing data (data, beat) -> (data, beat, second)
+        tempo_map = resolve_timing(music_data, args.extra_start_time, args.tempo_curve)
+        if args.time_range:
+            # filter by time
+            # TODO: compensate for create time and start buffer time?
+            music_data = music_data.filter_by_time_range(*args.time_range)
+            beat_start, beat_end = (tempo_map.sec_to_beat(sec) for sec in args.time_range)
+            logger.info(f"time range {args.time_range[0]}s to {args.time_range[1]}s is beats {beat_start:g} to {beat_end:g}")
+        # always export at this stage
+        export_music_data(
+            music_data,
+            args,
+            json_indent,
+            replace(
+                source,
+                stage=ProcessStage.timing.name,
+                time_range=args.time_range,
+                extra_start_time_sec=args.extra_start_time,
+                tempo_curve=str(args.tempo_curve),
+            ),
+        )
+    return music_data
+
+
+def animate(music_data: MusicData, harmonimation_config: dict) -> None:
+    # imported here so the stages before animate never load manim (see import_benchmark.py)
+    from manim import config
+    from scene_glasspanel import GlassPanel
+    from layout_config import build_widgets
 
     # make harmonimation widgets
     widgets = build_widgets(
-        config=pyjson5.load(args.harmonimation_file),
+        config=harmonimation_config,
         music_data=music_data,
     )
     # make harmonimation scene, and render!
@@ -159,5 +372,122 @@ def main():
     GlassPanel(music_data, widgets).render()
 
 
+def _mtime_ns(path: Path) -> int | None:
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        # editors may save by deleting and re-creating the file
+        return None
+
+
+def watch(
+    args,
+    music_data: MusicData,
+    json_indent: str | None,
+    parse_cache: ParseCache | None,
+) -> None:
+    """Re-run the stages affected by each change to the musicxml or harmonimation file, until interrupted.
+    Polls modification times, which needs no extra dependencies and works the same everywhere."""
+    musicxml_path = Path(args.musicxml_file.name)
+    harmonimation_path = (
+        Path(args.harmonimation_file.name) if args.stage == ProcessStage.animate else None
+    )
+    watched = [path for path in (musicxml_path, harmonimation_path) if path is not None]
+    mtimes = {path: _mtime_ns(path) for path in watched}
+    musicxml_hash = musicxml_sha256(musicxml_path.read_bytes())
+    logger.info(f"watching {', '.join(str(path) for path in watched)} for changes, ctrl+c to stop")
+
+    try:
+        while True:
+            time.sleep(args.watch_interval)
+            changed = {path for path in watched if _mtime_ns(path) != mtimes[path]}
+            if not changed:
+                continue
+            # wait for the editor to finish saving
+            while True:
+                new_mtimes = {path: _mtime_ns(path) for path in watched}
+                time.sleep(args.watch_interval)
+                if new_mtimes == {path: _mtime_ns(path) for path in watched}:
+                    break
+            mtimes = new_mtimes
+
+            start = time.perf_counter()
+            try:
+                if musicxml_path in changed:
+                    musicxml_data = musicxml_path.read_bytes()
+                    new_hash = musicxml_sha256(musicxml_data)
+                    if new_hash == musicxml_hash:
+                        # touched, or saved without changes
+                        changed.discard(musicxml_path)
+                    else:
+                        music_data = run_music_data_stages(
+                            args, musicxml_data, json_indent, parse_cache, from_stage=None
+                        )
+                        musicxml_hash = new_hash
+                if changed and args.stage == ProcessStage.animate:
+                    # a layout change only needs the animate stage, on the music data kept from last time
+                    with open(harmonimation_path, encoding="UTF-8") as f:
+                        animate(music_data, pyjson5.load(f))
+            except Exception:
+                # e.g. a score saved mid-edit that doesn't parse. keep watching for the fix
+                logger.exception("failed to update, waiting for the next change")
+                continue
+            if changed:
+                logger.info(
+                    f"updated for changes to {', '.join(path.name for path in changed)} "
+                    f"in {time.perf_counter() - start:.2f}s"
+                )
+    except KeyboardInterrupt:
+        logger.info("stopped watching")
+
+
+def main():
+    # use UTF-8 output encoding
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    # parse program arguments
+    args = parse_args()
+    json_indent = None if args.compact_json else DEFAULT_JSON_INDENT
+    parse_cache = (
+        None
+        if args.no_parse_cache
+        else ParseCache(
+            args.parse_cache_dir, int(args.parse_cache_max_mb * 1024 * 1024)
+        )
+    )
+
+    music_data = run_music_data_stages(
+        args, args.musicxml_file.read(), json_indent, parse_cache, args.from_stage
+    )
+    if args.stage == ProcessStage.animate:
+        animate(music_data, pyjson5.load(args.harmonimation_file))
+    if args.watch:
+        watch(args, music_data, json_indent, parse_cache)
+
+
+def _test_resume_unreadable_music_data():
+    import tempfile
+
+    source = MusicDataSource(musicxml_sha256="0" * 64, parser="music21", parser_version=PARSER_VERSION, stage="timing")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / DEFAULT_MUSIC_DATA_JSON_FILENAME
+        args = argparse.Namespace(music_data_file=path)
+        for content in (
+            '{"chords": [{"elem": ',  # cut short
+            '{"hello": "world"}',  # not music data
+            '[1, 2, 3]',
+            '{"_type": "MusicData", "chords": []}',  # missing lists
+            b"\xff\xfe not utf-8",
+        ):
+            if isinstance(content, bytes):
+                path.write_bytes(content)
+            else:
+                path.write_text(content)
+            for from_stage in (ProcessStage.timing, ProcessStage.animate):
+                assert resume_music_data(args, from_stage, source) is None, f"{content!r} was resumed from"
+
+# _test_resume_unreadable_music_data()
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,189 @@
+from typing import Any
+import math
+import numpy as np
+
+from manim import (
+    Mobject,
+    Group,
+    Scene,
+    VDict,
+    PI,
+    Animation,
+    Wait,
+    Succession,
+    Circle,
+    TAU,
+    ManimColor,
+    ParsableManimColor,
+    Dot,
+    WHITE,
+    VGroup,
+    RED,
+    AnimationGroup,
+    Text,
+    Create,
+)
+from manim.typing import Point3D
+
+# helpers for building manim objects and animations, kept apart from utils.py
+# so parsing and timing (which import utils) never load manim.
+
+
+# --------------------MANIM HELPERS--------------------
+
+
+def callback_add_to_group(group: Group, object: Mobject):
+    def callback(_: Scene) -> None:
+        group.add(object)
+
+    return callback
+
+
+def callback_add_to_vdict(vdict: VDict, index: Any, object: Mobject):
+    def callback(_: Scene) -> None:
+        vdict[index] = object
+
+    return callback
+
+
+def point_at_angle(circle: Circle, angle: float) -> Point3D:
+    proportion = (angle) / TAU
+    proportion -= np.floor(proportion)
+    return circle.point_from_proportion(proportion)
+
+
+class AnimateProperty(Animation):
+    """Animate one propert of a Mobject.
+    This is preferable to `.animate.set_<property>() as it can coexist with other Animations because it doesn't Animate other properties."""
+
+    property_name: str
+    initial_value: Any # TODO: typevar
+    final_value: Any
+    _initial_value_fetched = False
+
+    def __init__(
+            self,
+            mobject: Mobject,
+            property_name: str,
+            final_value: Any,
+            **kwargs
+    ):
+        super().__init__(mobject, **kwargs)
+        self.property_name = property_name
+        self.final_value = final_value
+
+    def interpolate_mobject(self, alpha: float):
+        # TODO: try to find a better way to do this
+
+        if not self._initial_value_fetched:
+            self.initial_value = self.mobject.__getattr__('get_' + self.property_name)()
+            self._initial_value_fetched = True
+
+        interpolated_value: Any = None
+        if isinstance(self.final_value, ManimColor):
+            interpolated_value = ManimColor.interpolate(self.initial_value, self.final_value, alpha)
+        else:
+            raise NotImplementedError()
+        self.mobject.__getattr__('set_' + self.property_name)(interpolated_value)
+
+class TimestampedAnimationSuccession(Succession):
+    """Given a list of animations which should each end at a particular time,
+    create a Succession of all of them separated by Wait animations."""
+
+    def __init__(
+        self,
+        anims: list[
+            tuple[float, Animation]
+        ],  # list[end_timestamp: second, anim: Animation]
+        transition_time: float,
+        **kwargs,
+    ):
+        # build a sequence of animations to play - waits followed by rotations
+        sequenced_anims: list[Animation] = []
+        # previous_pitch_class: int = get_ionian_root(music_data.keys[0].elem).pitchClass
+        previous_time: float = 0
+
+        for anim_timestamp, anim in anims:
+
+            # print(
+            #     f"TimestampedAnimationSuccession step:\n\t{previous_time=}\n\t{anim_timestamp}, {anim}"
+            # )
+
+            # fiture out how long since last update
+            assert anim_timestamp > previous_time
+            elapsed_time = anim_timestamp - previous_time
+
+            # if we don't have time to do a full wait-then-transition
+            if elapsed_time <= transition_time:
+                # just animate with the time we have
+                anim.run_time = elapsed_time
+                sequenced_anims.append(anim)
+            else:
+                # sleep until start of time when we need to transform
+                sequenced_anims.append(Wait(elapsed_time - transition_time))
+                anim.run_time = transition_time
+                sequenced_anims.append(anim)
+            # done processing this animation
+            previous_time = anim_timestamp
+
+        super().__init__(sequenced_anims, **kwargs)
+
+
+class Anchor(Dot):
+
+    def __init__(
+        self,
+        point: Point3D,
+        fill_opacity: float = 0,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, point=point, fill_opacity=fill_opacity, **kwargs)
+
+    def add_follower(self, mobject: Mobject) -> "Anchor":
+        def follow_anchor(follower: Mobject):
+            anchor_pos = self.get_center()[0:2]
+            follower_before_pos = follower.get_center()[0:2]
+            follower.move_to(self)
+            # some debug stuff iunno
+            if '_debug_anchor' in dir(follower):
+                follower_after_pos = follower.get_center()[0:2]
+                print(
+                    f"follow_anchor({follower}):\n\t       anchor: {anchor_pos}\n\tfollow_before: {follower_before_pos}\n\t follow_after: {follower_after_pos}"
+                )
+
+        mobject.add_updater(follow_anchor, call_updater=True)
+        return self
+
+
+class LabelledCircle(VGroup):
+
+    def __init__(self, circle_color=RED, text="Circle", **kwargs):
+        VGroup.__init__(self, **kwargs)
+        self.circle_color = circle_color
+        self.circle = Circle(color=circle_color)
+        self.text = Text(text=text)
+        self.add(self.circle)
+        self.add(self.text)
+
+    def create(self):
+        return AnimationGroup(Create(self.circle), Create(self.text), lag_ratio=0.5)
+
+
+class testLabelledCircle(Scene):
+    def construct(self):
+        circle = LabelledCircle()
+        self.play(circle.create(), run_time=2)
+        self.wait(1)
+
+
+# --------------------MATH HELPERS--------------------
+
+
+# TODO: use Circle.point_at_angle?
+def vector_on_unit_circle(t: float):
+    return np.array([math.cos(2 * PI * t), math.sin(2 * PI * t), 0])
+
+
+def vector_on_unit_circle_clockwise_from_top(t: float):
+    return vector_on_unit_circle(1 / 4 - t)
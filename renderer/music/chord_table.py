@@ -0,0 +1,228 @@
+from array import array
+from functools import cache
+
+# Chord qualities for every set of pitch classes, as a 12-bit mask (bit n = pitch class n).
+# Built once on first use by matching each set against the chord templates below from every possible root,
+# so naming a chord is a couple of array lookups.
+
+PITCH_CLASSES = 12
+PITCH_CLASS_SETS = 1 << PITCH_CLASSES  # 4096
+FULL_MASK = PITCH_CLASS_SETS - 1
+
+# chords need at least this many pitch classes, anything smaller is "no chord"
+MIN_CHORD_PITCH_CLASSES = 3
+
+
+def pitch_class_mask(pitch_classes) -> int:
+    mask = 0
+    for pitch_class in pitch_classes:
+        mask |= 1 << (pitch_class % PITCH_CLASSES)
+    return mask
+
+
+def pitch_classes_in(mask: int) -> list[int]:
+    return [pc for pc in range(PITCH_CLASSES) if mask & (1 << pc)]
+
+
+def transpose_mask(mask: int, steps: int) -> int:
+    """Rotate a pitch class mask up by `steps` semitones."""
+    steps %= PITCH_CLASSES
+    return ((mask << steps) | (mask >> (PITCH_CLASSES - steps))) & FULL_MASK
+
+
+# (quality, intervals above the root), best first when two roots explain a chord equally well
+_TEMPLATES: list[tuple[str, tuple[int, ...]]] = [
+    # seventh chords
+    ("Maj7", (0, 4, 7, 11)),
+    ("7", (0, 4, 7, 10)),
+    ("min7", (0, 3, 7, 10)),
+    ("mM7", (0, 3, 7, 11)),
+    ("ø7", (0, 3, 6, 10)),  # half-diminished # TODO: or maybe "b5b7"?
+    ("°7", (0, 3, 6, 9)),  # fully-diminished
+    ("+Maj7", (0, 4, 8, 11)),
+    ("+7", (0, 4, 8, 10)),
+    ("7sus4", (0, 5, 7, 10)),
+    # triads
+    ("Maj", (0, 4, 7)),
+    ("min", (0, 3, 7)),
+    ("dim", (0, 3, 6)),
+    ("+", (0, 4, 8)),
+    ("sus4", (0, 5, 7)),
+    ("sus2", (0, 2, 7)),
+    # sevenths with the fifth left out
+    ("7", (0, 4, 10)),
+    ("Maj7", (0, 4, 11)),
+    ("min7", (0, 3, 10)),
+    ("mM7", (0, 3, 11)),
+    # anything else is named from its root and the notes above it
+    ("5", (0, 7)),
+    ("", (0,)),
+]
+_TEMPLATE_MASKS = [pitch_class_mask(intervals) for _, intervals in _TEMPLATES]
+
+# notes on top of a template: interval above root -> (how far up the stack of thirds it is, suffix)
+_EXTENSIONS: dict[int, tuple[int, str]] = {
+    1: (1, "♭9"),
+    2: (1, "add9"),  # or turns a 7 into a 9, see _quality_name()
+    3: (1, "♯9"),
+    5: (2, "add11"),
+    6: (2, "♯11"),
+    8: (3, "♭13"),
+    9: (3, "add6"),
+    # only left over by the root-only templates
+    4: (4, "add3"),
+    7: (4, "add5"),
+    10: (4, "add♭7"),
+    11: (4, "add7"),
+}
+_NINTH_REPLACES_SEVENTH = ("Maj7", "7", "min7", "mM7")
+
+
+def _quality_name(template_quality: str, extensions: list[int]) -> str:
+    quality = template_quality
+    for interval in extensions:
+        if interval == 2 and quality in _NINTH_REPLACES_SEVENTH:
+            quality = quality.replace("7", "9")
+        else:
+            quality += _EXTENSIONS[interval][1]
+    return quality
+
+
+def _best_quality_at_root(rooted_mask: int) -> tuple[tuple[int, int, int], str]:
+    """(score, quality) of the best template for a mask with its root at pitch class 0. Lower scores are better."""
+    best: tuple[tuple[int, int, int], str] | None = None
+    for rank, ((template_quality, _), template_mask) in enumerate(
+        zip(_TEMPLATES, _TEMPLATE_MASKS)
+    ):
+        if rooted_mask & template_mask != template_mask:
+            continue
+        extensions = pitch_classes_in(rooted_mask & ~template_mask)
+        # prefer explaining more of the chord, then extensions low in the stack of thirds (9ths over 13ths)
+        score = (
+            len(extensions),
+            sum(_EXTENSIONS[interval][0] for interval in extensions),
+            rank,
+        )
+        if best is None or score < best[0]:
+            best = (score, _quality_name(template_quality, extensions))
+    assert best is not None  # the root-only template always matches
+    return best
+
+
+@cache
+def _tables() -> tuple[list[str], array, array]:
+    """(qualities, quality index per mask rooted on pitch class 0, root candidates mask per mask)"""
+    qualities: list[str] = []
+    quality_indices: dict[str, int] = {}
+    # quality of each mask when its root is pitch class 0
+    quality_at_root = array("H", [0] * PITCH_CLASS_SETS)
+    score_at_root: list[tuple[int, int, int] | None] = [None] * PITCH_CLASS_SETS
+    for rooted_mask in range(PITCH_CLASS_SETS):
+        if not rooted_mask & 1:
+            continue
+        score, quality = _best_quality_at_root(rooted_mask)
+        if quality not in quality_indices:
+            quality_indices[quality] = len(qualities)
+            qualities.append(quality)
+        quality_at_root[rooted_mask] = quality_indices[quality]
+        score_at_root[rooted_mask] = score
+
+    # mask of the pitch classes that are (equally) the best root of each mask
+    root_candidates = array("H", [0] * PITCH_CLASS_SETS)
+    for mask in range(1, PITCH_CLASS_SETS):
+        scores = {
+            root: score_at_root[transpose_mask(mask, -root)]
+            for root in pitch_classes_in(mask)
+        }
+        best_score = min(scores.values())
+        root_candidates[mask] = pitch_class_mask(
+            root for root, score in scores.items() if score == best_score
+        )
+    return qualities, quality_at_root, root_candidates
+
+
+def chord_root_candidates(mask: int) -> list[int]:
+    """Pitch classes that explain the chord equally well as its root, e.g. all four of a °7 chord."""
+    _, _, root_candidates = _tables()
+    return pitch_classes_in(root_candidates[mask])
+
+
+def chord_root(mask: int, bass: int | None = None) -> int | None:
+    """Best root of the chord, preferring the bass among equally good candidates."""
+    _, _, root_candidates = _tables()
+    candidates = root_candidates[mask]
+    if candidates == 0:
+        return None
+    if bass is not None and candidates & (1 << bass):
+        return bass
+    return pitch_classes_in(candidates)[0]
+
+
+def chord_quality(mask: int, root: int) -> str | None:
+    """Quality suffix of the chord built on `root`, e.g. "Maj7" or "min9". None if it's too small to be a chord."""
+    if bin(mask).count("1") < MIN_CHORD_PITCH_CLASSES or not mask & (1 << root):
+        return None
+    qualities, quality_at_root, _ = _tables()
+    return qualities[quality_at_root[transpose_mask(mask, -root)]]
+
+
+def _test_chord_table():
+    def mask_of(*pitch_classes: int) -> int:
+        return pitch_class_mask(pitch_classes)
+
+    # every set of pitch classes big enough to be a chord gets named from one of its own pitch classes
+    for mask in range(PITCH_CLASS_SETS):
+        root = chord_root(mask)
+        if mask == 0:
+            assert root is None
+            continue
+        assert root is not None and mask & (1 << root), f"{mask:012b}: bad root {root}"
+        quality = chord_quality(mask, root)
+        if bin(mask).count("1") < MIN_CHORD_PITCH_CLASSES:
+            assert quality is None
+        else:
+            assert quality is not None, f"{mask:012b}: no quality"
+        # naming doesn't depend on key
+        for steps in range(PITCH_CLASSES):
+            transposed = transpose_mask(mask, steps)
+            assert chord_root(transposed) in [
+                (candidate + steps) % PITCH_CLASSES
+                for candidate in chord_root_candidates(mask)
+            ]
+            assert chord_quality(transposed, (root + steps) % PITCH_CLASSES) == quality
+
+    expected = {
+        # (pitch classes): (root, quality)
+        (0, 4, 7): (0, "Maj"),
+        (2, 5, 9): (2, "min"),
+        (11, 2, 5): (11, "dim"),
+        (0, 5, 7): (0, "sus4"),
+        (0, 4, 7, 11): (0, "Maj7"),
+        (7, 11, 2, 5): (7, "7"),
+        (9, 0, 4, 7): (9, "min7"),  # not C6
+        (11, 2, 5, 9): (11, "ø7"),
+        (0, 3, 7, 11): (0, "mM7"),
+        (7, 11, 5): (7, "7"),
+        (0, 4, 7, 11, 2): (0, "Maj9"),
+        (0, 3, 7, 10, 2): (0, "min9"),
+        (7, 11, 2, 5, 9): (7, "9"),
+        (7, 11, 2, 5, 8): (7, "7♭9"),
+        (7, 11, 2, 5, 4): (4, "min7♭9"),  # E G B D F is stacked thirds from E
+        (0, 4, 7, 10, 5): (0, "7add11"),
+        (0, 4, 7, 2): (0, "Majadd9"),
+    }
+    for pitch_classes, (root, quality) in expected.items():
+        mask = mask_of(*pitch_classes)
+        assert chord_root(mask) == root, f"{pitch_classes}: root {chord_root(mask)} != {root}"
+        assert chord_quality(mask, root) == quality, f"{pitch_classes}: {chord_quality(mask, root)} != {quality}"
+
+    # symmetric chords take the bass as root
+    assert chord_root_candidates(mask_of(0, 3, 6, 9)) == [0, 3, 6, 9]
+    assert chord_root(mask_of(0, 3, 6, 9), bass=6) == 6
+    assert chord_quality(mask_of(0, 3, 6, 9), 6) == "°7"
+    assert chord_root(mask_of(0, 4, 8), bass=4) == 4
+
+
+if __name__ == "__main__":
+    _test_chord_table()
+    print(f"{len(_tables()[0])} distinct chord qualities")
@@ -0,0 +1,23 @@
+from dataclasses import dataclass
+
+from music.chord_table import pitch_classes_in
+
+
+@dataclass(frozen=True, slots=True)
+class KeyMask:
+    """Pitch classes of a key as a 12-bit mask (bit n = pitch class n)."""
+
+    tonic: int  # pitch class of the tonic
+    ionian_root: int  # pitch class of the tonic of the key's ionian (major) mode
+    mask: int
+
+    def __contains__(self, pitch_class: int) -> bool:
+        return bool(self.mask & (1 << pitch_class))
+
+    def pitch_classes(self) -> list[int]:
+        return pitch_classes_in(self.mask)
+
+    def changed_pitch_classes(self, other: "KeyMask") -> int:
+        """Mask of the pitch classes that are in exactly one of the two keys."""
+        return self.mask ^ other.mask
+
@@ -0,0 +1,100 @@
+from music21.common.types import OffsetQL
+
+from music.key_mask import KeyMask
+
+# small stand-ins for the music21 objects in MusicData, holding only what widgets and export read.
+# they don't refer back to the parsed score, so it can be freed once MusicData is built (see MusicData.detach()).
+# attributes are named like their music21 counterparts, so code reading MusicData works with either.
+# not dataclasses: dataclasses.asdict() (used by export_json._export_via_asdict()) would turn them into dicts.
+
+
+class PitchRecord:
+    __slots__ = ("pitchClass", "nameWithOctave", "name", "midi", "_type")
+
+    def __init__(self, pitchClass: int, nameWithOctave: str, name: str, midi: int, _type: str = "Pitch"):
+        self.pitchClass = pitchClass
+        self.nameWithOctave = nameWithOctave
+        self.name = name
+        self.midi = midi
+        self._type = _type  # class name of the music21 object this stands for
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} {self.nameWithOctave}>"
+
+
+class NoteRecord:
+    __slots__ = ("pitch", "quarterLength", "_type")
+
+    def __init__(self, pitch: PitchRecord, quarterLength: OffsetQL, _type: str = "Note"):
+        self.pitch = pitch
+        self.quarterLength = quarterLength
+        self._type = _type
+
+    @property
+    def pitchClass(self) -> int:
+        return self.pitch.pitchClass
+
+    @property
+    def nameWithOctave(self) -> str:
+        return self.pitch.nameWithOctave
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} {self.nameWithOctave} {self.quarterLength}>"
+
+
+class ChordRecord:
+    """A chord along with its names and root, which can't be worked out again without the music21 chord."""
+
+    __slots__ = ("notes", "quarterLength", "root", "display_custom", "pitched_common_name", "_type")
+
+    def __init__(
+        self,
+        notes: tuple[NoteRecord, ...],
+        quarterLength: OffsetQL,
+        root: PitchRecord | None,
+        display_custom: str | None,  # see utils.display_chord_short_custom()
+        pitched_common_name: str,
+        _type: str = "Chord",
+    ):
+        self.notes = notes
+        self.quarterLength = quarterLength
+        self.root = root
+        self.display_custom = display_custom
+        self.pitched_common_name = pitched_common_name
+        self._type = _type
+
+    @property
+    def pitches(self) -> tuple[PitchRecord, ...]:
+        return tuple(n.pitch for n in self.notes)
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} {' '.join(p.nameWithOctave for p in self.pitches)}>"
+
+
+class KeyRecord:
+    __slots__ = ("name", "mode", "tonic", "mask", "_type")
+
+    def __init__(self, name: str, mode: str, tonic: PitchRecord, mask: KeyMask, _type: str = "Key"):
+        self.name = name
+        self.mode = mode
+        self.tonic = tonic  # with an octave, like Key.pitchFromDegree(1)
+        self.mask = mask
+        self._type = _type
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} {self.name}>"
+
+
+class PartRecord:
+    """Hashed by identity like a music21 Part, since it's used as a dict key."""
+
+    __slots__ = ("id", "partName", "is_staff", "_type")
+
+    def __init__(self, id: str, partName: str | None, is_staff: bool, _type: str = "Part"):
+        self.id = id
+        self.partName = partName
+        self.is_staff = is_staff  # one staff of a multi-staff part, i.e. a PartStaff
+        self._type = _type
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} {self.id}>"
@@ -1,36 +1,51 @@
 # std library
+import io
 import re
-import json
+import logging
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right
+from collections.abc import MutableMapping, Sequence
+from concurrent.futures import ProcessPoolExecutor
 from collections import defaultdict
-from dataclasses import dataclass, asdict, field
+from dataclasses import dataclass, field
+from functools import cached_property
+from enum import Enum
 from fractions import Fraction
 from itertools import groupby
-from typing import Any, Callable, Generic, TypeVar
+from operator import itemgetter
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Generic, TextIO, TypeVar
+from xml.etree import ElementTree
 
 # 3rd party library
 from music import music_constants
+from music.records import ChordRecord, KeyRecord, NoteRecord, PartRecord, PitchRecord
 from music21 import converter
 from music21.base import Music21Object
 from music21.chord import Chord
+from music21.common.numberTools import opFrac
 from music21.common.types import OffsetQL
+from music21.expressions import TextExpression
 from music21.harmony import ChordSymbol, NoChord
 from music21.key import KeySignature, Key
 from music21.note import Lyric, Note, NotRest
 from music21.pitch import Pitch
-from music21.search.lyrics import LyricSearcher
 from music21.stream import Stream, Score, Part, PartStaff, Measure
+from music21.tempo import MetronomeMark
 import regex as re  # stdlib re doesn't support multiple named capture groups with the same name, i use it below
 
 # project files
 from utils import (
+    CHORD_NAME_CACHE,
     display_chord_short,
-    display_chord_short_custom,
     eq_unique,
     extract_pitches,
     get_chord_root,
+    get_key_mask,
     copy_timing,
     timing_from,
     get_unique_offsets,
+    slice_sorted,
     assert_not_none,
     group_or_default,
     frange,
@@ -43,6 +58,21 @@ from utils import (
     display_id,
 )
 
+# log setup
+logger = logging.getLogger(__name__)
+
+# bump whenever extraction output changes, to invalidate cached parse results
+PARSER_VERSION = 7
+
+# tempo of scores without any metronome marks, in quarter notes per minute
+DEFAULT_BPM = 180.0
+
+# words of gradual tempo changes, lowercase and without their trailing "." (e.g. "poco rit." has "rit")
+ACCELERANDO_WORDS = frozenset({"accel", "accelerando", "stringendo"})
+RITARDANDO_WORDS = frozenset({"rit", "ritard", "ritardando", "rall", "rallentando", "allarg", "allargando"})
+# texts going back to the tempo from before a gradual change
+A_TEMPO_TEXTS = ("a tempo", "tempo i", "tempo primo")
+
 # TODO: replace 'a' with a different letter since 'a' is a valid chord :(
 DEFAULT_CHORD_SYMBOL = ChordSymbol(kindStr="ma")
 
@@ -58,68 +88,215 @@ class MusicDataTiming(Generic[MusicInfo]):
     _type: str = ''
 
     def __post_init__(self):
-        self._type = f"{self.__class__.__name__}[{self.elem.__class__.__name__}]" # TODO: try to get generic showing?
+        # records (see MusicData.detach()) stand in for a music21 class, and are named after it
+        elem_type = getattr(self.elem, "_type", self.elem.__class__.__name__)
+        self._type = f"{self.__class__.__name__}[{elem_type}]" # TODO: try to get generic showing?
+
+
+class TimingView(Sequence):
+    """Read-only window onto a list of timings, shifted by `offset_shift` / `time_shift` as they're read.
+    The list itself is never copied or modified, so timings shared with other lists (or other views) stay intact."""
+
+    # stands in for a list, e.g. as the syllables of a lyric word (see MusicDataTiming.__post_init__())
+    _type = "list"
+
+    def __init__(
+        self,
+        timings: "list[MusicDataTiming] | TimingView",
+        indices: range | list[int],
+        offset_shift: OffsetQL = 0,
+        time_shift: float = 0,
+    ):
+        if isinstance(timings, TimingView):
+            # view of a view: index straight into the underlying list instead of stacking views
+            indices = (
+                timings._indices[indices]
+                if isinstance(indices, range) and isinstance(timings._indices, range)
+                else [timings._indices[idx] for idx in indices]
+            )
+            offset_shift += timings._offset_shift
+            time_shift += timings._time_shift
+            timings = timings._timings
+        self._timings = timings
+        self._indices = indices
+        self._offset_shift = offset_shift
+        self._time_shift = time_shift
+
+    def __len__(self) -> int:
+        return len(self._indices)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return TimingView(self, range(len(self))[idx])
+        return self._shifted(self._timings[self._indices[idx]])
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+    def _shifted(
+        self, timing: MusicDataTiming, memo: dict[int, MusicDataTiming] | None = None
+    ) -> MusicDataTiming:
+        if self._offset_shift == 0 and self._time_shift == 0:
+            return timing
+        if memo is not None and id(timing) in memo:
+            return memo[id(timing)]
+        elem = timing.elem
+        if isinstance(elem, (list, TimingView)):
+            # a lyric word's syllables move along with it
+            elem = TimingView(elem, range(len(elem)), self._offset_shift, self._time_shift)
+            if memo is not None:
+                elem = elem.materialize(memo)
+        shifted = MusicDataTiming(
+            elem=elem,
+            offset=timing.offset - self._offset_shift,
+            time=timing.time - self._time_shift if timing.time is not None else None,
+        )
+        if memo is not None:
+            memo[id(timing)] = shifted
+        return shifted
+
+    def materialize(
+        self, memo: dict[int, MusicDataTiming] | None = None
+    ) -> list[MusicDataTiming]:
+        """Plain list of (shifted copies of) the timings in view.
+        Timings found through more than one view sharing a `memo` are copied once, and stay shared."""
+        if memo is None:
+            memo = {}
+        return [self._shifted(self._timings[idx], memo) for idx in self._indices]
+
+
+def tempos_in_range(
+    tempos: "list[MusicDataTiming] | TimingView", attr: str, start: Any, end: Any
+) -> range:
+    """Indices of the tempos (or tempo ramps) set within `start <= <attr> <= end`, and of the one already set at
+    `start`, if any."""
+    key = lambda timing: getattr(timing, attr)
+    lo = max(bisect_right(tempos, start, key=key) - 1, 0)
+    return range(lo, bisect_right(tempos, end, lo=lo, key=key))
+
+
+@dataclass(frozen=True)
+class TempoRamp:
+    """A gradual tempo change (accel. or rit.) from the tempo at its offset to `bpm`, reached `quarterLength` later.
+    How the tempo gets there is up to the timing stage, see timing.TempoCurve."""
+
+    quarterLength: OffsetQL
+    bpm: float  # quarter notes per minute
+    _type: str = "TempoRamp"
 
 
 # data transfer class
 @dataclass
 class MusicData:
     # new ones
-    chords: list[MusicDataTiming[Chord]]
-    all_notes: list[MusicDataTiming[Note]]
-    all_notes_by_part: dict[Part, list[MusicDataTiming[Note]]]
+    # (music21 objects, or records of them once detached)
+    chords: list[MusicDataTiming[Chord | ChordRecord]]
+    all_notes: list[MusicDataTiming[Note | NoteRecord]]
+    all_notes_by_part: dict[Part | PartRecord, list[MusicDataTiming[Note | NoteRecord]]]
     lyrics: list[MusicDataTiming[list[MusicDataTiming[str]]]]
-    keys: list[MusicDataTiming[Key]]
-    bpm: float = 180  # object = None  # TODO: what would this look like?
+    keys: list[MusicDataTiming[Key | KeyRecord]]
+    bpm: float = DEFAULT_BPM  # until the first of `tempos`, in quarter notes per minute
+    # each tempo change (from MetronomeMarks), in quarter notes per minute, see timing.TempoMap
+    tempos: list[MusicDataTiming[float]] = field(default_factory=list)
+    # each accel. and rit. that reaches a metronome mark, see timing.TempoMap
+    tempo_ramps: list[MusicDataTiming[TempoRamp]] = field(default_factory=list)
     comments: object = None  # TODO: what would this look like?
 
     # overridden in __post_init__()
-    chord_roots: list[MusicDataTiming[Pitch|None]] = field(default_factory=list)
+    chord_roots: list[MusicDataTiming[Pitch|PitchRecord|None]] = field(default_factory=list)
     _type: str = ''
 
     def __post_init__(self):
-        self.chord_roots = [
-            MusicDataTiming(
-                elem=get_chord_root(chord_info.elem),
-                offset=chord_info.offset,
-                time=chord_info.time,
-            )
-            for chord_info in self.chords
-            if len(chord_info.elem.pitches) > 0
-        ]
+        if not self.chord_roots:
+            self.chord_roots = [
+                MusicDataTiming(
+                    elem=get_chord_root(chord_info.elem),
+                    offset=chord_info.offset,
+                    time=chord_info.time,
+                )
+                for chord_info in self.chords
+                if len(chord_info.elem.pitches) > 0
+            ]
         self._type = self.__class__.__name__
 
     @staticmethod
     def from_score(m21_score: Score):
+        return MusicData.from_extraction(ScoreExtraction.from_score(m21_score))
+
+    @staticmethod
+    def from_extraction(
+        extraction: "ScoreExtraction",
+        process_range: "ProcessChordAnnotation | None" = None,
+    ):
+        all_notes, all_notes_by_part = extraction.notes.result()
+        tempos = extraction.tempos.result()
         return MusicData(
-            chords=extract_harmonic_clusters(m21_score),
-            all_notes=extract_notes_with_offset(m21_score),
+            chords=extract_harmonic_clusters(
+                extraction.parts,
+                extraction.highest_time,
+                extraction.chord_symbols.result(),
+                extraction.harmonic_elements,
+                process_range or process_chord_annotation,
+            ),
+            all_notes=all_notes,
+            all_notes_by_part=all_notes_by_part,
+            lyrics=extraction.lyrics.result(),
+            keys=extraction.keys.result(),
+            bpm=tempos[0].elem if tempos else DEFAULT_BPM,
+            tempos=tempos,
+            tempo_ramps=extraction.tempos.ramps(),
+        )
+
+    def detach(
+        self, elem_cache: MutableMapping[int, tuple[Any, Any]] | None = None
+    ) -> "MusicData":
+        """Copy with every music21 object swapped for a record of just what widgets use (see music/records.py).
+        Nothing in the copy refers to the parsed score, so the score can be freed.
+        `elem_cache` keeps (elem, record) by id(elem) across calls, for elems shared with earlier parses."""
+        # timings listed in more than one place (e.g. all_notes and all_notes_by_part) stay shared
+        detached_timings: dict[int, MusicDataTiming] = {}
+
+        def detach_cached(elem: Any) -> Any:
+            if elem_cache is None:
+                return detach_elem(elem)
+            cached = elem_cache.get(id(elem))
+            # the elem is kept alongside, in case its id now belongs to another object
+            if cached is not None and cached[0] is elem:
+                return cached[1]
+            detached = detach_elem(elem)
+            elem_cache[id(elem)] = (elem, detached)
+            return detached
+
+        def detach_timing(timing: MusicDataTiming) -> MusicDataTiming:
+            detached = detached_timings.get(id(timing))
+            if detached is None:
+                elem = timing.elem
+                if isinstance(elem, list):
+                    # a lyric word's syllables
+                    elem = [detach_timing(syllable) for syllable in elem]
+                elif elem is not None and not isinstance(elem, (str, float, TempoRamp)):
+                    elem = detach_cached(elem)
+                detached = detached_timings[id(timing)] = MusicDataTiming(
+                    elem=elem, offset=timing.offset, time=timing.time
+                )
+            return detached
+
+        music_data = MusicData(
+            chords=[detach_timing(t) for t in self.chords],
+            all_notes=[detach_timing(t) for t in self.all_notes],
             all_notes_by_part={
-                part: extract_notes_with_offset(part) for part in m21_score.parts
+                detach_part(part): [detach_timing(t) for t in part_e]
+                for part, part_e in self.all_notes_by_part.items()
             },
-            lyrics=extract_lyrics(m21_score),
-            keys=extract_keys(m21_score),
+            lyrics=[detach_timing(t) for t in self.lyrics],
+            keys=[detach_timing(t) for t in self.keys],
+            bpm=self.bpm,
+            tempos=[detach_timing(t) for t in self.tempos],
+            tempo_ramps=[detach_timing(t) for t in self.tempo_ramps],
+            comments=self.comments,
+            chord_roots=[detach_timing(t) for t in self.chord_roots],
         )
-
-    def _modify_by_func(
-        self,
-        modify_func: Callable[[MusicDataTiming[MusicInfo]], None],
-    ) -> None:
-        for e in self.chords:
-            modify_func(e)
-        for e in self.all_notes:
-            modify_func(e)
-        for part, part_e in self.all_notes_by_part.items():
-            for e in part_e:
-                modify_func(e)
-        for lyric_e in self.lyrics:
-            modify_func(lyric_e)
-            for lyric_syl_e in lyric_e.elem:
-                modify_func(lyric_syl_e)
-        for e in self.keys:
-            modify_func(e)
-        for e in self.chord_roots:
-            modify_func(e)
+        return music_data
 
     # def _replace_by_func(
     #     self,
@@ -146,50 +323,92 @@ class MusicData:
     #         lyrics=lyrics,
     #     )
 
-    def _filter_by_func(
-        self, filter_func: Callable[[MusicDataTiming], bool]
+    def _filter_by_key(
+        self, attr: str, start: Any, end: Any, offset_shift: OffsetQL, time_shift: float
     ) -> "MusicData":
+        """Views of everything with `start <= <attr> <= end`, found by binary search since every list is sorted by time.
+        Lyric words are kept whole if any of their syllables is in range, and the tempo (and tempo ramp) at `start`
+        is kept too."""
+        key = lambda timing: getattr(timing, attr)
+
+        def window(timings: "list[MusicDataTiming] | TimingView") -> TimingView:
+            lo = bisect_left(timings, start, key=key)
+            hi = bisect_right(timings, end, lo=lo, key=key)
+            return TimingView(timings, range(lo, hi), offset_shift, time_shift)
+
+        # words starting in range are in, and so are earlier words still going when the range starts
+        words = self.lyrics
+        reach = self._lyric_reach(attr)
+        first_reaching = bisect_left(reach, start)
+        first_starting = bisect_left(words, start, lo=first_reaching, key=key)
+        last = bisect_right(words, end, lo=first_starting, key=key)
+        word_indices = [
+            idx
+            for idx in range(first_reaching, first_starting)
+            if any(start <= getattr(syllable, attr) <= end for syllable in words[idx].elem)
+        ]
+        word_indices.extend(range(first_starting, last))
+
         return MusicData(
-            chords=list(filter(filter_func, self.chords)),
-            all_notes=list(filter(filter_func, self.all_notes)),
+            chords=window(self.chords),
+            all_notes=window(self.all_notes),
             all_notes_by_part={
-                part: list(filter(filter_func, part_e))
-                for part, part_e in self.all_notes_by_part.items()
+                part: window(part_e) for part, part_e in self.all_notes_by_part.items()
             },
-            lyrics=list(
-                filter(
-                    lambda lyric_info: any(
-                        filter_func(syl_info) for syl_info in lyric_info.elem
-                    ),
-                    self.lyrics,
-                )
+            lyrics=TimingView(words, word_indices, offset_shift, time_shift),
+            keys=window(self.keys),
+            bpm=self.bpm,
+            tempos=TimingView(
+                self.tempos, tempos_in_range(self.tempos, attr, start, end), offset_shift, time_shift
+            ),
+            tempo_ramps=TimingView(
+                self.tempo_ramps, tempos_in_range(self.tempo_ramps, attr, start, end), offset_shift, time_shift
             ),
-            keys=list(filter(filter_func, self.keys)),
+            comments=self.comments,
+            chord_roots=window(self.chord_roots),
         )
 
-    def filter_by_beat_range(self, beat_start: float, beat_end: float) -> "MusicData":
-
-        def is_in_beat_range(e: MusicDataTiming) -> bool:
-            return e.offset >= beat_start and e.offset <= beat_end
-
-        def subtract_beat_start(e: MusicDataTiming) -> None:
-            e.offset -= beat_start
+    def _lyric_reach(self, attr: str) -> list:
+        """Running max over lyric words of their last syllable's `attr`, so it's sorted and can be binary searched."""
+        reach = self._lyric_reach_cache.get(attr)
+        if reach is None:
+            reach = []
+            for word in self.lyrics:
+                word_end = max(getattr(syllable, attr) for syllable in word.elem)
+                reach.append(word_end if not reach else max(reach[-1], word_end))
+            self._lyric_reach_cache[attr] = reach
+        return reach
+
+    @cached_property
+    def _lyric_reach_cache(self) -> dict[str, list]:
+        # not a dataclass field, so it isn't exported
+        return {}
 
-        filtered = self._filter_by_func(is_in_beat_range)
-        filtered._modify_by_func(subtract_beat_start)
-        return filtered
+    def filter_by_beat_range(self, beat_start: float, beat_end: float) -> "MusicData":
+        return self._filter_by_key("offset", beat_start, beat_end, beat_start, 0)
 
     def filter_by_time_range(self, time_start: float, time_end: float) -> "MusicData":
-
-        def is_in_time_range(e: MusicDataTiming) -> bool:
-            return e.time >= time_start and e.time <= time_end
-
-        def subtract_time_start(e: MusicDataTiming) -> None:
-            e.time -= time_start
-
-        filtered = self._filter_by_func(is_in_time_range)
-        filtered._modify_by_func(subtract_time_start)
-        return filtered
+        return self._filter_by_key("time", time_start, time_end, 0, time_start)
+
+    def materialize(self) -> None:  # modify in place
+        """Turn any views left by filtering into plain lists, so their timings can be modified in place."""
+        memo: dict[int, MusicDataTiming] = {}
+
+        def as_list(timings):
+            return timings.materialize(memo) if isinstance(timings, TimingView) else timings
+
+        self.chords = as_list(self.chords)
+        self.all_notes = as_list(self.all_notes)
+        self.all_notes_by_part = {
+            part: as_list(part_e) for part, part_e in self.all_notes_by_part.items()
+        }
+        self.lyrics = as_list(self.lyrics)
+        self.keys = as_list(self.keys)
+        self.tempos = as_list(self.tempos)
+        self.tempo_ramps = as_list(self.tempo_ramps)
+        self.chord_roots = as_list(self.chord_roots)
+        # timings may be about to change
+        self._lyric_reach_cache.clear()
 
     def __str__(self) -> str:
         return f"""MusicData
@@ -200,134 +419,251 @@ lyrics: len={len(self.lyrics)}, elems={self.lyrics}
 keys: len={len(self.keys)}, elems={self.keys}
 """
 
-    def export(self, indent: str='  ') -> str:
-
-        def _convert_special_objs(obj):
-            def convert_pitch(p: Pitch) -> dict:
-                return {
-                    "pitchClass": p.pitchClass,
-                    "pitchName": p.nameWithOctave,
-                    '_type': 'Pitch',
-                }
-
-            def convert_note(n: Note, include_quarter_length: bool=True) -> dict:
-                disp: dict = {
-                    'pitch': convert_pitch(n.pitch),
-                    '_type': 'Note',
-                }
-                if include_quarter_length:
-                    disp['quarterLength'] = n.quarterLength
-                return disp
-
-            def convert_chord(c: Chord) -> dict:
-                return {
-                    'notes': [convert_note(n, include_quarter_length=False) for n in c.notes],
-                    'name': display_chord_short_custom(c),
-                    'quarterLength': c.quarterLength,
-                    '_type': 'Chord',
-                }
-
-            def convert_part(p: Part) -> str:
-                if isinstance(p, PartStaff):
-                    # assuming p.id is a string like "P3-Staff2"
-                    # TODO: this is making a lot of assumptions, maybe test other cases or find a better way to distinguish PartStaff groups?
-                    return f"{p.partName}-{str(p.id).split('-')[1]}"
-                else:
-                    return p.partName
-
-            def convert_key(k: Key) -> dict:
-                return {
-                    'name': k.name.replace('-', '♭').replace('+', '♯'),
-                    'pitch': convert_pitch(k.pitchFromDegree(1)),
-                    'quality': k.mode,
-                    'pitches': list(set(p.pitchClass for p in k.getPitches())),
-                    '_type': 'Key',
-                }
-
-            if isinstance(obj, Chord):
-                return convert_chord(obj)
-            if isinstance(obj, Note):
-                return convert_note(obj)
-            if isinstance(obj, Pitch):
-                return convert_pitch(obj)
-            if isinstance(obj, Part):
-                return convert_part(obj)
-            if isinstance(obj, Key):
-                return convert_key(obj)
-
-            raise TypeError()
-
-        def _convert_or_leave(obj):
-            try:
-                return _convert_special_objs(obj)
-            except TypeError:
-                return obj
-
-        class CustomEncoder(json.JSONEncoder):
-
-            def encode(self, o):
-                # print(f"{o=}")
-                if isinstance(o, dict):
-                    new_dict = {}
-                    for k, v in o.items():
-                        # print(f"{k=}, {v=}")
-                        k = _convert_or_leave(k)
-                        new_dict[k] = v
-                    return super().encode(new_dict)
-                return super().encode(o)
-
-            def default(self, o):
-                try:
-                    return _convert_special_objs(o)
-                except TypeError:
-                    # Let the base class default method raise a TypeError for unhandled types
-                    return json.JSONEncoder.default(self, o)
-
-
-        def preprocess(e):
-            e = _convert_or_leave(e)
-            if isinstance(e, dict):
-                new_d = {}
-                for k, v in e.items():
-                    new_d[preprocess(k)] = preprocess(v)
-                return new_d
-            elif isinstance(e, list):
-                return [preprocess(o) for o in e]
-            else:
-                return e
-
-
-        # TODO: bother python maintainers to actually apply default handler on dict keys :(((
-        d = preprocess(asdict(self))
-        # print(d)
-        return json.dumps(d, indent=indent, cls=CustomEncoder)
-
-
-def extract_notes_with_offset(
-    m21_root: Stream,
-) -> list[MusicDataTiming[Note]]:
-    notes: list[MusicDataTiming[Note]] = []
-    for notRest in m21_root.recurse().getElementsByClass(NotRest):
-        if isinstance(notRest, Note):
-            notes.append(
-                MusicDataTiming(
-                    elem=notRest,
-                    offset=notRest.getOffsetInHierarchy(m21_root),
-                )
-            )
-        elif isinstance(notRest, Chord):
-            m21_chord: Chord = notRest
-            notes.extend(
-                MusicDataTiming(
-                    elem=note,
-                    offset=m21_chord.getOffsetInHierarchy(m21_root),
-                )
-                for note in m21_chord.notes
+    def export(
+        self, indent: str | None = '  ', layout: "ExportLayout | None" = None
+    ) -> str:
+        """JSON of everything, or compact JSON with `indent=None`."""
+        out = io.StringIO()
+        self.export_to(out, indent, layout)
+        return out.getvalue()
+
+    def export_to(
+        self,
+        out: TextIO,
+        indent: str | None = '  ',
+        layout: "ExportLayout | None" = None,
+        source: "MusicDataSource | None" = None,
+    ) -> None:
+        """Write `export()`'s JSON to `out` as it's produced, with `source` as its header if given."""
+        # imported here since export_json builds on this module
+        from export_json import export_music_data
+
+        export_music_data(self, out, indent, layout or ExportLayout.full, source)
+
+    def export_binary_to(self, out: BinaryIO) -> None:
+        """Write everything in `export()` as memory-mappable tables, see export_binary.py."""
+        # imported here since export_binary builds on this module
+        from export_binary import export_music_data_binary
+
+        export_music_data_binary(self, out)
+
+
+def detach_pitch(p: Pitch) -> PitchRecord:
+    return PitchRecord(
+        pitchClass=p.pitchClass,
+        nameWithOctave=p.nameWithOctave,
+        name=p.name,
+        midi=p.midi,
+        _type=type(p).__name__,
+    )
+
+
+def detach_note(n: Note) -> NoteRecord:
+    return NoteRecord(pitch=detach_pitch(n.pitch), quarterLength=n.quarterLength, _type=type(n).__name__)
+
+
+def detach_chord(c: Chord) -> ChordRecord:
+    chord_naming = CHORD_NAME_CACHE.get(c)
+    root = get_chord_root(c)
+    return ChordRecord(
+        notes=tuple(detach_note(n) for n in c.notes),
+        quarterLength=c.quarterLength,
+        root=detach_pitch(root) if root is not None else None,
+        display_custom=chord_naming.display_custom,
+        pitched_common_name=chord_naming.pitched_common_name,
+        _type=type(c).__name__,
+    )
+
+
+def detach_key(k: Key) -> KeyRecord:
+    return KeyRecord(
+        name=k.name,
+        mode=k.mode,
+        tonic=detach_pitch(k.pitchFromDegree(1)),
+        mask=get_key_mask(k),
+        _type=type(k).__name__,
+    )
+
+
+def detach_part(p: Part | PartRecord) -> PartRecord:
+    if isinstance(p, PartRecord):
+        return p
+    return PartRecord(
+        id=p.id,
+        partName=p.partName,
+        is_staff=isinstance(p, PartStaff),
+        _type=type(p).__name__,
+    )
+
+
+def detach_elem(elem: Any) -> Any:
+    if isinstance(elem, (PitchRecord, NoteRecord, ChordRecord, KeyRecord, PartRecord)):
+        # already detached
+        return elem
+    if isinstance(elem, Chord):
+        return detach_chord(elem)
+    if isinstance(elem, Note):
+        return detach_note(elem)
+    if isinstance(elem, Pitch):
+        return detach_pitch(elem)
+    if isinstance(elem, Key):
+        return detach_key(elem)
+    raise TypeError(f"don't know how to detach {type(elem)}")
+
+
+class ScoreExtractor(ABC):
+    """Collects one kind of music information while `walk_score()` visits every element of a score once.
+    Subclasses set `classes` to the element types they want dispatched to `visit()`."""
+
+    classes: tuple[type, ...] = (Music21Object,)
+
+    @abstractmethod
+    def visit(
+        self, el: Music21Object, offset: OffsetQL, part: Part | None
+    ) -> None:  # offset is relative to the score; part is None outside of any Part
+        ...
+
+    @abstractmethod
+    def merge(self, other: "ScoreExtractor") -> None:
+        """Fold in what `other` collected from parts that come after this one's in the score."""
+        ...
+
+
+def walk_score(
+    m21_score: Score,
+    extractors: list[ScoreExtractor],
+    part_key: Callable[[Part], Part] = lambda part: part,
+) -> None:
+    """Single traversal of `m21_score`, dispatching each element to every interested extractor.
+    `part_key` picks what extractors are given as the part an element belongs to."""
+    for top_el in m21_score:
+        top_offset = top_el.offset
+        part = part_key(top_el) if isinstance(top_el, Part) else None
+        dispatch_element(extractors, top_el, top_offset, part)
+        if not isinstance(top_el, Stream):
+            continue
+        el_iter = top_el.recurse()
+        for el in el_iter:
+            dispatch_element(
+                extractors, el, top_offset + el_iter.currentHierarchyOffset(), part
             )
-    return sorted(notes, key=lambda t: t.offset)
 
 
-def extract_chord_symbols(m21_score: Score) -> tuple[
+def dispatch_element(
+    extractors: list[ScoreExtractor],
+    el: Music21Object,
+    offset: OffsetQL,
+    part: Part | None,
+) -> None:
+    """Hand `el` to every extractor interested in its class."""
+    for extractor in extractors:
+        if isinstance(el, extractor.classes):
+            extractor.visit(el, offset, part)
+
+
+class NoteExtractor(ScoreExtractor):
+    """All notes in the score, and again per part. Chords are split into their notes."""
+
+    classes = (Part, NotRest)
+
+    all_notes: list[MusicDataTiming[Note]]
+    all_notes_by_part: dict[Part, list[MusicDataTiming[Note]]]
+
+    def __init__(self):
+        self.all_notes = []
+        self.all_notes_by_part = {}
+
+    def visit(self, el: Music21Object, offset: OffsetQL, part: Part | None) -> None:
+        if isinstance(el, Part):
+            # make sure parts without any notes are still listed
+            self.all_notes_by_part[part] = []
+            return
+        notes: list[MusicDataTiming[Note]]
+        if isinstance(el, Note):
+            notes = [MusicDataTiming(elem=el, offset=offset)]
+        elif isinstance(el, Chord):
+            notes = [MusicDataTiming(elem=note, offset=offset) for note in el.notes]
+        else:
+            return
+        self.all_notes.extend(notes)
+        if part is not None:
+            self.all_notes_by_part[part].extend(notes)
+
+    def merge(self, other: "NoteExtractor") -> None:
+        self.all_notes.extend(other.all_notes)
+        self.all_notes_by_part.update(other.all_notes_by_part)
+
+    def result(
+        self,
+    ) -> tuple[list[MusicDataTiming[Note]], dict[Part, list[MusicDataTiming[Note]]]]:
+        return (
+            sorted(self.all_notes, key=lambda t: t.offset),
+            {
+                part: sorted(notes, key=lambda t: t.offset)
+                for part, notes in self.all_notes_by_part.items()
+            },
+        )
+
+
+class ChordSymbolExtractor(ScoreExtractor):
+    """(offset, chordSymbol, part) for all ChordSymbols in the parts of the score."""
+
+    classes = (ChordSymbol,)
+
+    chord_symbol_info: list[tuple[OffsetQL, ChordSymbol, Part]]
+
+    def __init__(self):
+        self.chord_symbol_info = []
+
+    def visit(self, el: Music21Object, offset: OffsetQL, part: Part | None) -> None:
+        if part is not None:
+            self.chord_symbol_info.append((offset, el, part))
+
+    def merge(self, other: "ChordSymbolExtractor") -> None:
+        self.chord_symbol_info.extend(other.chord_symbol_info)
+
+    def result(self) -> list[tuple[OffsetQL, ChordSymbol, Part]]:
+        return sorted(self.chord_symbol_info, key=lambda t: t[0])
+
+
+class HarmonicElementExtractor(ScoreExtractor):
+    """Everything harmonic analysis may cluster, as (offset, NotRest) per part, plus all measure start offsets."""
+
+    classes = (Measure, NotRest)
+
+    elements_by_part: dict[Part, list[tuple[OffsetQL, NotRest]]]
+    measure_offsets: set[OffsetQL]
+
+    def __init__(self):
+        self.elements_by_part = defaultdict(list)
+        self.measure_offsets = set()
+
+    def visit(self, el: Music21Object, offset: OffsetQL, part: Part | None) -> None:
+        if isinstance(el, Measure):
+            self.measure_offsets.add(offset)
+        elif part is not None and not isinstance(el, NoChord):
+            self.elements_by_part[part].append((offset, el))
+
+    def merge(self, other: "HarmonicElementExtractor") -> None:
+        self.elements_by_part.update(other.elements_by_part)
+        self.measure_offsets.update(other.measure_offsets)
+
+    def result(
+        self,
+    ) -> tuple[dict[Part, list[tuple[OffsetQL, NotRest]]], list[OffsetQL]]:
+        return (
+            {
+                part: sorted(elements, key=lambda t: t[0])
+                for part, elements in self.elements_by_part.items()
+            },
+            sorted(self.measure_offsets),
+        )
+
+
+def extract_chord_symbols(
+    parts: list[Part],
+    chord_symbol_info: list[tuple[OffsetQL, ChordSymbol, Part]],
+) -> tuple[
     # non-`x` chord symbol per part per offset
     list[
         tuple[
@@ -342,19 +678,9 @@ def extract_chord_symbols(m21_score: Score) -> tuple[
     #         set[Part],
     #     ]
     # ],
-    # list of specific offsets to exclude per part
+    # sorted list of specific offsets to exclude per part
     dict[Part, list[OffsetQL]],
 ]:
-    # (global offset, chordSymbol, part) for all chordSymbols in the score
-    chord_symbol_info = sorted(
-        (
-            (chord_symbol.getOffsetInHierarchy(part), chord_symbol, part)
-            for part in m21_score.parts
-            for chord_symbol in part.recurse().getElementsByClass(ChordSymbol)
-        ),
-        key=lambda t: t[0],
-    )
-
     # identify all non-`x` chord symbols
     harmonic_span_chord_symbol_info = list(
         filter(lambda t: t[1].chordKindStr.lower() != "x", chord_symbol_info)
@@ -378,7 +704,7 @@ def extract_chord_symbols(m21_score: Score) -> tuple[
         or chord_symbols_per_part_per_offset[0][0] > 0
     ):
         chord_symbols_per_part_per_offset.insert(
-            0, (0.0, {m21_score.parts.first(): DEFAULT_CHORD_SYMBOL})
+            0, (0.0, {parts[0]: DEFAULT_CHORD_SYMBOL})
         )
 
     # # identify all the `x` chord symbols
@@ -402,10 +728,11 @@ def extract_chord_symbols(m21_score: Score) -> tuple[
     #     for offset in x_unique_offsets
     # ]
 
-    # group the `x` symbols by part
-    x_offsets_per_part = defaultdict(lambda: [])
-    for _, part, chord_symbol in chord_symbol_info:
-        x_offsets_per_part[part].append(chord_symbol.getOffsetInHierarchy(m21_score))
+    # group the `x` symbols by part. chord_symbol_info is sorted, so each part's offsets are too
+    x_offsets_per_part: dict[Part, list[OffsetQL]] = defaultdict(list)
+    for offset, chord_symbol, part in chord_symbol_info:
+        if chord_symbol.chordKindStr.lower() == "x":
+            x_offsets_per_part[part].append(offset)
 
     return (
         chord_symbols_per_part_per_offset,
@@ -464,11 +791,44 @@ def _test_chord_annotation_pattern():
 # _test_chord_annotation_pattern()
 
 
+def _test_chords_same_across_runs(score_path: Path = Path(__file__).parent.parent / "test_scores" / "My Time.musicxml"):
+    import os
+    import subprocess
+    import sys
+
+    # pitch hashes depend on the string hash seed, so only separate runs show an unstable order
+    script = (
+        "import sys; from music21 import converter; from musicxml import MusicData; "
+        "sys.stdout.write(MusicData.from_score(converter.parse(sys.argv[1])).export())"
+    )
+    exports = {
+        subprocess.run(
+            [sys.executable, "-W", "ignore", "-c", script, str(score_path)],
+            env={**os.environ, "PYTHONHASHSEED": str(seed)},
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        for seed in range(3)
+    }
+    assert len(exports) == 1, "chords differ between runs"
+
+# _test_chords_same_across_runs()
+
+
+def chord_of_cluster(cluster: list[NotRest]) -> Chord:
+    return Chord(extract_pitches(cluster))
+
+
 def process_chord_annotation(
-    m21_score: Score,
+    parts: list[Part],
     range: tuple[OffsetQL, OffsetQL],
     chord_symbols: dict[Part, ChordSymbol],
-    x_symbols_2: dict[Part, list[OffsetQL]],
+    x_symbols_in_range: dict[Part, set[OffsetQL]],
+    harmonic_elements_by_part: dict[Part, list[tuple[OffsetQL, NotRest]]],
+    measure_offsets: list[OffsetQL],
+    chord_of_cluster: Callable[[list[NotRest]], Chord] = chord_of_cluster,
 ) -> list[MusicDataTiming[Chord]]:
 
     # Easy case: Chord is hard-coded
@@ -528,32 +888,39 @@ def process_chord_annotation(
         harmonic_parts = set(harmonic_parts_css.keys())
     else:
         # `a`, all parts
-        harmonic_parts = set(m21_score.parts)
+        harmonic_parts = set(parts)
 
     # --------remove x'd notes--------
     # remove specific NotRest entities on offsets+parts annotated with x
 
     # filter generator to strip out elements if they're x'd out
-    def filter_block_by_x_in_part(part: Part) -> Callable[[Music21Object], bool]:
-        if part not in x_symbols_2:
+    def filter_block_by_x_in_part(part: Part) -> Callable[[OffsetQL], bool]:
+        blocked_offsets = x_symbols_in_range.get(part)
+        if not blocked_offsets:
             return lambda _: True
-        blocked_offsets = x_symbols_2[part]
 
-        def filter_block_by_x(el: Music21Object) -> bool:
-            el_offset = el.getOffsetInHierarchy(part)
+        def filter_block_by_x(el_offset: OffsetQL) -> bool:
             return el_offset not in blocked_offsets
 
         return filter_block_by_x
 
     # Filter all the notes in each part by x's annotated in score
-    harmonic_elements = {
-        part: part.recurse()
-        .getElementsByClass(NotRest)
-        .getElementsNotOfClass(NoChord)
-        .getElementsByOffsetInHierarchy(range[0], range[1], includeEndBoundary=False)
-        .addFilter(filter_block_by_x_in_part(part))
-        for part in harmonic_parts
-    }
+    # (kept in score part order, and sorted by offset so each cluster below is a binary search)
+    harmonic_elements: dict[Part, list[tuple[OffsetQL, NotRest]]] = {}
+    for part in parts:
+        if part not in harmonic_parts:
+            continue
+        filter_block_by_x = filter_block_by_x_in_part(part)
+        harmonic_elements[part] = [
+            (el_offset, el)
+            for el_offset, el in slice_sorted(
+                harmonic_elements_by_part.get(part, []),
+                range[0],
+                range[1],
+                key=itemgetter(0),
+            )
+            if filter_block_by_x(el_offset)
+        ]
 
     # --------group notes into clusters--------
     # split out beat/measure repeats
@@ -565,16 +932,7 @@ def process_chord_annotation(
         cluster_starts = [range[0]]
     elif "m" in harmonic_rhythm_css.values():
         # one chord block per measure
-        cluster_starts = get_unique_offsets(
-            m21_score.recurse()
-            .getElementsByClass(Measure)
-            .getElementsByOffset(
-                range[0],
-                range[1],
-                includeEndBoundary=False,
-            ),
-            offsetSite=m21_score,
-        )
+        cluster_starts = slice_sorted(measure_offsets, range[0], range[1])
     else:
         # one chord block per offset range
         offset_step = Fraction(next(iter(harmonic_rhythm_css.values())))
@@ -595,11 +953,9 @@ def process_chord_annotation(
                 r_start,
                 [
                     el
-                    for partNotRests in harmonic_elements.values()
-                    for el in set(
-                        partNotRests.getElementsByOffsetInHierarchy(
-                            r_start, r_end, includeEndBoundary=False
-                        )
+                    for part_elements in harmonic_elements.values()
+                    for _, el in slice_sorted(
+                        part_elements, r_start, r_end, key=itemgetter(0)
                     )
                 ],
             )
@@ -612,14 +968,34 @@ def process_chord_annotation(
     # resolve into chords
     return [
         MusicDataTiming(
-            elem=Chord(extract_pitches(cluster)),
+            elem=chord_of_cluster(cluster),
             offset=offset,
         )
         for offset, cluster in harmonic_clusters
     ]
 
 
-def extract_harmonic_clusters(m21_score: Score) -> list[MusicDataTiming[Chord]]:
+# signature of process_chord_annotation(), for swapping in a cached version of it (see musicxml_incremental.py)
+ProcessChordAnnotation = Callable[
+    [
+        list[Part],
+        tuple[OffsetQL, OffsetQL],
+        dict[Part, ChordSymbol],
+        dict[Part, set[OffsetQL]],
+        dict[Part, list[tuple[OffsetQL, NotRest]]],
+        list[OffsetQL],
+    ],
+    list[MusicDataTiming[Chord]],
+]
+
+
+def extract_harmonic_clusters(
+    parts: list[Part],
+    highest_time: OffsetQL,
+    chord_symbol_info: list[tuple[OffsetQL, ChordSymbol, Part]],
+    harmonic_elements: "HarmonicElementExtractor",
+    process_range: ProcessChordAnnotation = process_chord_annotation,
+) -> list[MusicDataTiming[Chord]]:
     """
     Identify harmonic clusters with the help of ChordSymbol / NoChord annotations.
     Rules:
@@ -639,110 +1015,414 @@ def extract_harmonic_clusters(m21_score: Score) -> list[MusicDataTiming[Chord]]:
                 `a` means "all parts" (default)
                 `p` means "this part (and all others notated on this beat with `p`).
     """
-    chord_symbols, x_symbols = extract_chord_symbols(m21_score)
+    chord_symbols, x_symbols = extract_chord_symbols(parts, chord_symbol_info)
+    harmonic_elements_by_part, measure_offsets = harmonic_elements.result()
     chords: list[MusicDataTiming[Chord]] = []
     for idx, css_at_offset in enumerate(chord_symbols):
         range_start = css_at_offset[0]
         range_end = (
             chord_symbols[idx + 1][0]
             if idx + 1 < len(chord_symbols)
-            else m21_score.highestTime
+            else highest_time
         )
         # print(
         #     f"extract_harmonic_clusters(): processing harmonic range {range_start}-{range_end}"
         # )
-        # TODO: optimization: filter x_symbols to only those in range?
+        # only x symbols within this range can exclude anything from it
+        x_symbols_in_range = {
+            part: set(slice_sorted(x_offsets, range_start, range_end))
+            for part, x_offsets in x_symbols.items()
+        }
         chords.extend(
-            process_chord_annotation(
-                m21_score, (range_start, range_end), css_at_offset[1], x_symbols
+            process_range(
+                parts,
+                (range_start, range_end),
+                css_at_offset[1],
+                x_symbols_in_range,
+                harmonic_elements_by_part,
+                measure_offsets,
             )
         )
     return chords
 
 
-def extract_lyrics(
-    m21_score: Score,
-) -> list[
-    MusicDataTiming[list[MusicDataTiming[str]]]
-]:  # [(offset, [(syllable_offset, syllable_text)])]
-    searcher = LyricSearcher(m21_score)
-    m21_lyrics = searcher.search(re.compile(r"[^\s]+"))
-    lyrics_by_syllable = sorted(
-        [
-            MusicDataTiming(
-                elem=[
+LYRIC_WORD_PATTERN = re.compile(r"[^\s]+")
+
+
+class LyricExtractor(ScoreExtractor):
+    """Lyric words, each with the timing of its syllables.
+    Words are assembled the same way as music21's `LyricSearcher`, separately for each verse."""
+
+    classes = (NotRest,)
+
+    # (syllable, note offset) per lyric identifier (i.e. verse), in score order
+    syllables_by_identifier: dict[str | int, list[tuple[Lyric, OffsetQL]]]
+
+    def __init__(self):
+        self.syllables_by_identifier = {}
+
+    def visit(self, el: Music21Object, offset: OffsetQL, part: Part | None) -> None:
+        for lyric in el.lyrics:
+            if not lyric.text:
+                continue
+            self.syllables_by_identifier.setdefault(lyric.identifier, []).append(
+                (lyric, offset)
+            )
+
+    def merge(self, other: "LyricExtractor") -> None:
+        for identifier, syllables in other.syllables_by_identifier.items():
+            self.syllables_by_identifier.setdefault(identifier, []).extend(syllables)
+
+    def result(
+        self,
+    ) -> list[
+        MusicDataTiming[list[MusicDataTiming[str]]]
+    ]:  # [(offset, [(syllable_offset, syllable_text)])]
+        lyrics: list[MusicDataTiming[list[MusicDataTiming[str]]]] = []
+        for syllables in self.syllables_by_identifier.values():
+            # join the verse into one text, only separating syllables that end a word
+            verse_text = ""
+            syllable_starts: list[int] = []
+            last_syllabic: str | None = None
+            for lyric, _ in syllables:
+                if last_syllabic not in ("begin", "middle", None):
+                    verse_text += " "
+                syllable_starts.append(len(verse_text))
+                verse_text += lyric.text
+                last_syllabic = (
+                    lyric.components[-1].syllabic
+                    if lyric.isComposite
+                    else lyric.syllabic
+                )
+            # each word is every syllable overlapping a match
+            for match in LYRIC_WORD_PATTERN.finditer(verse_text):
+                first_idx = bisect_right(syllable_starts, match.start()) - 1
+                last_idx = bisect_right(syllable_starts, match.end() - 1) - 1
+                word_syllables = syllables[first_idx : last_idx + 1]
+                lyrics.append(
                     MusicDataTiming(
-                        elem=il.text,
-                        offset=il.el.getOffsetInHierarchy(m21_score),
+                        elem=[
+                            MusicDataTiming(elem=lyric.text, offset=offset)
+                            for lyric, offset in word_syllables
+                        ],
+                        offset=word_syllables[0][1],
                     )
-                    for il in lyric.indices
-                ],
-                offset=lyric.els[0].getOffsetInHierarchy(m21_score),
-            )
-            for lyric in m21_lyrics
-        ],
-        key=lambda mdt: mdt.offset,
-    )
-    return lyrics_by_syllable
+                )
+        return sorted(lyrics, key=lambda mdt: mdt.offset)
 
 
-def extract_keys(
-    m21_score: Score,
-) -> list[MusicDataTiming[Key]]:
-    # current assumptions:
-    # - piece contain simple KeySignature objects AND complex Key objects
-    # - KeySignatures can be assumed to be in major and transformed to Keys
-    # - there is at most one unique Key object per offset
-
-    grouped_key_signatures = groupby(
-        sorted(
-            (
-                (ks.getOffsetInHierarchy(m21_score), ks)
-                for ks in m21_score.recurse().getElementsByClass(KeySignature)
-            ),
+class KeyExtractor(ScoreExtractor):
+
+    classes = (KeySignature,)
+
+    key_signature_info: list[tuple[OffsetQL, KeySignature]]
+
+    def __init__(self):
+        self.key_signature_info = []
+
+    def visit(self, el: Music21Object, offset: OffsetQL, part: Part | None) -> None:
+        self.key_signature_info.append((offset, el))
+
+    def merge(self, other: "KeyExtractor") -> None:
+        self.key_signature_info.extend(other.key_signature_info)
+
+    def result(self) -> list[MusicDataTiming[Key]]:
+        # current assumptions:
+        # - piece contain simple KeySignature objects AND complex Key objects
+        # - KeySignatures can be assumed to be in major and transformed to Keys
+        # - there is at most one unique Key object per offset
+
+        grouped_key_signatures = groupby(
+            sorted(self.key_signature_info, key=lambda ks_info: ks_info[0]),
             key=lambda ks_info: ks_info[0],
-        ),
-        key=lambda ks_info: ks_info[0],
-    )
+        )
 
-    keys: list[MusicDataTiming[Key]] = []
+        keys: list[MusicDataTiming[Key]] = []
 
-    for offset, ks_iter in grouped_key_signatures:
-        ks_list = list(ks_iter)
-        # print(f"{offset:5}: {ks_list}")
+        for offset, ks_iter in grouped_key_signatures:
+            ks_list = list(ks_iter)
+            # print(f"{offset:5}: {ks_list}")
 
-        # transform any KeySignatures to Keys
-        key_list = [
-            ks[1] if isinstance(ks[1], Key) else ks[1].asKey(mode="major")
-            for ks in ks_list
-        ]
-        # print(key_list)
+            # transform any KeySignatures to Keys
+            key_list = [
+                ks[1] if isinstance(ks[1], Key) else ks[1].asKey(mode="major")
+                for ks in ks_list
+            ]
+            # print(key_list)
 
-        # ensure all are same at this offset
-        assert len(eq_unique(key_list)) == 1
-        key = key_list[0]
-        keys.append(MusicDataTiming(elem=key, offset=offset))
-        # print(f"{offset:5}: {key}")
-    return keys
+            # ensure all are same at this offset
+            assert len(eq_unique(key_list)) == 1
+            key = key_list[0]
+            # warm up the pitch class info every key consumer uses
+            get_key_mask(key)
+            keys.append(MusicDataTiming(elem=key, offset=offset))
+            # print(f"{offset:5}: {key}")
+        return keys
 
 
-def parse_score_data(data) -> MusicData:
-    m21_score = converter.parseData(data)
+class TempoWords(Enum):
+    accelerando = "accel."
+    ritardando = "rit."
+    a_tempo = "a tempo"
+
+    def __str__(self):
+        return self.name
 
-    if not isinstance(m21_score, Score):
-        raise ValueError(
-            "Can only render musicxml files containing a Score, not a "
-            + str(type(m21_score))
+    @staticmethod
+    def of(text: str) -> "TempoWords | None":
+        text = text.strip().lower()
+        if text.startswith(A_TEMPO_TEXTS):
+            return TempoWords.a_tempo
+        words = {word.rstrip(".") for word in text.split()}
+        if words & ACCELERANDO_WORDS:
+            return TempoWords.accelerando
+        if words & RITARDANDO_WORDS:
+            return TempoWords.ritardando
+        return None
+
+
+class TempoExtractor(ScoreExtractor):
+    """Tempo changes, in quarter notes per minute, and the accel./rit. words leading up to them.
+    Marks repeated on other parts or staves count once."""
+
+    classes = (MetronomeMark, TextExpression)
+
+    bpm_by_offset: dict[OffsetQL, float]
+    words_by_offset: dict[OffsetQL, TempoWords]
+
+    def __init__(self):
+        self.bpm_by_offset = {}
+        self.words_by_offset = {}
+
+    def visit(self, el: Music21Object, offset: OffsetQL, part: Part | None) -> None:
+        if isinstance(el, TextExpression):
+            words = TempoWords.of(el.content or "")
+            if words is not None:
+                self.words_by_offset.setdefault(offset, words)
+            return
+        assert isinstance(el, MetronomeMark)
+        # None for marks with just text, e.g. "Allegro"
+        bpm = el.getQuarterBPM()
+        if bpm is not None and bpm > 0:
+            # the first part's mark wins if parts disagree
+            self.bpm_by_offset.setdefault(offset, float(bpm))
+
+    def merge(self, other: "TempoExtractor") -> None:
+        for offset, bpm in other.bpm_by_offset.items():
+            self.bpm_by_offset.setdefault(offset, bpm)
+        for offset, words in other.words_by_offset.items():
+            self.words_by_offset.setdefault(offset, words)
+
+    def result(self) -> list[MusicDataTiming[float]]:
+        tempos: list[MusicDataTiming[float]] = []
+        for offset, bpm in sorted(self.bpm_by_offset.items()):
+            # marks restating the tempo don't change it
+            if not tempos or tempos[-1].elem != bpm:
+                tempos.append(MusicDataTiming(elem=bpm, offset=offset))
+        return tempos
+
+    def ramps(self) -> list[MusicDataTiming[TempoRamp]]:
+        """Each accel. or rit. running from its words to the next metronome mark, which sets the tempo it reaches.
+        Words without a mark after them, or with a mark going the other way, or with an "a tempo" first, are
+        left out: there's no telling how far they go."""
+        # TODO: end ramps at the end of their dashes (<dashes type="stop">) when there are any
+        marks = sorted(self.bpm_by_offset.items())
+        mark_offsets = [offset for offset, _ in marks]
+        a_tempo_offsets = sorted(
+            offset for offset, words in self.words_by_offset.items() if words == TempoWords.a_tempo
         )
+        ramps: list[MusicDataTiming[TempoRamp]] = []
+        for offset, words in sorted(self.words_by_offset.items()):
+            if words == TempoWords.a_tempo:
+                continue
+            if ramps and offset < ramps[-1].offset + ramps[-1].elem.quarterLength:
+                # e.g. "molto rit." during a rit.
+                continue
+            next_mark = bisect_right(mark_offsets, offset)
+            if next_mark == 0 or next_mark == len(marks):
+                # before the first mark the tempo is already the first mark's
+                continue
+            start_bpm = marks[next_mark - 1][1]
+            end_offset, end_bpm = marks[next_mark]
+            if bisect_left(a_tempo_offsets, offset) != bisect_left(a_tempo_offsets, end_offset):
+                continue
+            if (end_bpm > start_bpm) != (words == TempoWords.accelerando) or end_bpm == start_bpm:
+                continue
+            ramp = TempoRamp(quarterLength=opFrac(end_offset - offset), bpm=end_bpm)
+            ramps.append(MusicDataTiming(elem=ramp, offset=offset))
+        return ramps
+
+
+@dataclass
+class ScoreExtraction:
+    """Everything collected by walking a score, or some of its parts, with each of the extractors."""
+
+    parts: list[Part] = field(default_factory=list)
+    highest_time: OffsetQL = 0.0
+    notes: NoteExtractor = field(default_factory=NoteExtractor)
+    chord_symbols: ChordSymbolExtractor = field(default_factory=ChordSymbolExtractor)
+    lyrics: LyricExtractor = field(default_factory=LyricExtractor)
+    keys: KeyExtractor = field(default_factory=KeyExtractor)
+    harmonic_elements: HarmonicElementExtractor = field(
+        default_factory=HarmonicElementExtractor
+    )
+    tempos: TempoExtractor = field(default_factory=TempoExtractor)
+
+    def extractors(self) -> list[ScoreExtractor]:
+        return [
+            self.notes,
+            self.chord_symbols,
+            self.lyrics,
+            self.keys,
+            self.harmonic_elements,
+            self.tempos,
+        ]
 
-    music_data = MusicData.from_score(m21_score)
+    def merge(self, other: "ScoreExtraction") -> None:
+        self.parts.extend(other.parts)
+        self.highest_time = max(self.highest_time, other.highest_time)
+        for extractor, other_extractor in zip(self.extractors(), other.extractors()):
+            extractor.merge(other_extractor)
 
-    for chord_info in music_data.chords:
-        chord = chord_info.elem
-        custom_disp = display_chord_short_custom(chord)
-        print(
-            f"{chord_info.offset:5}: {chord.pitchedCommonName:>32} {custom_disp if custom_disp is not None else "":32} ({' '.join(f"{p.nameWithOctave:3}" for p in sorted(chord.pitches)) if len(chord.pitches) > 0 else "no notes"})"
+    @staticmethod
+    def from_score(m21_score: Score, detach_parts: bool = False) -> "ScoreExtraction":
+        """`detach_parts` swaps each Part for an empty stand-in with the same id and name,
+        so the result can be pickled without dragging the whole score along."""
+        part_keys: dict[Part, Part] = {
+            part: _detached_part(part) if detach_parts else part
+            for part in m21_score.parts
+        }
+        extraction = ScoreExtraction(
+            parts=list(part_keys.values()),
+            highest_time=m21_score.highestTime,
+        )
+        walk_score(m21_score, extraction.extractors(), part_key=part_keys.get)
+        return extraction
+
+
+def _detached_part(part: Part) -> Part:
+    detached = type(part)(id=part.id)
+    detached.partName = part.partName
+    return detached
+
+
+def split_parts_musicxml(data: bytes | str) -> list[bytes] | None:
+    """Split a partwise musicxml document into one standalone document per `<part>`.
+    Returns None for anything else (e.g. timewise scores), which has to be parsed whole."""
+    try:
+        root = ElementTree.fromstring(data)
+    except ElementTree.ParseError:
+        return None
+    if root.tag != "score-partwise":
+        return None
+
+    part_ids = [part.get("id") for part in root.iterfind("part")]
+    part_documents: list[bytes] = []
+    for part_id in part_ids:
+        part_root = ElementTree.Element(root.tag, root.attrib)
+        for child in root:
+            if child.tag == "part-list":
+                # keep only this part's entry (and no part-groups spanning other parts)
+                part_list = ElementTree.SubElement(part_root, child.tag, child.attrib)
+                part_list.extend(
+                    score_part
+                    for score_part in child.iterfind("score-part")
+                    if score_part.get("id") == part_id
+                )
+            elif child.tag != "part" or child.get("id") == part_id:
+                part_root.append(child)
+        part_documents.append(
+            ElementTree.tostring(part_root, encoding="utf-8", xml_declaration=True)
         )
+    return part_documents
+
+
+def _extract_score_part(data: bytes) -> ScoreExtraction:
+    # process pool worker: parse and walk one part on its own
+    m21_score = converter.parseData(data)
+    assert isinstance(m21_score, Score)
+    return ScoreExtraction.from_score(m21_score, detach_parts=True)
+
+
+def parse_score_extraction_parallel(data: bytes | str, jobs: int) -> ScoreExtraction | None:
+    """Parse and walk each part of the score in its own worker process, then merge in score order.
+    Returns None if the score can't be split into parts."""
+    part_documents = split_parts_musicxml(data)
+    if part_documents is None or len(part_documents) < 2:
+        return None
+
+    extraction = ScoreExtraction()
+    with ProcessPoolExecutor(max_workers=min(jobs, len(part_documents))) as pool:
+        # map() yields in submission order, so merging is deterministic
+        for part_extraction in pool.map(_extract_score_part, part_documents):
+            extraction.merge(part_extraction)
+    return extraction
+
+
+class ScoreParser(Enum):
+    music21 = "music21"
+    # streaming reader for only what MusicData needs, see musicxml_fast.py
+    fast = "fast"
+    # fast, re-reading only the measures that changed since the last parse in this process, see musicxml_incremental.py
+    incremental = "incremental"
+
+    def __str__(self):
+        return self.name
+
+
+class ExportLayout(Enum):
+    # every event with its music information written out in full
+    full = "full"
+    # pitches, chords and keys written once each in tables, and referenced by index from events, see export_json.py
+    normalized = "normalized"
+
+    def __str__(self):
+        return self.name
+
+
+def parse_score_data(
+    data, jobs: int = 1, parser: ScoreParser = ScoreParser.music21
+) -> MusicData:
+    extraction: ScoreExtraction | None = None
+    process_range: ProcessChordAnnotation | None = None
+    elem_cache: MutableMapping[int, tuple[Any, Any]] | None = None
+    if parser == ScoreParser.fast:
+        # imported here since musicxml_fast builds on this module
+        from musicxml_fast import parse_score_extraction_fast
+
+        extraction = parse_score_extraction_fast(data)
+    elif parser == ScoreParser.incremental:
+        # imported here since musicxml_incremental builds on this module
+        from musicxml_incremental import INCREMENTAL_PARSER
+
+        extraction = INCREMENTAL_PARSER.extract(data)
+        process_range = INCREMENTAL_PARSER.process_range
+        elem_cache = INCREMENTAL_PARSER.detached_elems
+    elif jobs > 1:
+        extraction = parse_score_extraction_parallel(data, jobs)
+
+    if extraction is None:
+        m21_score = converter.parseData(data)
+
+        if not isinstance(m21_score, Score):
+            raise ValueError(
+                "Can only render musicxml files containing a Score, not a "
+                + str(type(m21_score))
+            )
+
+        extraction = ScoreExtraction.from_score(m21_score)
+
+    music_data = MusicData.from_extraction(extraction, process_range)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        for chord_info in music_data.chords:
+            chord = chord_info.elem
+            chord_naming = CHORD_NAME_CACHE.get(chord)
+            custom_disp = chord_naming.display_custom
+            logger.debug(
+                f"{chord_info.offset:5}: {chord_naming.pitched_common_name:>32} {custom_disp if custom_disp is not None else "":32} ({' '.join(f"{p.nameWithOctave:3}" for p in sorted(chord.pitches)) if len(chord.pitches) > 0 else "no notes"})"
+            )
+        logger.debug(f"chord name cache: {CHORD_NAME_CACHE}")
     # for offset, note in music_data.all_notes:
     #     print(f"{offset:5}: {note.nameWithOctave} {note.duration.quarterLength}")
     # for part, notes in music_data.all_notes_by_part.items():
@@ -750,4 +1430,7 @@ def parse_score_data(data) -> MusicData:
     #     for offset, note in notes:
     #         print(f"\t{offset:5}: {note.nameWithOctave} {note.duration.quarterLength}")
 
+    # keep only what widgets need, so the score (and everything music21 hung off it) can be freed
+    music_data = music_data.detach(elem_cache)
+    CHORD_NAME_CACHE.detach_chords()
     return music_data
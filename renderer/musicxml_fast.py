@@ -0,0 +1,350 @@
+# std library
+from collections import Counter
+from dataclasses import dataclass, field
+from fractions import Fraction
+from io import BytesIO
+from pathlib import Path
+from xml.etree import ElementTree
+
+# 3rd party library
+from music21 import converter
+from music21.base import Music21Object
+from music21.common.numberTools import opFrac
+from music21.common.types import OffsetQL
+from music21.musicxml.xmlToM21 import MeasureParser
+from music21.note import Note
+from music21.stream import Part, PartStaff, Measure, Score
+from music21.tempo import MetronomeMark
+
+# project files
+from musicxml import MusicData, ScoreExtraction, TempoWords, dispatch_element
+
+# streaming reader for the parts of a musicxml file that MusicData needs:
+# pitches, offsets, durations, <harmony> annotations, key signatures, tempo marks (and accel./rit. words) and
+# lyric syllables.
+# everything else (layout, spanners, articulations, ...) is skipped instead of built into music21 objects,
+# and each <measure> is dropped from memory as soon as it's read.
+# elements end up assigned to parts/PartStaffs the same way music21's musicxml import does,
+# so the extractors (and export) see the same parts as with the music21 parser.
+
+
+# only used for its converters of single xml elements (<pitch>, <key>, <harmony>, <lyric>, <metronome>, <words>),
+# never given a measure
+_MEASURE_PARSER = MeasureParser()
+
+DEFAULT_BAR_QUARTER_LENGTH = 4.0
+
+
+@dataclass
+class _PartReader:
+    """Running state while reading one `<part>`."""
+
+    part_id: str
+    part_name: str | None
+    divisions: float = 1.0
+    bar_quarter_length: OffsetQL = DEFAULT_BAR_QUARTER_LENGTH
+    staves: int = 1
+    measure_offset: float = 0.0
+    # (staff or None for all staves, offset, sort key, element), for the whole part
+    events: list[tuple[int | None, OffsetQL, tuple, Music21Object]] = field(
+        default_factory=list
+    )
+    measure_offsets: list[OffsetQL] = field(default_factory=list)
+
+    def read_measure(self, mx_measure: ElementTree.Element) -> None:
+        cursor: OffsetQL = 0.0
+        measure_highest_time: OffsetQL = 0.0
+        has_notes_or_rests = False
+        last_note_offset: OffsetQL = 0.0
+        # music21 puts the notes of each voice in its own stream, so they're walked voice after voice
+        voice_order: dict[str | None, int] = {}
+        pending_chord: list[ElementTree.Element] = []
+
+        def add(staff: int | None, offset: OffsetQL, voice: str | None, el: Music21Object):
+            voice_rank = voice_order.setdefault(voice, len(voice_order))
+            self.events.append(
+                (
+                    staff,
+                    self.measure_offset + offset,
+                    (self.measure_offset, voice_rank, offset, len(self.events)),
+                    el,
+                )
+            )
+
+        def flush_chord() -> None:
+            # a chord's lyrics are gathered from all of its notes, like music21 does
+            if not pending_chord:
+                return
+            offset = last_note_offset
+            notes = [self._note(mx_note) for mx_note in pending_chord]
+            _MEASURE_PARSER.updateLyricsFromList(
+                notes[0],
+                [mx_lyric for mx_note in pending_chord for mx_lyric in mx_note.iterfind("lyric")],
+            )
+            for mx_note, n in zip(pending_chord, notes):
+                add(self._staff(mx_note), offset, mx_note.findtext("voice"), n)
+            pending_chord.clear()
+
+        for mx_el in mx_measure:
+            tag = mx_el.tag
+            if tag == "note":
+                if mx_el.find("chord") is not None:
+                    if mx_el.find("pitch") is not None:
+                        pending_chord.append(mx_el)
+                    continue
+                flush_chord()
+                has_notes_or_rests = True
+                last_note_offset = cursor
+                quarter_length = self._quarter_length(mx_el)
+                # rests and unpitched notes only take up time
+                if mx_el.find("pitch") is not None:
+                    pending_chord.append(mx_el)
+                cursor = opFrac(cursor + quarter_length)
+                measure_highest_time = max(measure_highest_time, cursor)
+            elif tag == "backup":
+                flush_chord()
+                cursor = max(opFrac(cursor - self._quarter_length(mx_el)), 0.0)
+            elif tag == "forward":
+                flush_chord()
+                cursor = opFrac(cursor + self._quarter_length(mx_el))
+            elif tag == "harmony":
+                flush_chord()
+                offset = opFrac(cursor + self._offset(mx_el))
+                staff = self._staff(mx_el)
+                # a harmony without a <staff> shows up on every staff, as separate objects
+                for target_staff in self._target_staves(staff):
+                    add(
+                        target_staff,
+                        offset,
+                        None,
+                        _MEASURE_PARSER.xmlToChordSymbol(mx_el),
+                    )
+            elif tag == "attributes":
+                flush_chord()
+                self._read_attributes(mx_el, cursor, add)
+            elif tag == "direction":
+                flush_chord()
+                offset = opFrac(cursor + self._offset(mx_el))
+                if (mm := self._tempo(mx_el)) is not None:
+                    add(self._staff(mx_el), offset, None, mm)
+                for mx_words in mx_el.iterfind("direction-type/words"):
+                    # only the ones TempoExtractor wants, the rest would just be skipped
+                    if TempoWords.of(mx_words.text or "") is not None:
+                        add(self._staff(mx_el), offset, None, _MEASURE_PARSER.xmlToTextExpression(mx_words))
+            elif tag == "sound":
+                flush_chord()
+                if (mm := self._sound_tempo(mx_el)) is not None:
+                    add(None, opFrac(cursor + self._offset(mx_el)), None, mm)
+        flush_chord()
+
+        # advance to the next measure like music21's PartParser.adjustTimeAttributesFromMeasure()
+        if measure_highest_time == 0.0 and not has_notes_or_rests:
+            # empty measure, counts as a whole bar of rest
+            measure_shift = self.bar_quarter_length
+        else:
+            measure_shift = measure_highest_time
+        self.measure_offsets.append(self.measure_offset)
+        # kept a float like music21 does, so offsets in the score compare equal to its own
+        self.measure_offset = float(self.measure_offset + measure_shift)
+
+    def _read_attributes(self, mx_attributes: ElementTree.Element, cursor: OffsetQL, add) -> None:
+        if (divisions := mx_attributes.findtext("divisions")) is not None:
+            self.divisions = float(divisions)
+        if (staves := mx_attributes.findtext("staves")) is not None:
+            self.staves = max(self.staves, int(staves))
+        for mx_time in mx_attributes.iterfind("time"):
+            beats = mx_time.findtext("beats")
+            beat_type = mx_time.findtext("beat-type")
+            if beats is None or beat_type is None:
+                continue
+            try:
+                self.bar_quarter_length = opFrac(
+                    Fraction(sum(int(b) for b in beats.split("+")) * 4, int(beat_type))
+                )
+            except ValueError:
+                # TODO: support other time signatures than number/number
+                self.bar_quarter_length = DEFAULT_BAR_QUARTER_LENGTH
+        for mx_key in mx_attributes.iterfind("key"):
+            staff = int(mx_key.get("number")) if mx_key.get("number") else None
+            # a key without a number applies to every staff, as separate objects
+            for target_staff in self._target_staves(staff):
+                add(target_staff, cursor, None, _MEASURE_PARSER.xmlToKeySignature(mx_key))
+
+    def _tempo(self, mx_direction: ElementTree.Element) -> MetronomeMark | None:
+        # like music21, a <sound tempo> only counts if the direction has no <metronome>
+        mx_metronome = mx_direction.find("direction-type/metronome")
+        if mx_metronome is not None:
+            mm = _MEASURE_PARSER.xmlToTempoIndication(mx_metronome)
+            # not a metric modulation
+            return mm if isinstance(mm, MetronomeMark) else None
+        mx_sound = mx_direction.find("sound[@tempo]")
+        return self._sound_tempo(mx_sound) if mx_sound is not None else None
+
+    def _sound_tempo(self, mx_sound: ElementTree.Element) -> MetronomeMark | None:
+        try:
+            bpm = float(mx_sound.get("tempo", ""))
+        except ValueError:
+            return None
+        if bpm == 0:
+            return None
+        return MetronomeMark(referent=1.0, numberSounding=bpm)
+
+    def _target_staves(self, staff: int | None) -> list[int | None]:
+        return [staff] if staff is not None else list(range(1, self.staves + 1))
+
+    def _quarter_length(self, mx_el: ElementTree.Element) -> OffsetQL:
+        # grace notes have no duration
+        duration = mx_el.findtext("duration")
+        if duration is None:
+            return 0.0
+        return opFrac(float(duration) / self.divisions)
+
+    def _offset(self, mx_el: ElementTree.Element) -> OffsetQL:
+        offset = mx_el.findtext("offset")
+        if offset is None:
+            return 0.0
+        return opFrac(float(offset) / self.divisions)
+
+    def _staff(self, mx_el: ElementTree.Element) -> int | None:
+        staff = mx_el.findtext("staff")
+        return int(staff) if staff is not None else None
+
+    def _note(self, mx_note: ElementTree.Element) -> Note:
+        # accidental display is part of a Pitch's hash, which decides what a harmonic cluster's pitch set dedupes,
+        # so take the pitch exactly as music21 reads it
+        pitch = _MEASURE_PARSER.xmlToPitch(mx_note)
+        n = Note(pitch)
+        # set separately, Note() would take a quarterLength of 0 (grace notes) as unset
+        n.quarterLength = self._quarter_length(mx_note)
+        return n
+
+    def extract_into(self, extraction: ScoreExtraction) -> None:
+        """Hand everything read from this part to the extractors, one part (or PartStaff) at a time."""
+        staff_keys: list[int | None]
+        if self.staves > 1:
+            staff_keys = list(range(1, self.staves + 1))
+        else:
+            staff_keys = [None]
+        extractors = extraction.extractors()
+        for staff_key in staff_keys:
+            part = self._part_for(staff_key)
+            extraction.parts.append(part)
+            dispatch_element(extractors, part, 0.0, part)
+            staff_events = sorted(
+                (
+                    event
+                    for event in self.events
+                    if staff_key is None or event[0] is None or event[0] == staff_key
+                ),
+                key=lambda event: event[2],
+            )
+            for measure_offset in self.measure_offsets:
+                dispatch_element(extractors, Measure(), measure_offset, part)
+            for _, offset, _, el in staff_events:
+                dispatch_element(extractors, el, offset, part)
+        extraction.highest_time = max(extraction.highest_time, self.measure_offset)
+
+    def _part_for(self, staff_key: int | None) -> Part:
+        part: Part
+        if staff_key is None:
+            # music21 names single-staff parts after their instrument
+            part = Part(id=self.part_name or self.part_id)
+        else:
+            part = PartStaff(id=f"{self.part_id}-Staff{staff_key}")
+        part.partName = self.part_name
+        return part
+
+
+def parse_score_extraction_fast(data: bytes | str) -> ScoreExtraction:
+    """Stream a partwise musicxml document straight into a ScoreExtraction, without building a music21 Score."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+
+    extraction = ScoreExtraction()
+    part_names: dict[str, str | None] = {}
+    reader: _PartReader | None = None
+    part_el: ElementTree.Element | None = None
+    for event, mx_el in ElementTree.iterparse(BytesIO(data), events=("start", "end")):
+        tag = mx_el.tag
+        if event == "start":
+            if tag == "score-timewise":
+                raise ValueError("fast parser only supports partwise musicxml scores")
+            if tag == "part":
+                part_id = mx_el.get("id", "")
+                reader = _PartReader(part_id=part_id, part_name=part_names.get(part_id))
+                part_el = mx_el
+            continue
+
+        if tag == "score-part":
+            part_names[mx_el.get("id", "")] = (mx_el.findtext("part-name") or "").strip() or None
+        elif tag == "measure" and reader is not None and part_el is not None:
+            reader.read_measure(mx_el)
+            # done with this measure, free it
+            part_el.remove(mx_el)
+        elif tag == "part" and reader is not None:
+            reader.extract_into(extraction)
+            reader = None
+            part_el = None
+    return extraction
+
+
+def _comparable_music_data(music_data: MusicData) -> dict:
+    # order of simultaneous elements isn't specified, so compare per offset as multisets
+    def notes(notes_timing) -> Counter:
+        return Counter(
+            (t.offset, t.elem.nameWithOctave, t.elem.quarterLength) for t in notes_timing
+        )
+
+    return {
+        "chords": [
+            (t.offset, sorted(p.nameWithOctave for p in t.elem.pitches))
+            for t in music_data.chords
+        ],
+        "all_notes": notes(music_data.all_notes),
+        "all_notes_by_part": {
+            (type(part).__name__, part.id, part.partName): notes(part_notes)
+            for part, part_notes in music_data.all_notes_by_part.items()
+        },
+        "lyrics": Counter(
+            (t.offset, tuple((s.offset, s.elem) for s in t.elem)) for t in music_data.lyrics
+        ),
+        "keys": [(t.offset, t.elem.name) for t in music_data.keys],
+        "tempos": [(t.offset, t.elem) for t in music_data.tempos],
+        "tempo_ramps": [(t.offset, t.elem) for t in music_data.tempo_ramps],
+        "bpm": music_data.bpm,
+    }
+
+
+def _test_fast_parser_matches_music21(scores_dir: Path = Path(__file__).parent.parent / "test_scores"):
+    for score_path in sorted(scores_dir.glob("*.musicxml")):
+        data = score_path.read_bytes()
+        m21_score = converter.parseData(data)
+        assert isinstance(m21_score, Score)
+        expected = _comparable_music_data(
+            MusicData.from_extraction(ScoreExtraction.from_score(m21_score))
+        )
+        actual = _comparable_music_data(
+            MusicData.from_extraction(parse_score_extraction_fast(data))
+        )
+        for k in expected:
+            assert expected[k] == actual[k], f"{score_path.name}: fast parser {k} differ from music21"
+
+
+# _test_fast_parser_matches_music21()
+
+
+def _test_tempo_ramps(score_path: Path = Path(__file__).parent.parent / "test_scores" / "Tempo ramps.musicxml"):
+    from musicxml import TempoRamp
+
+    # an accel. up to 140 at beat 4, and a rall. down to 80 at beat 32. the rit. at beat 12 is dropped since
+    # "a tempo" comes first, and the rit. at beat 24 since the next mark is faster
+    expected = [(4.0, TempoRamp(quarterLength=4.0, bpm=140.0)), (32.0, TempoRamp(quarterLength=4.0, bpm=80.0))]
+    data = score_path.read_bytes()
+    m21_score = converter.parseData(data)
+    assert isinstance(m21_score, Score)
+    for extraction in (ScoreExtraction.from_score(m21_score), parse_score_extraction_fast(data)):
+        music_data = MusicData.from_extraction(extraction)
+        assert [(t.offset, t.elem) for t in music_data.tempo_ramps] == expected, music_data.tempo_ramps
+
+
+# _test_tempo_ramps()
@@ -0,0 +1,368 @@
+# std library
+import hashlib
+import logging
+import re
+import time
+from dataclasses import dataclass
+from operator import itemgetter
+from pathlib import Path
+from typing import Any, Generic, Hashable, TypeVar
+from xml.etree import ElementTree
+
+# 3rd party library
+from music21.base import Music21Object
+from music21.chord import Chord
+from music21.common.types import OffsetQL
+from music21.harmony import ChordSymbol
+from music21.note import NotRest
+from music21.stream import Part
+
+# project files
+from musicxml import MusicData, MusicDataTiming, ScoreExtraction, chord_of_cluster, process_chord_annotation
+from musicxml_fast import _PartReader, parse_score_extraction_fast
+from utils import slice_sorted
+
+# log setup
+logger = logging.getLogger(__name__)
+
+# re-parsing a score after an edit, re-reading only what changed, on top of musicxml_fast's reader:
+# - each <measure> of each <part> is fingerprinted by its raw bytes, and what the reader got out of it is kept,
+#   keyed by the fingerprint and the reader state it started in (divisions, time signature, staves).
+#   measures are found with regexes rather than an xml parser, so unchanged ones are never parsed at all.
+# - parts whose measures are all unchanged keep their whole extraction. the others are put together again from
+#   their measures, but keep their Part objects, so what's unchanged in them still looks the same below.
+# - harmonic ranges (see extract_harmonic_clusters()) whose chord symbols, notes and measures are all the same
+#   objects at the same offsets as before keep their chords. in ranges that changed, clusters of the same notes
+#   as before still keep their chord.
+# - music21 objects kept from before keep their detached records (see MusicData.detach()).
+# results are the same as parse_score_extraction_fast()'s for the same data.
+
+PART_LIST_PATTERN = re.compile(rb"<part-list(?:\s[^>]*)?>.*?</part-list>", re.S)
+# not <part-list>, <part-name>, ...
+PART_PATTERN = re.compile(rb"<part(\s[^>]*)?>(.*?)</part>", re.S)
+PART_ID_PATTERN = re.compile(rb"""\sid\s*=\s*(["'])(.*?)\1""")
+MEASURE_PATTERN = re.compile(rb"<measure(?:\s[^>]*?)?(?:/>|>.*?</measure>)", re.S)
+
+# cached results not used by any of this many parses in a row are dropped.
+# more than one, so a process parsing a few scores in turn (e.g. parse_service.py) keeps all of them
+DEFAULT_KEEP_PARSES = 4
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class _GenerationCache(Generic[K, V]):
+    """Dict that forgets entries not used by the last `keep` parses.
+    Works as the `elem_cache` of MusicData.detach() too."""
+
+    def __init__(self, keep: int):
+        self.keep = keep
+        self.generation = 0
+        self._entries: dict[K, tuple[V, int]] = {}  # key -> (value, generation it was last used in)
+
+    def get(self, key: K, default: V | None = None) -> V | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        if entry[1] != self.generation:
+            self._entries[key] = (entry[0], self.generation)
+        return entry[0]
+
+    def __setitem__(self, key: K, value: V) -> None:
+        self._entries[key] = (value, self.generation)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def next_generation(self) -> None:
+        self.generation += 1
+        oldest_kept = self.generation - self.keep
+        self._entries = {k: entry for k, entry in self._entries.items() if entry[1] >= oldest_kept}
+
+
+_ReaderState = tuple[float, OffsetQL, int]  # divisions, bar quarter length, staves
+_Event = tuple[int | None, OffsetQL, tuple, Music21Object]  # like _PartReader.events
+
+
+@dataclass
+class _ReusingPartReader(_PartReader):
+    """_PartReader handing out the same Part objects as when the part was last read."""
+
+    part_idx: int = 0
+    part_objects: "_GenerationCache[tuple, Part] | None" = None
+
+    def _part_for(self, staff_key: int | None) -> Part:
+        if self.part_objects is None:
+            return super()._part_for(staff_key)
+        key = (self.part_idx, self.part_id, self.part_name, staff_key)
+        part = self.part_objects.get(key)
+        if part is None:
+            part = self.part_objects[key] = super()._part_for(staff_key)
+        return part
+
+
+@dataclass
+class _MeasureRead:
+    events: list[_Event]  # offsets relative to the start of the measure, sort keys (0.0, voice, offset, index)
+    shift: float  # from the start of this measure to the start of the next
+    state_after: _ReaderState
+
+
+@dataclass
+class IncrementalParseStats:
+    measures: int = 0
+    measures_read: int = 0
+    parts: int = 0
+    parts_read: int = 0
+    ranges: int = 0
+    ranges_processed: int = 0
+    clusters_processed: int = 0
+
+    def __str__(self) -> str:
+        return (
+            f"read {self.measures_read}/{self.measures} measures, {self.parts_read}/{self.parts} parts, "
+            f"processed {self.ranges_processed}/{self.ranges} harmonic ranges ({self.clusters_processed} new chords)"
+        )
+
+
+class IncrementalParser:
+    """Parses scores like musicxml_fast, reusing whatever is unchanged since the last few parses."""
+
+    def __init__(self, keep_parses: int = DEFAULT_KEEP_PARSES):
+        self._measures: _GenerationCache[tuple[bytes, _ReaderState], _MeasureRead] = _GenerationCache(keep_parses)
+        self._parts: _GenerationCache[tuple, ScoreExtraction] = _GenerationCache(keep_parses)
+        self._part_objects: _GenerationCache[tuple, Part] = _GenerationCache(keep_parses)
+        # (objects the key refers to by id, chords), kept so those ids can't be reused while cached
+        self._ranges: _GenerationCache[tuple, tuple[list[Any], list[MusicDataTiming[Chord]]]] = _GenerationCache(
+            keep_parses
+        )
+        # chords of the clusters of notes in those ranges, by the notes' ids, for ranges that did change
+        self._clusters: _GenerationCache[tuple[int, ...], tuple[list[NotRest], Chord]] = _GenerationCache(
+            keep_parses
+        )
+        self.detached_elems: _GenerationCache[int, tuple[Any, Any]] = _GenerationCache(keep_parses)
+        self.stats = IncrementalParseStats()
+
+    def extract(self, data: bytes | str) -> ScoreExtraction:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        for cache in (
+            self._measures,
+            self._parts,
+            self._part_objects,
+            self._ranges,
+            self._clusters,
+            self.detached_elems,
+        ):
+            cache.next_generation()
+        self.stats = IncrementalParseStats()
+
+        extraction: ScoreExtraction | None = None
+        if b"<score-partwise" in data:
+            try:
+                extraction = self._extract_parts(data)
+            except ElementTree.ParseError as e:
+                # e.g. a measure using entities declared in the document's DTD, which it can't be parsed without
+                logger.warning(f"can't parse measures on their own ({e}), reading the whole score")
+        if extraction is None:
+            self.stats = IncrementalParseStats()
+            return parse_score_extraction_fast(data)
+        logger.info(f"incremental parse: {self.stats}")
+        return extraction
+
+    def _extract_parts(self, data: bytes) -> ScoreExtraction | None:
+        part_names: dict[str, str | None] = {}
+        if (part_list_match := PART_LIST_PATTERN.search(data)) is not None:
+            for mx_score_part in ElementTree.fromstring(part_list_match.group(0)).iter("score-part"):
+                part_names[mx_score_part.get("id", "")] = (
+                    mx_score_part.findtext("part-name") or ""
+                ).strip() or None
+
+        extraction = ScoreExtraction()
+        for part_idx, part_match in enumerate(
+            PART_PATTERN.finditer(data, part_list_match.end() if part_list_match else 0)
+        ):
+            id_match = PART_ID_PATTERN.search(part_match.group(1) or b"")
+            part_id = id_match.group(2).decode("utf-8") if id_match is not None else ""
+            measures = [m.group(0) for m in MEASURE_PATTERN.finditer(part_match.group(2))]
+            fingerprints = tuple(hashlib.blake2b(m, digest_size=16).digest() for m in measures)
+            self.stats.parts += 1
+            self.stats.measures += len(measures)
+
+            part_key = (part_idx, part_id, part_names.get(part_id), fingerprints)
+            part_extraction = self._parts.get(part_key)
+            if part_extraction is None:
+                self.stats.parts_read += 1
+                part_extraction = self._parts[part_key] = self._read_part(
+                    part_idx, part_id, part_names.get(part_id), measures, fingerprints
+                )
+            # merging copies lists out of the cached extraction, so it's never modified
+            extraction.merge(part_extraction)
+        if self.stats.parts == 0:
+            return None
+        return extraction
+
+    def _read_part(
+        self,
+        part_idx: int,
+        part_id: str,
+        part_name: str | None,
+        measures: list[bytes],
+        fingerprints: tuple[bytes, ...],
+    ) -> ScoreExtraction:
+        reader = _ReusingPartReader(
+            part_id=part_id, part_name=part_name, part_idx=part_idx, part_objects=self._part_objects
+        )
+        state: _ReaderState = (reader.divisions, reader.bar_quarter_length, reader.staves)
+        for measure_idx, (measure, fingerprint) in enumerate(zip(measures, fingerprints)):
+            measure_read = self._measures.get((fingerprint, state))
+            if measure_read is None:
+                self.stats.measures_read += 1
+                measure_read = self._measures[(fingerprint, state)] = _read_measure(measure, state)
+            # place the measure's events like _PartReader.read_measure() would have
+            measure_offset = reader.measure_offset
+            reader.events.extend(
+                (
+                    staff,
+                    measure_offset + offset,
+                    (measure_offset, voice_rank, event_offset, measure_idx, event_idx),
+                    el,
+                )
+                for staff, offset, (_, voice_rank, event_offset, event_idx), el in measure_read.events
+            )
+            reader.measure_offsets.append(measure_offset)
+            reader.measure_offset = float(measure_offset + measure_read.shift)
+            state = measure_read.state_after
+        reader.divisions, reader.bar_quarter_length, reader.staves = state
+
+        part_extraction = ScoreExtraction()
+        reader.extract_into(part_extraction)
+        return part_extraction
+
+    def process_range(
+        self,
+        parts: list[Part],
+        range: tuple[OffsetQL, OffsetQL],
+        chord_symbols: dict[Part, ChordSymbol],
+        x_symbols_in_range: dict[Part, set[OffsetQL]],
+        harmonic_elements_by_part: dict[Part, list[tuple[OffsetQL, NotRest]]],
+        measure_offsets: list[OffsetQL],
+    ) -> list[MusicDataTiming[Chord]]:
+        """process_chord_annotation(), reusing the chords of a range whose inputs are all the same as before."""
+        self.stats.ranges += 1
+        # everything process_chord_annotation() reads, with music21 objects by identity
+        pinned: list[Any] = [*parts, *chord_symbols.keys(), *chord_symbols.values()]
+        elements_key = []
+        for part in parts:
+            elements = slice_sorted(harmonic_elements_by_part.get(part, []), range[0], range[1], key=itemgetter(0))
+            pinned.extend(el for _, el in elements)
+            elements_key.append(tuple((offset, id(el)) for offset, el in elements))
+        key = (
+            range,
+            tuple(map(id, parts)),
+            tuple((id(part), id(cs)) for part, cs in chord_symbols.items()),
+            tuple((id(part), tuple(sorted(offsets))) for part, offsets in x_symbols_in_range.items() if offsets),
+            tuple(elements_key),
+            tuple(slice_sorted(measure_offsets, range[0], range[1])),
+        )
+        cached = self._ranges.get(key)
+        if cached is not None:
+            return cached[1]
+        self.stats.ranges_processed += 1
+        chords = process_chord_annotation(
+            parts,
+            range,
+            chord_symbols,
+            x_symbols_in_range,
+            harmonic_elements_by_part,
+            measure_offsets,
+            chord_of_cluster=self._chord_of_cluster,
+        )
+        self._ranges[key] = (pinned, chords)
+        return chords
+
+    def _chord_of_cluster(self, cluster: list[NotRest]) -> Chord:
+        # e.g. the measures of a range with one chord per measure, most of which didn't change
+        key = tuple(map(id, cluster))
+        cached = self._clusters.get(key)
+        if cached is not None:
+            return cached[1]
+        self.stats.clusters_processed += 1
+        chord = chord_of_cluster(cluster)
+        self._clusters[key] = (cluster, chord)
+        return chord
+
+
+def _read_measure(measure: bytes, state: _ReaderState) -> _MeasureRead:
+    # a reader of its own, starting at offset 0, so the events can be placed anywhere in the part
+    reader = _PartReader(part_id="", part_name=None)
+    reader.divisions, reader.bar_quarter_length, reader.staves = state
+    reader.read_measure(ElementTree.fromstring(measure))
+    return _MeasureRead(
+        events=reader.events,
+        shift=reader.measure_offset,
+        state_after=(reader.divisions, reader.bar_quarter_length, reader.staves),
+    )
+
+
+# for ScoreParser.incremental, which parse_score_data() can't hold on to between calls itself
+INCREMENTAL_PARSER = IncrementalParser()
+
+
+def _test_incremental_matches_fast(scores_dir: Path = Path(__file__).parent.parent / "test_scores"):
+    from musicxml_fast import _comparable_music_data
+
+    def edit_note(data: bytes, measure_idx: int) -> bytes:
+        # move the first pitched note of the measure a step up
+        measure = list(MEASURE_PATTERN.finditer(data))[measure_idx]
+        step = re.search(rb"<step>([A-G])</step>", measure.group(0))
+        assert step is not None
+        new_step = {b"A": b"B", b"B": b"C", b"C": b"D", b"D": b"E", b"E": b"F", b"F": b"G", b"G": b"A"}[step.group(1)]
+        start = measure.start() + step.start(1)
+        return data[:start] + new_step + data[start + 1 :]
+
+    def drop_measure(data: bytes, measure_idx: int) -> bytes:
+        # from every part, shifting every later measure
+        for part in reversed(list(PART_PATTERN.finditer(data))):
+            measure = list(MEASURE_PATTERN.finditer(data, part.start(2), part.end(2)))[measure_idx]
+            data = data[: measure.start()] + data[measure.end() :]
+        return data
+
+    def comparable(parser: IncrementalParser | None, data: bytes) -> dict:
+        if parser is None:
+            return _comparable_music_data(MusicData.from_extraction(parse_score_extraction_fast(data)))
+        extraction = parser.extract(data)
+        return _comparable_music_data(MusicData.from_extraction(extraction, parser.process_range))
+
+    for score_path in sorted(scores_dir.glob("*.musicxml")):
+        data = score_path.read_bytes()
+        parser = IncrementalParser()
+        assert comparable(parser, data) == comparable(None, data), f"{score_path.name}: cold parse differs"
+
+        first_part = PART_PATTERN.search(data)
+        assert first_part is not None
+        measure_count = len(MEASURE_PATTERN.findall(data, first_part.start(2), first_part.end(2)))
+        pitched_measures = [
+            idx for idx, m in enumerate(MEASURE_PATTERN.finditer(data)) if b"<step>" in m.group(0)
+        ]
+        edits = [
+            ("one note", edit_note(data, pitched_measures[len(pitched_measures) // 2])),
+            ("dropped measure", drop_measure(data, measure_count // 3)),
+            ("unchanged", data),
+        ]
+        for edit_name, edited in edits:
+            start = time.perf_counter()
+            extraction = parser.extract(edited)
+            music_data = MusicData.from_extraction(extraction, parser.process_range).detach(parser.detached_elems)
+            warm_ms = (time.perf_counter() - start) * 1000
+            stats = parser.stats
+            start = time.perf_counter()
+            expected = MusicData.from_extraction(parse_score_extraction_fast(edited)).detach()
+            cold_ms = (time.perf_counter() - start) * 1000
+            assert _comparable_music_data(music_data) == _comparable_music_data(
+                expected
+            ), f"{score_path.name} {edit_name}: differs"
+            print(f"{score_path.name} {edit_name}: {warm_ms:.0f}ms vs {cold_ms:.0f}ms fast, {stats}")
+
+
+# _test_incremental_matches_fast()
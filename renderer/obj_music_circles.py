@@ -15,16 +15,18 @@ from more_itertools import peekable
 from music.music_constants import note_for_step
 from obj_music_text import NoteText
 from musicxml import MusicData, MusicDataTiming
-from utils import (
+from manim_utils import (
     TimestampedAnimationSuccession,
     point_at_angle,
-    get_ionian_root,
     vector_on_unit_circle_clockwise_from_top,
-    generate_group,
-    pick_preferred_rotation,
     Anchor,
     AnimateProperty,
 )
+from utils import (
+    get_key_mask,
+    generate_group,
+    pick_preferred_rotation,
+)
 
 # log setup
 logger = logging.getLogger(__name__)
@@ -478,51 +480,35 @@ class PlayCircle12NotesKeyChanges(TimestampedAnimationSuccession):
 
         # build a sequence of rotation animations to play
         anims: list[tuple[float, Animation]] = []
-        previous_root_pitch_class: int = get_ionian_root(
-            music_data.keys[0].elem
-        ).pitchClass
-        previous_pitches_in_key: dict[int, bool] = {
-            pitch_idx: pitch_idx
-            in set(p.pitchClass for p in music_data.keys[0].elem.getPitches())
-            for _, pitch_idx in circle12._list_steps()
-        }
+        previous_key = get_key_mask(music_data.keys[0].elem)
 
         for key_info in music_data.keys[1:]:
             # make a list of animations for this key change
             key_change_anims: list[Animation] = []
 
             # get info about new key
-            key = key_info.elem
-            pitchesInKey = set(p.pitchClass for p in key.getPitches())
-            # figure out which pitch to use for root
-            # TODO: whether to orient tonic or ionian root at top should be a config option
-            root_pitch = get_ionian_root(key_info.elem)
-            assert root_pitch is not None
+            key = get_key_mask(key_info.elem)
 
             # if root changed, animate circle rotating
-            if root_pitch.pitchClass != previous_root_pitch_class:
-                anim = circle12.animate_rotate_to_pitch(root_pitch.pitchClass)
+            # TODO: whether to orient tonic or ionian root at top should be a config option
+            if key.ionian_root != previous_key.ionian_root:
+                anim = circle12.animate_rotate_to_pitch(key.ionian_root)
                 key_change_anims.append(anim)
 
-            # animate any individual pitches needing to change highlighting
-            pitches_in_new_key = {
-                pitch_idx: pitch_idx in pitchesInKey
-                for _, pitch_idx in circle12._list_steps()
-            }
-            for pitch_idx, pitch_is_in_new_key in pitches_in_new_key.items():
-                # optimization: skip animation for this pitch if not changed from last key
-                if previous_pitches_in_key[pitch_idx] == pitch_is_in_new_key:
+            # animate only the pitches that moved in or out of the key
+            changed_pitches = key.changed_pitch_classes(previous_key)
+            for _, pitch_idx in circle12._list_steps():
+                if not changed_pitches & (1 << pitch_idx):
                     continue
 
                 # this pitch needs to animate
-                final_color = DEFAULT_NOTE_IN_KEY_COLOR if pitch_is_in_new_key else DEFAULT_NOTE_NOT_IN_KEY_COLOR
+                final_color = DEFAULT_NOTE_IN_KEY_COLOR if pitch_idx in key else DEFAULT_NOTE_NOT_IN_KEY_COLOR
                 key_change_anims.append(
                         AnimateProperty(circle12.get_pitch_text(pitch_idx), 'color', final_color)
                     )
 
             # done processing this key change
-            previous_root_pitch_class = root_pitch.pitchClass
-            previous_pitches_in_key = pitches_in_new_key
+            previous_key = key
 
             # if we ended up with any notes to change, add it to the overall list
             if len(key_change_anims) > 0:
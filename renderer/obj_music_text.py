@@ -24,7 +24,8 @@ from music21.common.types import OffsetQL
 from music.music_constants import Note
 from constants import USE_LATEX
 from musicxml import MusicData, MusicDataTiming
-from utils import TimestampedAnimationSuccession, display_chord_short, display_key
+from manim_utils import TimestampedAnimationSuccession
+from utils import display_chord_short, display_key
 
 myTemplate = TexTemplate()
 myTemplate.add_to_preamble(
@@ -7,7 +7,7 @@ from manim import *
 
 # my files
 from animations import RippleOut
-from utils import callback_add_to_vdict, vector_on_unit_circle_clockwise_from_top
+from manim_utils import callback_add_to_vdict, vector_on_unit_circle_clockwise_from_top
 
 # TODO: make a color with a fade towards the edges
 
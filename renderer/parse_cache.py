@@ -0,0 +1,114 @@
+# std library
+import hashlib
+import logging
+import os
+import pickle
+from pathlib import Path
+
+# project files
+from musicxml import PARSER_VERSION, MusicData, ScoreParser, parse_score_data
+
+# log setup
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARSE_CACHE_DIR = Path.home() / ".cache" / "harmonimation" / "parse"
+DEFAULT_PARSE_CACHE_MAX_MB = 256
+PARSE_CACHE_SUFFIX = ".pickle"
+
+
+def musicxml_sha256(data: bytes) -> str:
+    """Plain SHA-256 of the file bytes, same as the Godot `MusicScoreData` checksum."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def compute_cache_key(data: bytes, parser: ScoreParser = ScoreParser.music21) -> str:
+    """Content-addressed key for a musicxml file."""
+    return f"{musicxml_sha256(data)}.{parser}.v{PARSER_VERSION}"
+
+
+class ParseCache:
+    """On-disk cache of parsed MusicData, evicting least-recently-used entries past `max_bytes`."""
+
+    cache_dir: Path
+    max_bytes: int
+
+    def __init__(
+        self,
+        cache_dir: Path = DEFAULT_PARSE_CACHE_DIR,
+        max_bytes: int = DEFAULT_PARSE_CACHE_MAX_MB * 1024 * 1024,
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def _path_for(self, key: str) -> Path:
+        return self.cache_dir / f"{key}{PARSE_CACHE_SUFFIX}"
+
+    def get(self, key: str) -> MusicData | None:
+        path = self._path_for(key)
+        try:
+            with open(path, "rb") as f:
+                music_data = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # corrupt or incompatible entry, drop it and re-parse
+            logger.warning(f"discarding unreadable parse cache entry {path}: {e}")
+            path.unlink(missing_ok=True)
+            return None
+        # mark as recently used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # evicted by another process sharing the cache since it was read, which is fine
+            pass
+        return music_data
+
+    def put(self, key: str, music_data: MusicData) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path_for(key)
+        # write to a temp file first so a concurrent reader never sees a partial entry
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(music_data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        for entry in self.cache_dir.glob(f"*{PARSE_CACHE_SUFFIX}"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # evicted by another process sharing the cache
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+        # oldest (least recently used) first
+        entries.sort()
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            logger.debug(f"evicting parse cache entry {entry}")
+            entry.unlink(missing_ok=True)
+            total_bytes -= size
+
+
+def cached_parse_score_data(
+    data: bytes,
+    cache: ParseCache | None,
+    jobs: int = 1,
+    parser: ScoreParser = ScoreParser.music21,
+) -> MusicData:
+    if cache is None:
+        return parse_score_data(data, jobs, parser)
+
+    key = compute_cache_key(data, parser)
+    music_data = cache.get(key)
+    if music_data is not None:
+        logger.info(f"parse cache hit for {key}")
+        return music_data
+
+    logger.info(f"parse cache miss for {key}")
+    music_data = parse_score_data(data, jobs, parser)
+    cache.put(key, music_data)
+    return music_data
@@ -0,0 +1,602 @@
+# standard lib
+import argparse
+import copy
+import inspect
+import io
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, TextIO
+
+# project files
+from export_json import MusicDataSource
+from musicxml import PARSER_VERSION, ExportLayout, MusicData, ScoreParser
+from timing import DEFAULT_EXTRA_START_TIME_SEC, DEFAULT_TEMPO_CURVE, TempoCurve, resolve_timing
+from parse_cache import (
+    DEFAULT_PARSE_CACHE_DIR,
+    DEFAULT_PARSE_CACHE_MAX_MB,
+    ParseCache,
+    cached_parse_score_data,
+    compute_cache_key,
+    musicxml_sha256,
+)
+
+# log setup
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+DEFAULT_SOCKET_PATH = Path(tempfile.gettempdir()) / "harmonimation-parse.sock"
+DEFAULT_MAX_SCORES = 8
+DEFAULT_MAX_TIMED_PER_SCORE = 8
+DEFAULT_JSON_INDENT = "  "
+
+
+# --------------------PARSE SERVICE--------------------
+# a long-running process that keeps python, music21 and recently parsed scores loaded, so an editor
+# (the Godot plugin) doesn't pay for them on every request.
+# speaks JSON-RPC 2.0, one request or response per line, over a unix socket or stdin/stdout.
+#
+# methods:
+#   parse(musicxml_file, parser="music21") -> {score, cached, ...counts}
+#   timing(score, beat_range=None, extra_start_time=2, tempo_curve="linear") -> {score, cached}
+#   export(score, stage="timing", beat_range=None, time_range=None, extra_start_time=2, tempo_curve="linear",
+#          layout="full", compact=False, music_data_file=None)
+#          -> {music_data_file} if given, else {music_data} with the JSON text
+# `score` is the id returned by parse, see parse_cache.compute_cache_key().
+# parser="incremental" suits an editor re-parsing the score it's editing: only measures changed since the
+# last parse are read again (parses are serialized, so the one shared incremental parser is safe to use).
+
+
+# JSON-RPC error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+SERVER_ERROR = -32000
+
+
+class ParseServiceError(Exception):
+    code: int
+
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+def _range_param(value: Any, name: str) -> tuple[float, float] | None:
+    if value is None:
+        return None
+    if not isinstance(value, list) or len(value) != 2 or not all(isinstance(v, (int, float)) for v in value):
+        raise ParseServiceError(INVALID_PARAMS, f"{name} must be a list of two numbers")
+    return (float(value[0]), float(value[1]))
+
+
+def _number_param(value: Any, name: str) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ParseServiceError(INVALID_PARAMS, f"{name} must be a number")
+    return float(value)
+
+
+def _tempo_curve_param(value: Any) -> TempoCurve:
+    try:
+        return TempoCurve(value)
+    except ValueError:
+        raise ParseServiceError(INVALID_PARAMS, f"unknown tempo_curve {value}")
+
+
+@dataclass
+class ScoreEntry:
+    musicxml_sha256: str
+    parser: ScoreParser
+    parsed: MusicData
+    # timed copies of `parsed`, by beat range (timing starts from the first beat in range), extra start time
+    # and tempo curve. least recently used first
+    timed: OrderedDict[tuple[tuple[float, float] | None, float, TempoCurve], MusicData] = field(
+        default_factory=OrderedDict
+    )
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+class ParseService:
+    """Recently parsed scores, and the methods served on them. Safe to call from many threads at once."""
+
+    def __init__(
+        self,
+        parse_cache: ParseCache | None,
+        max_scores: int = DEFAULT_MAX_SCORES,
+        max_timed_per_score: int = DEFAULT_MAX_TIMED_PER_SCORE,
+    ):
+        self.parse_cache = parse_cache
+        self.max_scores = max_scores
+        # each timed copy is a whole MusicData, and an editor scrubbing through beat ranges makes a new one
+        # per range, so only the most recently used are kept
+        self.max_timed_per_score = max_timed_per_score
+        self._scores: OrderedDict[str, ScoreEntry] = OrderedDict()  # least recently used first
+        self._scores_lock = threading.Lock()
+        # music21 and the chord name cache aren't thread safe, so scores are parsed one at a time.
+        # requests for scores already in memory are still served meanwhile
+        self._parse_lock = threading.Lock()
+        self.methods: dict[str, Callable[..., dict[str, Any]]] = {
+            "parse": self.parse,
+            "timing": self.timing,
+            "export": self.export,
+        }
+
+    def _find_score(self, score: str) -> ScoreEntry | None:
+        with self._scores_lock:
+            entry = self._scores.get(score)
+            if entry is not None:
+                self._scores.move_to_end(score)
+            return entry
+
+    def _get_score(self, score: str) -> ScoreEntry:
+        entry = self._find_score(score)
+        if entry is None:
+            raise ParseServiceError(SERVER_ERROR, f"unknown score {score}, parse it first")
+        return entry
+
+    def parse(self, musicxml_file: str, parser: str = str(ScoreParser.music21)) -> dict[str, Any]:
+        try:
+            score_parser = ScoreParser(parser)
+        except ValueError:
+            raise ParseServiceError(INVALID_PARAMS, f"unknown parser {parser}")
+        try:
+            data = Path(musicxml_file).read_bytes()
+        except OSError as e:
+            raise ParseServiceError(SERVER_ERROR, f"can't read {musicxml_file}: {e}")
+
+        score = compute_cache_key(data, score_parser)
+        entry = self._find_score(score)
+        cached = entry is not None
+        if entry is None:
+            with self._parse_lock:
+                # another request for the same score may have parsed it while this one waited for the lock
+                entry = self._find_score(score)
+                cached = entry is not None
+                if entry is None:
+                    music_data = cached_parse_score_data(data, self.parse_cache, parser=score_parser)
+                    entry = ScoreEntry(musicxml_sha256(data), score_parser, music_data)
+                    with self._scores_lock:
+                        self._scores[score] = entry
+                        while len(self._scores) > self.max_scores:
+                            self._scores.popitem(last=False)
+        return {
+            "score": score,
+            "cached": cached,
+            "chords": len(entry.parsed.chords),
+            "notes": len(entry.parsed.all_notes),
+            "lyrics": len(entry.parsed.lyrics),
+            "keys": len(entry.parsed.keys),
+        }
+
+    def _timed(
+        self,
+        entry: ScoreEntry,
+        beat_range: tuple[float, float] | None,
+        extra_start_time: float,
+        tempo_curve: TempoCurve,
+    ) -> tuple[MusicData, bool]:
+        key = (beat_range, extra_start_time, tempo_curve)
+        with entry.lock:
+            music_data = entry.timed.get(key)
+            if music_data is not None:
+                entry.timed.move_to_end(key)
+                return music_data, True
+            # resolve_timing() modifies in place, and the parsed music data is shared by every request
+            music_data = copy.deepcopy(entry.parsed)
+            if beat_range is not None:
+                music_data = music_data.filter_by_beat_range(*beat_range)
+            resolve_timing(music_data, extra_start_time, tempo_curve)
+            entry.timed[key] = music_data
+            while len(entry.timed) > self.max_timed_per_score:
+                entry.timed.popitem(last=False)
+            return music_data, False
+
+    def timing(
+        self,
+        score: str,
+        beat_range: list[float] | None = None,
+        extra_start_time: float = DEFAULT_EXTRA_START_TIME_SEC,
+        tempo_curve: str = str(DEFAULT_TEMPO_CURVE),
+    ) -> dict[str, Any]:
+        entry = self._get_score(score)
+        _, cached = self._timed(
+            entry,
+            _range_param(beat_range, "beat_range"),
+            _number_param(extra_start_time, "extra_start_time"),
+            _tempo_curve_param(tempo_curve),
+        )
+        return {"score": score, "cached": cached}
+
+    def export(
+        self,
+        score: str,
+        stage: str = "timing",
+        beat_range: list[float] | None = None,
+        time_range: list[float] | None = None,
+        extra_start_time: float = DEFAULT_EXTRA_START_TIME_SEC,
+        tempo_curve: str = str(DEFAULT_TEMPO_CURVE),
+        layout: str = str(ExportLayout.full),
+        compact: bool = False,
+        music_data_file: str | None = None,
+    ) -> dict[str, Any]:
+        entry = self._get_score(score)
+        beat_range_ = _range_param(beat_range, "beat_range")
+        time_range_ = _range_param(time_range, "time_range")
+        try:
+            export_layout = ExportLayout(layout)
+        except ValueError:
+            raise ParseServiceError(INVALID_PARAMS, f"unknown layout {layout}")
+        source = MusicDataSource(
+            musicxml_sha256=entry.musicxml_sha256,
+            parser=str(entry.parser),
+            parser_version=PARSER_VERSION,
+            stage=stage,
+            beat_range=beat_range_,
+        )
+        if stage == "parse_score":
+            if time_range_ is not None:
+                raise ParseServiceError(INVALID_PARAMS, "time_range needs stage timing")
+            music_data = entry.parsed
+            if beat_range_ is not None:
+                music_data = music_data.filter_by_beat_range(*beat_range_)
+        elif stage == "timing":
+            extra_start_time_ = _number_param(extra_start_time, "extra_start_time")
+            tempo_curve_ = _tempo_curve_param(tempo_curve)
+            music_data, _ = self._timed(entry, beat_range_, extra_start_time_, tempo_curve_)
+            if time_range_ is not None:
+                music_data = music_data.filter_by_time_range(*time_range_)
+            source.time_range = time_range_
+            source.extra_start_time_sec = extra_start_time_
+            source.tempo_curve = str(tempo_curve_)
+        else:
+            raise ParseServiceError(INVALID_PARAMS, f"unknown stage {stage}, expected parse_score or timing")
+
+        indent = None if compact else DEFAULT_JSON_INDENT
+        if music_data_file is None:
+            out = io.StringIO()
+            music_data.export_to(out, indent, export_layout, source)
+            return {"music_data": out.getvalue()}
+        path = Path(music_data_file)
+        # written to a temp file first so the editor never reads a partial file
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, "w") as f:
+                music_data.export_to(f, indent, export_layout, source)
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        return {"music_data_file": str(path)}
+
+    def handle(self, line: str) -> str | None:
+        """Response line for a request line, or None for a notification (a request without an id)."""
+        request_id = None
+        try:
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ParseServiceError(PARSE_ERROR, f"invalid JSON: {e}")
+            if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+                raise ParseServiceError(INVALID_REQUEST, "expected an object with a method")
+            request_id = request.get("id")
+            method = self.methods.get(request["method"])
+            if method is None:
+                raise ParseServiceError(METHOD_NOT_FOUND, f"unknown method {request['method']}")
+            params = request.get("params", {})
+            if not isinstance(params, dict):
+                raise ParseServiceError(INVALID_PARAMS, "params must be an object")
+            try:
+                inspect.signature(method).bind(**params)
+            except TypeError as e:
+                # wrong or missing params. a TypeError from inside the method is a bug, reported below
+                raise ParseServiceError(INVALID_PARAMS, str(e))
+            result = method(**params)
+            response: dict[str, Any] = {"jsonrpc": "2.0", "result": result, "id": request_id}
+        except ParseServiceError as e:
+            response = {"jsonrpc": "2.0", "error": {"code": e.code, "message": str(e)}, "id": request_id}
+        except Exception as e:
+            logger.exception("request failed")
+            response = {
+                "jsonrpc": "2.0",
+                "error": {"code": SERVER_ERROR, "message": f"{type(e).__name__}: {e}"},
+                "id": request_id,
+            }
+        if request_id is None and "result" in response:
+            return None
+        return json.dumps(response)
+
+
+def serve_stdio(service: ParseService, workers: int, stdin: TextIO, stdout: TextIO) -> None:
+    """Serve requests from `stdin` until it closes. Requests run concurrently, so responses may come out of order."""
+    write_lock = threading.Lock()
+
+    def respond(line: str) -> None:
+        response = service.handle(line)
+        if response is not None:
+            with write_lock:
+                stdout.write(response + "\n")
+                stdout.flush()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for line in stdin:
+            if line.strip():
+                pool.submit(respond, line)
+
+
+class _ServiceRequestHandler(socketserver.StreamRequestHandler):
+    server: "ParseServiceServer"
+
+    def handle(self) -> None:
+        # one client connection, requests on it are answered in order
+        for line in self.rfile:
+            line = line.decode("utf-8")
+            if not line.strip():
+                continue
+            response = self.server.service.handle(line)
+            if response is not None:
+                self.wfile.write((response + "\n").encode("utf-8"))
+                self.wfile.flush()
+
+
+class ParseServiceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serves a ParseService on a unix socket, each client connection on its own thread."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: Path, service: ParseService):
+        self.service = service
+        if socket_path.is_socket():
+            if _socket_answers(socket_path):
+                raise ParseServiceError(SERVER_ERROR, f"a parse service is already running on {socket_path}")
+            # a socket file left behind by a server that didn't shut down cleanly
+            socket_path.unlink()
+        super().__init__(str(socket_path), _ServiceRequestHandler)
+
+
+def _socket_answers(socket_path: Path) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(str(socket_path))
+        except (ConnectionRefusedError, FileNotFoundError):
+            return False
+    return True
+
+
+class ParseServiceClient:
+    """Minimal client, standing in for the Godot side. One request at a time per client."""
+
+    def __init__(self, socket_path: Path = DEFAULT_SOCKET_PATH):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(str(socket_path))
+        self._file = self._socket.makefile("rwb")
+        self._next_id = 0
+
+    def call(self, method: str, **params) -> dict[str, Any]:
+        self._next_id += 1
+        request = {"jsonrpc": "2.0", "method": method, "params": params, "id": self._next_id}
+        self._file.write((json.dumps(request) + "\n").encode("utf-8"))
+        self._file.flush()
+        response = json.loads(self._file.readline())
+        if "error" in response:
+            raise ParseServiceError(response["error"]["code"], response["error"]["message"])
+        return response["result"]
+
+    def close(self) -> None:
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self) -> "ParseServiceClient":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog="harmonimation-parse-service",
+        description="Keep music21 and recently parsed scores loaded, serving parse/timing/export requests as JSON-RPC",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        '--stdio',
+        action='store_true',
+        help="Serve requests on stdin/stdout instead of a unix socket",
+    )
+    parser.add_argument(
+        '--socket',
+        type=Path,
+        help="Unix socket path to serve requests on",
+        default=DEFAULT_SOCKET_PATH,
+    )
+    parser.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        help="Number of requests to work on at once (--stdio only, socket clients each get their own thread)",
+        default=4,
+    )
+    parser.add_argument(
+        '--max-scores',
+        type=int,
+        help="Number of parsed scores to keep in memory; least recently used ones are dropped past this",
+        default=DEFAULT_MAX_SCORES,
+    )
+    parser.add_argument(
+        '--max-timed-per-score',
+        type=int,
+        help="Number of timed copies (one per beat range, extra start time and tempo curve) to keep per score; "
+        "least recently used ones are dropped past this",
+        default=DEFAULT_MAX_TIMED_PER_SCORE,
+    )
+    parser.add_argument(
+        '--no-parse-cache',
+        action='store_true',
+        help="Don't read or write the on-disk parse cache, only keep scores in memory",
+    )
+    parser.add_argument(
+        '--parse-cache-dir',
+        type=Path,
+        help="Directory for cached parse results, keyed by musicxml content hash",
+        default=DEFAULT_PARSE_CACHE_DIR,
+    )
+    parser.add_argument(
+        '--parse-cache-max-mb',
+        type=float,
+        help="Maximum total size of the parse cache; least recently used entries are evicted past this",
+        default=DEFAULT_PARSE_CACHE_MAX_MB,
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    parse_cache = (
+        None
+        if args.no_parse_cache
+        else ParseCache(args.parse_cache_dir, int(args.parse_cache_max_mb * 1024 * 1024))
+    )
+    service = ParseService(parse_cache, args.max_scores, args.max_timed_per_score)
+
+    if args.stdio:
+        # stdout carries the responses, so anything else printed (e.g. music21 warnings) goes to stderr
+        protocol_out = sys.stdout
+        sys.stdout = sys.stderr
+        logger.info("serving on stdin/stdout")
+        serve_stdio(service, args.workers, sys.stdin, protocol_out)
+        return
+
+    try:
+        server = ParseServiceServer(args.socket, service)
+    except ParseServiceError as e:
+        logger.error(e)
+        sys.exit(1)
+    with server:
+        logger.info(f"serving on {args.socket}, ctrl+c to stop")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            args.socket.unlink(missing_ok=True)
+
+
+def _test_parse_service(score_path: Path = Path(__file__).parent.parent / "test_scores" / "My Time.musicxml"):
+    from import_json import music_data_from_json
+
+    service = ParseService(parse_cache=None)
+    service.methods["broken"] = lambda: len(None)
+    socket_path = Path(tempfile.mkdtemp()) / "parse.sock"
+    server = ParseServiceServer(socket_path, service)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        # a second server doesn't take the socket of a running one
+        try:
+            ParseServiceServer(socket_path, ParseService(parse_cache=None))
+            assert False, "a second server started on a socket in use"
+        except ParseServiceError as e:
+            assert e.code == SERVER_ERROR
+        with ParseServiceClient(socket_path) as client:
+            parsed = client.call("parse", musicxml_file=str(score_path))
+            assert not parsed["cached"] and parsed["notes"] > 0
+            assert client.call("parse", musicxml_file=str(score_path)) == {**parsed, "cached": True}
+            score = parsed["score"]
+
+            # exports match main.py's
+            music_data = copy.deepcopy(service._get_score(score).parsed)
+            resolve_timing(music_data)
+            exported = client.call("export", score=score)["music_data"]
+            assert json.loads(exported)["source"]["stage"] == "timing"
+            assert music_data_from_json(json.loads(exported))[0].export() == music_data.export()
+            assert client.call("timing", score=score) == {"score": score, "cached": True}
+
+            # errors come back as errors, and the connection stays usable
+            for method, params, code in (
+                ("nope", {}, METHOD_NOT_FOUND),
+                ("export", {"score": "nope"}, SERVER_ERROR),
+                ("export", {"score": score, "stage": "animate"}, INVALID_PARAMS),
+                ("timing", {"score": score, "beat_range": [1]}, INVALID_PARAMS),
+                ("timing", {"score": score, "extra_start_time": "2"}, INVALID_PARAMS),
+                ("timing", {"score": score, "tempo_curve": "cubic"}, INVALID_PARAMS),
+                ("parse", {"file": "x"}, INVALID_PARAMS),
+                ("broken", {}, SERVER_ERROR),
+            ):
+                try:
+                    client.call(method, **params)
+                    assert False, f"{method} {params} should have failed"
+                except ParseServiceError as e:
+                    assert e.code == code, f"{method} {params}: {e.code} {e}"
+
+        # concurrent clients, each with their own beat range
+        def export_range(beat_start: int) -> str:
+            with ParseServiceClient(socket_path) as client:
+                return client.call("export", score=score, beat_range=[beat_start, beat_start + 16], compact=True)[
+                    "music_data"
+                ]
+
+        def expected_export(beat_start: int) -> str:
+            entry = service._get_score(score)
+            music_data = copy.deepcopy(entry.parsed).filter_by_beat_range(beat_start, beat_start + 16)
+            resolve_timing(music_data)
+            source = MusicDataSource(
+                musicxml_sha256=entry.musicxml_sha256,
+                parser=str(entry.parser),
+                parser_version=PARSER_VERSION,
+                stage="timing",
+                beat_range=(float(beat_start), float(beat_start + 16)),
+                extra_start_time_sec=float(DEFAULT_EXTRA_START_TIME_SEC),
+                tempo_curve=str(DEFAULT_TEMPO_CURVE),
+            )
+            out = io.StringIO()
+            music_data.export_to(out, None, ExportLayout.full, source)
+            return out.getvalue()
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(export_range, range(0, 64, 8)))
+        for beat_start, result in zip(range(0, 64, 8), results):
+            assert result == expected_export(beat_start), f"beat range from {beat_start} differs"
+        # only the most recently used timed copies are kept
+        assert len(service._get_score(score).timed) == DEFAULT_MAX_TIMED_PER_SCORE
+    finally:
+        server.shutdown()
+        server.server_close()
+        socket_path.unlink(missing_ok=True)
+
+    # but does take over a socket file that nothing answers on any more
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+        stale.bind(str(socket_path))
+    ParseServiceServer(socket_path, ParseService(parse_cache=None)).server_close()
+    socket_path.unlink()
+
+    # concurrent parses of a score not in memory yet parse it once
+    service = ParseService(parse_cache=None)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        parses = list(pool.map(lambda _: service.parse(str(score_path)), range(4)))
+    assert sum(not p["cached"] for p in parses) == 1
+
+    # stdio
+    stdin = io.StringIO(
+        json.dumps({"jsonrpc": "2.0", "method": "parse", "params": {"musicxml_file": str(score_path)}, "id": 1})
+        + "\n{not json\n"
+    )
+    stdout = io.StringIO()
+    serve_stdio(ParseService(parse_cache=None), 2, stdin, stdout)
+    responses = {r["id"]: r for r in map(json.loads, stdout.getvalue().splitlines())}
+    assert responses[1]["result"]["score"] == score
+    assert responses[None]["error"]["code"] == PARSE_ERROR
+
+
+# _test_parse_service()
+
+
+if __name__ == "__main__":
+    main()
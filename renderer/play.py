@@ -3,7 +3,7 @@ from manim.typing import *
 
 config.disable_caching = True
 
-from utils import point_at_angle, Anchor
+from manim_utils import point_at_angle, Anchor
 
 
 class CreateCircle(Scene):
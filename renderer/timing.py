@@ -1,39 +1,355 @@
+from bisect import bisect_right
+from dataclasses import dataclass
+from enum import Enum
+from heapq import merge
+from itertools import chain
+from math import ceil, exp, log
+
 from music21.common.types import OffsetQL
 
-from musicxml import MusicData, MusicDataTiming
+from musicxml import MusicData, MusicDataTiming, TempoRamp
 
-# TODO: make configurable
+# silence before the first beat, see main.py --extra-start-time
 DEFAULT_EXTRA_START_TIME_SEC = 2  # seconds
+# points per quarter note of the seconds-so-far table of each tempo ramp, see RampTable.
+# interpolating between them is off by well under 0.1ms even for a ramp doubling its tempo within a beat
+RAMP_TABLE_STEPS_PER_QUARTER = 32
+
+
+def _numpy():
+    # imported on first use, so the entry points don't load numpy until timing starts
+    # (see DEFERRED_PACKAGES in import_benchmark.py)
+    import numpy
+
+    return numpy
+
+
+class TempoCurve(Enum):
+    """How the tempo goes from one bpm to the next over an accel. or rit. (see MusicData.tempo_ramps)."""
+
+    # the bpm changes by the same amount every beat
+    linear = "linear"
+    # the bpm changes by the same ratio every beat
+    exponential = "exponential"
+
+    def __str__(self):
+        return self.name
+
+    def bpm_at(self, beat: float, length: float, start_bpm: float, end_bpm: float) -> float:
+        if self == TempoCurve.linear:
+            return start_bpm + (end_bpm - start_bpm) * beat / length
+        return start_bpm * (end_bpm / start_bpm) ** (beat / length)
+
+    def secs_at(self, beat: float, length: float, start_bpm: float, end_bpm: float) -> float:
+        """Seconds from the start of a ramp `length` beats long to `beat` beats into it, i.e. the integral of
+        60 / bpm over [0, beat]."""
+        if start_bpm == end_bpm:
+            return beat * 60 / start_bpm
+        if self == TempoCurve.linear:
+            slope = (end_bpm - start_bpm) / length
+            return 60 / slope * log(self.bpm_at(beat, length, start_bpm, end_bpm) / start_bpm)
+        rate = log(end_bpm / start_bpm) / length
+        return 60 / (start_bpm * rate) * (1 - exp(-rate * beat))
+
+
+DEFAULT_TEMPO_CURVE = TempoCurve.linear
+
+
+@dataclass
+class RampTable:
+    """Seconds since the start of a tempo ramp, at evenly spaced beats across it.
+    Converting either way is then interpolating between two neighbouring points, so sec_to_beat() undoes
+    beat_to_sec() exactly (up to rounding)."""
+
+    beats: list[float]  # since the start, from 0 to the ramp's length
+    secs: list[float]
+    end_bpm: float
+
+    @staticmethod
+    def of(length: float, start_bpm: float, end_bpm: float, curve: TempoCurve) -> "RampTable":
+        steps = max(ceil(length * RAMP_TABLE_STEPS_PER_QUARTER), 1)
+        beats = [length * i / steps for i in range(steps + 1)]
+        return RampTable(
+            beats=beats,
+            secs=[curve.secs_at(beat, length, start_bpm, end_bpm) for beat in beats],
+            end_bpm=end_bpm,
+        )
+
+    @property
+    def length(self) -> float:
+        return self.beats[-1]
+
+    def beat_to_sec(self, beat: float) -> float:
+        return _interpolate(beat, self.beats, self.secs)
+
+    def sec_to_beat(self, sec: float) -> float:
+        return _interpolate(sec, self.secs, self.beats)
+
+
+def _interpolate(x: float, xs: list[float], ys: list[float]) -> float:
+    # same arithmetic as np.interp, so scalar and array conversions agree
+    idx = min(max(bisect_right(xs, x) - 1, 0), len(xs) - 2)
+    slope = (ys[idx + 1] - ys[idx]) / (xs[idx + 1] - xs[idx])
+    return slope * (x - xs[idx]) + ys[idx]
+
+
+@dataclass
+class TempoMap:
+    """Seconds at each beat of a piece whose tempo changes.
+    From offsets[i] (until offsets[i + 1]) the tempo is bpms[i], or ramps from it along ramps[i] if that isn't None,
+    and offsets[i] is at secs[i] seconds."""
+
+    offsets: list[OffsetQL]  # offsets[0] is 0
+    bpms: list[float]  # quarter notes per minute
+    secs: list[float]
+    ramps: list[RampTable | None]
+
+    @staticmethod
+    def from_tempos(
+        bpm: float,
+        tempos: "list[MusicDataTiming[float]]",
+        extra_start_time_sec: float = DEFAULT_EXTRA_START_TIME_SEC,
+        tempo_ramps: "list[MusicDataTiming[TempoRamp]]" = (),
+        tempo_curve: TempoCurve = DEFAULT_TEMPO_CURVE,
+    ) -> "TempoMap":
+        """`bpm` until the first of `tempos` (see MusicData.bpm / MusicData.tempos / MusicData.tempo_ramps)."""
+        tempo_map = TempoMap(offsets=[0.0], bpms=[bpm], secs=[extra_start_time_sec], ramps=[None])
+        # a mark and a ramp at the same offset: the ramp starts from the mark's tempo
+        changes = merge(
+            ((timing.offset, 0, timing) for timing in tempos),
+            ((timing.offset, 1, timing) for timing in tempo_ramps),
+            key=lambda change: change[:2],
+        )
+        for offset, _, timing in changes:
+            tempo_map._end_ramp_before(offset)
+            if isinstance(timing.elem, TempoRamp):
+                tempo_map._add_ramp(offset, timing.elem, tempo_curve)
+            elif offset <= tempo_map.offsets[-1]:
+                # set at the start (or before it, for filtered music data), so in effect from the start
+                tempo_map.bpms[-1] = timing.elem
+                tempo_map.ramps[-1] = None
+            else:
+                tempo_map._add_segment(offset, timing.elem, None)
+        tempo_map._end_ramp_before(float("inf"))
+        return tempo_map
+
+    @staticmethod
+    def of(
+        music_data: MusicData,
+        extra_start_time_sec: float = DEFAULT_EXTRA_START_TIME_SEC,
+        tempo_curve: TempoCurve = DEFAULT_TEMPO_CURVE,
+    ) -> "TempoMap":
+        return TempoMap.from_tempos(
+            music_data.bpm, music_data.tempos, extra_start_time_sec, music_data.tempo_ramps, tempo_curve
+        )
+
+    def _add_segment(self, offset: OffsetQL, bpm: float, ramp: RampTable | None) -> None:
+        if offset <= self.offsets[-1]:
+            self.bpms[-1] = bpm
+            self.ramps[-1] = ramp
+            return
+        self.secs.append(self.beat_to_sec(offset))
+        self.offsets.append(offset)
+        self.bpms.append(bpm)
+        self.ramps.append(ramp)
 
+    def _end_ramp_before(self, offset: OffsetQL) -> None:
+        # the tempo a ramp reaches holds from its end until the next change
+        ramp = self.ramps[-1]
+        if ramp is not None and self.offsets[-1] + ramp.length < offset:
+            self._add_segment(self.offsets[-1] + ramp.length, ramp.end_bpm, None)
 
-def resolve_timing(music_data: MusicData) -> None:  # modify in place
-    # TODO: maybe some smart way of finding all MusicDataTiming objects in MusicData?
-    for timing in music_data.all_notes:
-        _set_timing_sec(timing)
-    for part_timings in music_data.all_notes_by_part.values():
-        for timing in part_timings:
-            _set_timing_sec(timing)
-    # TODO: set timing on bpm
-    for timing in music_data.chords:
-        _set_timing_sec(timing)
+    def _add_ramp(self, offset: OffsetQL, ramp: TempoRamp, tempo_curve: TempoCurve) -> None:
+        start = self.offsets[-1]
+        start_bpm = self.bpm_at(offset)
+        length = float(ramp.quarterLength)
+        if offset < start:
+            # started before the start (of filtered music data): the rest of the ramp, along the same curve
+            if offset + length <= start:
+                self.bpms[-1] = ramp.bpm
+                self.ramps[-1] = None
+                return
+            start_bpm = tempo_curve.bpm_at(start - offset, length, start_bpm, ramp.bpm)
+            length -= start - offset
+            offset = start
+        self._add_segment(offset, start_bpm, RampTable.of(length, start_bpm, ramp.bpm, tempo_curve))
+
+    def _segment_of(self, beat: OffsetQL) -> int:
+        # offsets before the start take the first tempo too
+        return max(bisect_right(self.offsets, beat) - 1, 0)
+
+    def bpm_at(self, beat: OffsetQL) -> float:
+        segment = self._segment_of(beat)
+        ramp = self.ramps[segment]
+        if ramp is None or beat <= self.offsets[segment]:
+            return self.bpms[segment]
+        # only used to start a ramp during another one, so worked out from the table's slope
+        idx = min(bisect_right(ramp.beats, beat - self.offsets[segment]) - 1, len(ramp.beats) - 2)
+        return 60 * (ramp.beats[idx + 1] - ramp.beats[idx]) / (ramp.secs[idx + 1] - ramp.secs[idx])
+
+    def beat_to_sec(self, beat: OffsetQL) -> float:
+        segment = self._segment_of(beat)
+        ramp = self.ramps[segment]
+        if ramp is not None and beat >= self.offsets[segment]:
+            return ramp.beat_to_sec(beat - self.offsets[segment]) + self.secs[segment]
+        bps = self.bpms[segment] / 60
+        return (beat - self.offsets[segment]) / bps + self.secs[segment]
+
+    def sec_to_beat(self, sec: float) -> float:
+        """Inverse of beat_to_sec()."""
+        segment = max(bisect_right(self.secs, sec) - 1, 0)
+        ramp = self.ramps[segment]
+        if ramp is not None and sec >= self.secs[segment]:
+            return ramp.sec_to_beat(sec - self.secs[segment]) + self.offsets[segment]
+        bps = self.bpms[segment] / 60
+        return (sec - self.secs[segment]) * bps + self.offsets[segment]
+
+    def beats_to_secs(self, beats):
+        """beat_to_sec() of every beat in a numpy array, as an array."""
+        np = _numpy()
+
+        offsets = np.array(self.offsets, dtype=np.float64)
+        secs = np.array(self.secs, dtype=np.float64)
+        # offsets before the start take the first tempo too
+        segment = np.maximum(np.searchsorted(offsets, beats, side="right") - 1, 0)
+        bps = np.array(self.bpms, dtype=np.float64)[segment] / 60
+        result = (beats - offsets[segment]) / bps + secs[segment]
+        for idx, ramp in enumerate(self.ramps):
+            if ramp is not None:
+                in_ramp = (segment == idx) & (beats >= offsets[idx])
+                result[in_ramp] = np.interp(beats[in_ramp] - offsets[idx], ramp.beats, ramp.secs) + secs[idx]
+        return result
+
+    def secs_to_beats(self, secs):
+        """sec_to_beat() of every second in a numpy array, as an array."""
+        np = _numpy()
+
+        offsets = np.array(self.offsets, dtype=np.float64)
+        starts = np.array(self.secs, dtype=np.float64)
+        segment = np.maximum(np.searchsorted(starts, secs, side="right") - 1, 0)
+        bps = np.array(self.bpms, dtype=np.float64)[segment] / 60
+        result = (secs - starts[segment]) * bps + offsets[segment]
+        for idx, ramp in enumerate(self.ramps):
+            if ramp is not None:
+                in_ramp = (segment == idx) & (secs >= starts[idx])
+                result[in_ramp] = np.interp(secs[in_ramp] - starts[idx], ramp.secs, ramp.beats) + offsets[idx]
+        return result
+
+
+def resolve_timing(
+    music_data: MusicData,
+    extra_start_time_sec: float = DEFAULT_EXTRA_START_TIME_SEC,
+    tempo_curve: TempoCurve = DEFAULT_TEMPO_CURVE,
+) -> TempoMap:  # modify in place
+    """Set the time of everything in `music_data`, and return the tempo map the times came from."""
+    # filtered MusicData only has views of its source's timings, which can't be set
+    music_data.materialize()
+    tempo_map = TempoMap.of(music_data, extra_start_time_sec, tempo_curve)
+    # the notes of each part are (normally) the same timings as in all_notes, so they're left for last,
+    # and only the ones still without a time after everything else is timed are timed again.
+    # cheaper than telling them apart by id()
+    part_timings = list(chain.from_iterable(music_data.all_notes_by_part.values()))
+    for timing in part_timings:
+        timing.time = None
     # TODO: set timing on comments
-    for timing in music_data.lyrics:
-        _set_timing_sec(timing)
-        for lyric_syllable in timing.elem:
-            _set_timing_sec(lyric_syllable)
-    for timing in music_data.keys:
-        _set_timing_sec(timing)
-    for timing in music_data.chord_roots:
-        _set_timing_sec(timing)
-
-
-def _beat_to_sec(beat: OffsetQL) -> float:
-    # TODO: handle changing BPM
-    bpm = 180  # TODO: actually parse from music_data!
-    bps = bpm / 60
-    second = beat / bps
-    return second + DEFAULT_EXTRA_START_TIME_SEC
-
-
-def _set_timing_sec(timing: MusicDataTiming) -> None:  # modify in place
-    timing.time = _beat_to_sec(timing.offset)
+    _set_timing_secs(
+        list(
+            chain(
+                music_data.all_notes,
+                music_data.tempos,
+                music_data.tempo_ramps,
+                music_data.chords,
+                music_data.lyrics,
+                chain.from_iterable(word.elem for word in music_data.lyrics),
+                music_data.keys,
+                music_data.chord_roots,
+            )
+        ),
+        tempo_map,
+    )
+    _set_timing_secs([timing for timing in part_timings if timing.time is None], tempo_map)
+    return tempo_map
+
+
+def _set_timing_secs(timings: list[MusicDataTiming], tempo_map: TempoMap) -> None:  # modify in place
+    if not timings:
+        return
+    np = _numpy()
+    # every offset at once, then every time back to its timing
+    offsets = np.array([timing.offset for timing in timings], dtype=np.float64)
+    for timing, sec in zip(timings, tempo_map.beats_to_secs(offsets).tolist()):
+        timing.time = sec
+
+
+def _test_tempo_map():
+    tempo_map = TempoMap.from_tempos(
+        120,
+        [
+            MusicDataTiming(elem=60.0, offset=0),  # replaces the default
+            MusicDataTiming(elem=120.0, offset=4),
+            MusicDataTiming(elem=30.0, offset=8),
+        ],
+        extra_start_time_sec=1,
+    )
+    assert tempo_map.offsets == [0.0, 4, 8]
+    assert tempo_map.secs == [1, 5, 7]
+    beats = [-1, 0, 2, 4, 6, 8, 9]
+    assert [tempo_map.beat_to_sec(b) for b in beats] == [0, 1, 3, 5, 6, 7, 9]
+    assert [tempo_map.sec_to_beat(s) for s in [0, 1, 3, 5, 6, 7, 9]] == beats
+
+    import numpy as np
+
+    assert tempo_map.beats_to_secs(np.array(beats, dtype=np.float64)).tolist() == [0, 1, 3, 5, 6, 7, 9]
+    assert tempo_map.secs_to_beats(np.array([0, 1, 3, 5, 6, 7, 9], dtype=np.float64)).tolist() == beats
+
+
+# _test_tempo_map()
+
+
+def _test_tempo_ramps():
+    import numpy as np
+
+    tempos = [MusicDataTiming(elem=60.0, offset=0), MusicDataTiming(elem=120.0, offset=8)]
+    # accel. from 60 to 120 over beats [4, 8]
+    ramps = [MusicDataTiming(elem=TempoRamp(quarterLength=4, bpm=120.0), offset=4)]
+    for curve in TempoCurve:
+        tempo_map = TempoMap.from_tempos(60, tempos, 0, ramps, curve)
+        assert tempo_map.offsets == [0.0, 4, 8]
+        # the ramp's table is exact at its points, and interpolated between them
+        for beat in np.linspace(4, 8, 101).tolist():
+            exact = 4 + curve.secs_at(beat - 4, 4, 60, 120)
+            assert abs(tempo_map.beat_to_sec(beat) - exact) < 1e-4, (curve, beat)
+        # 4 beats at 60 and 120 take 4s and 2s, and the ramp between
+        ramp_secs = tempo_map.secs[2] - tempo_map.secs[1]
+        assert 2 < ramp_secs < 4
+        expected_ramp_secs = 240 * log(2) / 60 if curve == TempoCurve.linear else 60 * 4 / (60 * log(2)) * 0.5
+        assert abs(ramp_secs - expected_ramp_secs) < 1e-12, (curve, ramp_secs)
+        assert tempo_map.beat_to_sec(10) == tempo_map.secs[2] + 1
+
+        beats = np.linspace(-1, 12, 1301)
+        secs = tempo_map.beats_to_secs(beats)
+        assert np.all(np.diff(secs) > 0)
+        assert np.allclose(secs, [tempo_map.beat_to_sec(b) for b in beats.tolist()], rtol=0, atol=1e-12)
+        # exact inverse, both ways
+        assert np.allclose(tempo_map.secs_to_beats(secs), beats, rtol=0, atol=1e-9)
+        assert all(abs(tempo_map.sec_to_beat(s) - b) < 1e-9 for s, b in zip(secs.tolist(), beats.tolist()))
+
+        # the same piece filtered from beat 6 (half way through the ramp) keeps its times, just shifted
+        filtered = TempoMap.from_tempos(
+            60,
+            [MusicDataTiming(elem=60.0, offset=-6), MusicDataTiming(elem=120.0, offset=2)],
+            0,
+            [MusicDataTiming(elem=TempoRamp(quarterLength=4, bpm=120.0), offset=-2)],
+            curve,
+        )
+        later = np.linspace(6, 12, 61)
+        assert np.allclose(
+            filtered.beats_to_secs(later - 6), tempo_map.beats_to_secs(later) - tempo_map.beat_to_sec(6), atol=1e-6
+        )
+
+    # a ramp with no mark after it holds its tempo once it's done
+    tempo_map = TempoMap.from_tempos(60, [], 0, ramps)
+    assert tempo_map.offsets == [0.0, 4, 8] and tempo_map.bpms == [60, 60, 120.0]
+
+
+# _test_tempo_ramps()
@@ -1,33 +1,12 @@
-from typing import Any, TypeVar, Iterable, Iterator, Optional
+from typing import Any, Callable, TypeVar, Iterable, Iterator, Optional
+from bisect import bisect_left
 from fractions import Fraction
-import math
-import numpy as np
 from dataclasses import dataclass
+from functools import cached_property
 
-from manim import (
-    Mobject,
-    Group,
-    Scene,
-    VDict,
-    PI,
-    Animation,
-    Wait,
-    Succession,
-    Circle,
-    TAU,
-    ManimColor,
-    ParsableManimColor,
-    Dot,
-    WHITE,
-    VGroup,
-    RED,
-    AnimationGroup,
-    Text,
-    Create,
-)
-from manim.typing import Point3D
 from music21.base import Music21Object
 from music21.chord import Chord
+from music21.harmony import Harmony
 from music21.interval import Interval
 from music21.key import Key
 from music21.note import Note, NotRest
@@ -38,7 +17,9 @@ from music21.duration import Duration
 from regex import Match
 
 from constants import USE_LATEX
-from music import music_constants
+from music import chord_table, music_constants
+from music.key_mask import KeyMask
+from music.records import ChordRecord, KeyRecord, PitchRecord
 
 # print(f"{USE_LATEX=}")
 
@@ -75,6 +56,18 @@ def frange(
         start += step
 
 
+def slice_sorted(
+    items: list[T],
+    start: Any,
+    end: Any,
+    key: Callable[[T], Any] | None = None,
+) -> list[T]:
+    """Items with `start <= key(item) < end`, for a list already sorted by `key`."""
+    lo = bisect_left(items, start, key=key)
+    hi = bisect_left(items, end, lo=lo, key=key)
+    return items[lo:hi]
+
+
 def eq_unique(it: Iterable[T]) -> list[T]:
     uniquelist = []
     for obj in it:
@@ -91,166 +84,9 @@ def generate_group(start: int, step: int, size: int) -> list[int]:
     return stable_unique((start + i * step) % size for i in range(size))
 
 
-# --------------------MANIM HELPERS--------------------
-
-
-def callback_add_to_group(group: Group, object: Mobject):
-    def callback(_: Scene) -> None:
-        group.add(object)
-
-    return callback
-
-
-def callback_add_to_vdict(vdict: VDict, index: Any, object: Mobject):
-    def callback(_: Scene) -> None:
-        vdict[index] = object
-
-    return callback
-
-
-def point_at_angle(circle: Circle, angle: float) -> Point3D:
-    proportion = (angle) / TAU
-    proportion -= np.floor(proportion)
-    return circle.point_from_proportion(proportion)
-
-
-class AnimateProperty(Animation):
-    """Animate one propert of a Mobject.
-    This is preferable to `.animate.set_<property>() as it can coexist with other Animations because it doesn't Animate other properties."""
-
-    property_name: str
-    initial_value: Any # TODO: typevar
-    final_value: Any
-    _initial_value_fetched = False
-
-    def __init__(
-            self,
-            mobject: Mobject,
-            property_name: str,
-            final_value: Any,
-            **kwargs
-    ):
-        super().__init__(mobject, **kwargs)
-        self.property_name = property_name
-        self.final_value = final_value
-
-    def interpolate_mobject(self, alpha: float):
-        # TODO: try to find a better way to do this
-
-        if not self._initial_value_fetched:
-            self.initial_value = self.mobject.__getattr__('get_' + self.property_name)()
-            self._initial_value_fetched = True
-
-        interpolated_value: Any = None
-        if isinstance(self.final_value, ManimColor):
-            interpolated_value = ManimColor.interpolate(self.initial_value, self.final_value, alpha)
-        else:
-            raise NotImplementedError()
-        self.mobject.__getattr__('set_' + self.property_name)(interpolated_value)
-
-class TimestampedAnimationSuccession(Succession):
-    """Given a list of animations which should each end at a particular time,
-    create a Succession of all of them separated by Wait animations."""
-
-    def __init__(
-        self,
-        anims: list[
-            tuple[float, Animation]
-        ],  # list[end_timestamp: second, anim: Animation]
-        transition_time: float,
-        **kwargs,
-    ):
-        # build a sequence of animations to play - waits followed by rotations
-        sequenced_anims: list[Animation] = []
-        # previous_pitch_class: int = get_ionian_root(music_data.keys[0].elem).pitchClass
-        previous_time: float = 0
-
-        for anim_timestamp, anim in anims:
-
-            # print(
-            #     f"TimestampedAnimationSuccession step:\n\t{previous_time=}\n\t{anim_timestamp}, {anim}"
-            # )
-
-            # fiture out how long since last update
-            assert anim_timestamp > previous_time
-            elapsed_time = anim_timestamp - previous_time
-
-            # if we don't have time to do a full wait-then-transition
-            if elapsed_time <= transition_time:
-                # just animate with the time we have
-                anim.run_time = elapsed_time
-                sequenced_anims.append(anim)
-            else:
-                # sleep until start of time when we need to transform
-                sequenced_anims.append(Wait(elapsed_time - transition_time))
-                anim.run_time = transition_time
-                sequenced_anims.append(anim)
-            # done processing this animation
-            previous_time = anim_timestamp
-
-        super().__init__(sequenced_anims, **kwargs)
-
-
-class Anchor(Dot):
-
-    def __init__(
-        self,
-        point: Point3D,
-        fill_opacity: float = 0,
-        *args,
-        **kwargs,
-    ):
-        super().__init__(*args, point=point, fill_opacity=fill_opacity, **kwargs)
-
-    def add_follower(self, mobject: Mobject) -> "Anchor":
-        def follow_anchor(follower: Mobject):
-            anchor_pos = self.get_center()[0:2]
-            follower_before_pos = follower.get_center()[0:2]
-            follower.move_to(self)
-            # some debug stuff iunno
-            if '_debug_anchor' in dir(follower):
-                follower_after_pos = follower.get_center()[0:2]
-                print(
-                    f"follow_anchor({follower}):\n\t       anchor: {anchor_pos}\n\tfollow_before: {follower_before_pos}\n\t follow_after: {follower_after_pos}"
-                )
-
-        mobject.add_updater(follow_anchor, call_updater=True)
-        return self
-
-
-class LabelledCircle(VGroup):
-
-    def __init__(self, circle_color=RED, text="Circle", **kwargs):
-        VGroup.__init__(self, **kwargs)
-        self.circle_color = circle_color
-        self.circle = Circle(color=circle_color)
-        self.text = Text(text=text)
-        self.add(self.circle)
-        self.add(self.text)
-
-    def create(self):
-        return AnimationGroup(Create(self.circle), Create(self.text), lag_ratio=0.5)
-
-
-class testLabelledCircle(Scene):
-    def construct(self):
-        circle = LabelledCircle()
-        self.play(circle.create(), run_time=2)
-        self.wait(1)
-
-
 # --------------------MATH HELPERS--------------------
 
 
-# TODO: use Circle.point_at_angle?
-def vector_on_unit_circle(t: float):
-    return np.array([math.cos(2 * PI * t), math.sin(2 * PI * t), 0])
-
-
-def vector_on_unit_circle_clockwise_from_top(t: float):
-    return vector_on_unit_circle(1 / 4 - t)
-
-
 def pick_preferred_rotation(start_angle, end_angle) -> float:
     """Pick the shorter rotation from start to end angle (in unit rotations)"""
     angle_diff = (end_angle - start_angle) % 1
@@ -284,12 +120,158 @@ class Music21Timing:
         return m21_obj
 
 
-def get_chord_root(m21_chord: Chord) -> Pitch | None:
+# chord naming only depends on a chord's pitch spelling and bass (plus the symbol, for written-in chords),
+# and songs repeat the same few harmonies, so every chord name/root lookup goes through this cache
+ChordNameKey = tuple[int, str | None, tuple[str, ...], str | None]
+
+
+def chord_name_key(m21_chord: Chord) -> ChordNameKey:
+    """(12-bit pitch class mask, bass, spelled pitch names, chord symbol figure)"""
+    pitches = m21_chord.pitches
+    return (
+        chord_table.pitch_class_mask(pitch.pitchClass for pitch in pitches),
+        m21_chord.bass().name if len(pitches) > 0 else None,
+        tuple(sorted({pitch.name for pitch in pitches})),
+        # a ChordSymbol's root is written in, not found from its pitches (C6 and Am7/C have the same pitches)
+        m21_chord.figure if isinstance(m21_chord, Harmony) else None,
+    )
+
+
+class ChordNaming:
+    """Names of one chord spelling, each computed from the first chord seen with it the first time it's asked for.
+    Roots and qualities come from the precomputed `music.chord_table`."""
+
+    _chord: Chord
+    pitch_class_mask: int
+
+    def __init__(self, m21_chord: Chord, key: ChordNameKey):
+        self._chord = m21_chord
+        self.pitch_class_mask = key[0]
+
+    @cached_property
+    def root_pitch_class(self) -> int | None:
+        if len(self._chord.pitches) == 0:
+            return None
+        if isinstance(self._chord, Harmony):
+            # written-in chord, keep its root
+            return self._chord.root().pitchClass
+        return chord_table.chord_root(
+            self.pitch_class_mask, self._chord.bass().pitchClass
+        )
+
+    @cached_property
+    def root_name(self) -> str | None:
+        return next(
+            (
+                pitch.name
+                for pitch in self._chord.pitches
+                if pitch.pitchClass == self.root_pitch_class
+            ),
+            None,
+        )
+
+    @cached_property
+    def quality(self) -> str | None:
+        """e.g. "Maj7". None if there's no name for it."""
+        if not self._chord.isChord or self.root_pitch_class is None:
+            return None
+        return chord_table.chord_quality(self.pitch_class_mask, self.root_pitch_class)
+
+    @cached_property
+    def display_custom(self) -> str | None:
+        """`display_chord_short_custom()`"""
+        if (
+            not self._chord.isChord
+            or bin(self.pitch_class_mask).count("1") < chord_table.MIN_CHORD_PITCH_CLASSES
+        ):
+            return "no chord"  # TODO: handle other cases
+        if self.quality is None or self.root_name is None:
+            return None
+        return f"{_rich_accidental_replacements.get(self.root_name, self.root_name)}{self.quality}"
+
+    @cached_property
+    def pitched_common_name(self) -> str:
+        return self._chord.pitchedCommonName
+
+    def detach(self) -> None:
+        """Work out every name now and let go of the chord, which may be part of a score that's otherwise done with."""
+        if not hasattr(self, "_chord"):
+            return
+        for name in ("root_pitch_class", "root_name", "quality", "display_custom", "pitched_common_name"):
+            getattr(self, name)
+        del self._chord
+
+
+class ChordNameCache:
+    namings: dict[ChordNameKey, ChordNaming]
+    hits: int
+    misses: int
+
+    def __init__(self):
+        self.namings = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, m21_chord: Chord | ChordRecord) -> ChordNaming | ChordRecord:
+        if isinstance(m21_chord, ChordRecord):
+            # names were worked out when it was detached
+            return m21_chord
+        key = chord_name_key(m21_chord)
+        naming = self.namings.get(key)
+        if naming is None:
+            self.misses += 1
+            naming = self.namings[key] = ChordNaming(m21_chord, key)
+        else:
+            self.hits += 1
+        return naming
+
+    def detach_chords(self) -> None:
+        for naming in self.namings.values():
+            naming.detach()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def __str__(self) -> str:
+        return f"{self.hits}/{self.hits + self.misses} hits ({self.hit_rate:.0%}), {len(self.namings)} distinct chords"
+
+
+CHORD_NAME_CACHE = ChordNameCache()
+
+
+def get_chord_root(m21_chord: Chord | ChordRecord) -> Pitch | PitchRecord | None:
     if m21_chord is None:
         return None
+    if isinstance(m21_chord, ChordRecord):
+        return m21_chord.root
     if len(m21_chord.pitches) == 0:
         return None
-    return m21_chord.root()
+    root_pitch_class = CHORD_NAME_CACHE.get(m21_chord).root_pitch_class
+    # the root is one of this chord's own pitches, to keep its octave
+    return next(
+        (pitch for pitch in m21_chord.pitches if pitch.pitchClass == root_pitch_class),
+        m21_chord.root(),
+    )
+
+
+_key_masks: dict[tuple[str, str], KeyMask] = {}
+
+
+def get_key_mask(m21_key: Key | KeyRecord) -> KeyMask:
+    """Tonic, ionian root and pitch classes of a key, computed once per distinct key."""
+    if isinstance(m21_key, KeyRecord):
+        return m21_key.mask
+    cache_key = (m21_key.tonic.name, m21_key.mode)
+    key_mask = _key_masks.get(cache_key)
+    if key_mask is None:
+        key_mask = _key_masks[cache_key] = KeyMask(
+            tonic=get_key_tonic(m21_key).pitchClass,
+            ionian_root=get_ionian_root(m21_key).pitchClass,
+            mask=chord_table.pitch_class_mask(p.pitchClass for p in m21_key.getPitches()),
+        )
+    return key_mask
 
 
 def get_key_tonic(m21_key: Key) -> Pitch:
@@ -302,115 +284,21 @@ def get_ionian_root(m21_key: Key) -> Pitch:
     return get_key_tonic(m21_key.asKey(mode="ionian"))
 
 
-def display_chord_short_custom(m21_chord: Chord) -> str | None:
-    quality_mapping = {
-        "augmented": "+",
-        "major": "Maj",
-        "minor": "min",
-        "diminished": "dim",
-        "half-diminished": "ø",
-        "full-diminished": "°",
-    }
+def display_chord_short_custom(m21_chord: Chord | ChordRecord) -> str | None:
+    return CHORD_NAME_CACHE.get(m21_chord).display_custom
 
-    if not m21_chord.isChord or len(m21_chord.pitches) < 3:
-        return "no chord"  # TODO: handle other cases
-
-    chord_root = m21_chord.root()
-    chord_root_str = chord_root.name
-    # print(
-    #     f"display_chord_short_custom(): {chord_root=}, {m21_chord.pitches=}, {m21_chord.pitchedCommonName=}"
-    # )
-
-    def steps_above_root(m21_pitch: Pitch = None, pitchClass: int = None) -> int:
-        if m21_pitch is not None:
-            pitchClass = m21_pitch.pitchClass
-        if pitchClass is None:
-            raise ValueError("must provide either pitch or pitchClass")
-        return (pitchClass - chord_root.pitchClass) % 12
-
-    if m21_chord.isTriad():  # 3 notes
-        # print("it's a triad")
-        quality = m21_chord.quality
-        quality_str = quality_mapping.get(quality, quality)
-        return f"{chord_root_str}{quality_str}"
-    # elif m21_chord.isSeventh() or m21_chord.isNinth():  # 4-5 notes
-    # TODO: assume everything else is a 7th or 9th chord
-    else:
-        third_steps = steps_above_root(m21_chord.third)
-        fifth_steps = steps_above_root(m21_chord.fifth)
-        seventh_steps = steps_above_root(m21_chord.seventh)
-        match (third_steps, fifth_steps, seventh_steps):
-            case (4, 7, 11):
-                quality_str = "Maj7"  # major 7
-            case (3, 7, 11):
-                quality_str = "mM7"  # minor-major 7
-            case (4, 7, 10):
-                quality_str = "7"  # dominant
-            case (3, 7, 10):
-                quality_str = "min7"  # minor 7
-            case (3, 6, 10):
-                quality_str = "ø7"  # half-diminished # TODO: or maybe "b5b7"?
-            case (3, 6, 9):
-                quality_str = "°7"  # fully-diminished
-        # print(f"{third_steps=}, {fifth_steps=}, {seventh_steps=}, 7th quality={quality_str}")
-
-        # figure out how to display other pitches in the chord
-        other_pitches = {
-            steps_above_root(pitch): pitch
-            for pitch in m21_chord.pitches
-            if pitch.pitchClass
-            not in (
-                chord_root.pitchClass,
-                m21_chord.third.pitchClass,
-                m21_chord.fifth.pitchClass,
-                m21_chord.seventh.pitchClass,
-            )
-        }
-
-        if len(other_pitches) > 0:
-            # hack for now - handle known cases.
-            # TODO: handle weirder stuff later.
-
-            # handle ninth pitches
-            ninth_pitches = {
-                step: p for step, p in other_pitches.items() if step == 1 or step == 2
-            }
-            # print(f"{other_pitches=}, {ninth_pitches=}")
-            if m21_chord.isNinth() or len(ninth_pitches) == 1:
-                assert (
-                    len(ninth_pitches) == 1
-                )  # TODO: handle sharp ninths later if that's a thing I care about?
-                ninth_steps_above_root, _ = list(ninth_pitches.items())[0]
-                if ninth_steps_above_root == 1:
-                    quality_str += "♭9"
-                elif ninth_steps_above_root == 2:
-                    assert quality_str in ("Maj7", "7", "min7")
-                    quality_str = quality_str.replace("7", "9")
-
-                del other_pitches[ninth_steps_above_root]
-
-            # process remaining extra pitches
-            for step, pitch in other_pitches.items():
-                # add6
-                if step == 9:
-                    quality_str += "add6"
-                else:
-                    # give up, use music21's name
-                    return None
-
-    # Add note name to chord quality
-    return f"{_rich_accidental_replacements.get(chord_root_str, chord_root_str)}{quality_str}"
-
-
-def display_chord_short(m21_chord: Chord) -> str:
+
+def display_chord_short(m21_chord: Chord | ChordRecord) -> str:
+
+    chord_naming = CHORD_NAME_CACHE.get(m21_chord)
 
     # first: try to display a name using my custom logic
-    chord_repr = display_chord_short_custom(m21_chord)
+    chord_repr = chord_naming.display_custom
     if chord_repr is not None:
         return chord_repr
 
     # otherwise, adapt from Music21's names
-    chord_repr = m21_chord.pitchedCommonName
+    chord_repr = chord_naming.pitched_common_name
     replacements = {
         "-major seventh chord": "M7",
         "-minor seventh chord": "m7",
@@ -439,10 +327,12 @@ def display_key(m21_key: Key) -> str:
 
 
 def extract_pitches(m21_notRests: Iterable[NotRest]) -> list[Pitch]:
+    """Distinct pitches of all the notes, low to high.
+    Sorted because a set's order follows hash(), which is seeded differently every run."""
     pitches: set[Pitch] = set()
     for elem in m21_notRests:
         pitches.update(elem.pitches)
-    return pitches
+    return sorted(pitches, key=lambda p: (p.ps, p.nameWithOctave))
 
 
 def copy_timing(m21_to: M21Obj, timing: Music21Timing) -> M21Obj: